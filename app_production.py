@@ -2,191 +2,292 @@
 生產環境版本的電池測試器 Web App
 適用於公開部署
 """
-from flask import Flask, render_template, request, send_file, jsonify
-import pandas as pd
+from flask import Flask, Request, Response, g, render_template, request, send_file, jsonify, stream_with_context, url_for
+import numpy as np
 import os
 import tempfile
-import zipfile
 from werkzeug.utils import secure_filename
-import re
 from datetime import datetime
 import logging
 import gzip
 import base64
 import io
 import gc
+import importlib.util
+import json
+import re
+import shutil
+import time
+import uuid
+from utils import expand_durations, extract_origin_csv, memory_report
+from summary import cycle_summary, step_summary, summary_csv
+from excel import is_excel, is_legacy_excel, iter_excel_chunks
+from ingest import SpoolStream, UploadStream, is_text_upload
+from jobs import JobQueue
+from cache import ResultCache, link_file
+from columnar import encode_columnar
+from preview import METHODS as PREVIEW_METHODS, build_preview
+from colstore import ColumnStore, json_columns, write_store
+from metrics import Metrics, StageTimer, server_timing
+from chunked import CHUNK_ROWS, export_chunks
+from passthrough import passthrough_chunks
+from compression import DEFAULT_LEVEL as COMPRESSION_LEVEL, GzipCompressor
+from zipstream import ZipStream
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
 
 # 設置日誌
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class UploadRequest(Request):
+    """
+    文字格式的上傳檔案在接收時直接交給解析器 (UploadStream)，不再先存到 /tmp 再讀回
+    其他檔案、平行處理模式 (?parallel=1)、背景工作 (/jobs)、超過 CHUNKED_THRESHOLD 的請求
+    以及 DETAIL_WRITER=passthrough 時 (預覽除外) 使用 SpoolStream，
+    超過 UPLOAD_SPILL_THRESHOLD 才會寫入磁碟 (大檔改為分批處理，不在接收時建立完整的欄位)
+    """
+
+    @property
+    def use_pool(self):
+        return app.config['UPLOAD_WORKERS'] > 1 and self.args.get('parallel') == '1'
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if (app.config['STREAM_INGEST'] and is_text_upload(filename) and not self.use_pool and self.path != '/jobs'
+                and (total_content_length or 0) <= app.config['CHUNKED_THRESHOLD']
+                and (app.config['DETAIL_WRITER'] == 'dataframe' or self.path == '/preview')):
+            return UploadStream(filename)
+        return SpoolStream(filename, app.config['UPLOAD_SPILL_THRESHOLD'], SPOOL_FOLDER)
+
 app = Flask(__name__)
+app.request_class = UploadRequest
 
 # 生產環境配置
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'battery_tester_production_key_2024')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-MAX_RESPONSE_SIZE = 4.5 * 1024 * 1024  # 4.5MB Vercel payload limit safeguard
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # 16MB max file size
+app.config['STREAM_INGEST'] = os.environ.get('STREAM_INGEST', '1') == '1'  # 上傳時邊接收邊解析
+app.config['UPLOAD_SPILL_THRESHOLD'] = int(os.environ.get('UPLOAD_SPILL_THRESHOLD', 8 * 1024 * 1024))
+MAX_RESPONSE_SIZE = 4.5 * 1024 * 1024  # 4.5MB Vercel payload limit safeguard (僅限 JSON 回應模式)
+STREAM_CHUNK_ROWS = 100000  # 串流回應每次轉換的列數
+ALLOWED_EXTENSIONS = ('.csv', '.xlsx', '.001')  # .xlsx 以唯讀串流方式逐列讀取 (excel.py)；舊版 .xls 不支援
+PREVIEW_POINTS = 500  # 預覽 (/preview) 每個步驟預設保留的點數
+MAX_PREVIEW_POINTS = 5000
+QUERY_ROWS = 1000  # 欄位儲存查詢 (/store/<id>/rows) 每頁預設列數
+MAX_QUERY_ROWS = 100000
+
+# 多檔平行處理：以 process pool 執行，依「檔案大小 x PEAK_MEMORY_FACTOR」估計峰值記憶體控制同時處理的檔案
+app.config['UPLOAD_WORKERS'] = int(os.environ.get('UPLOAD_WORKERS', os.cpu_count() or 1))
+app.config['MEMORY_BUDGET'] = int(os.environ.get('MEMORY_BUDGET', 768 * 1024 * 1024))
+PEAK_MEMORY_FACTOR = 6.0  # 實測：70MB 的 .001 檔在 JSON 模式下峰值約為檔案大小的 5.3 倍
+
+# 精簡 DataFrame (JSON 與串流模式，預設關閉)：Step name 改為 categorical，數值在 float32 下輸出相同時改為 float32，
+# Step Time / Total Time 改為整數秒 (輸出 CSV 時還原為原本的文字)，輸出內容不變；結果附上各欄位的記憶體用量 ('frame_memory')
+app.config['COMPACT_FRAMES'] = os.environ.get('COMPACT_FRAMES', '0') == '1'
+COMPACT_PEAK_MEMORY_FACTOR = 4.0  # 實測：同一個檔案約為 3.8 倍
+
+# 大檔分批處理：超過 CHUNKED_THRESHOLD 的檔案每 CHUNK_ROWS 列轉換一次並直接寫入 gzip CSV，
+# 峰值記憶體取決於 CHUNK_ROWS 而非檔案大小 (實測 CHUNK_ROWS=100000 約 170MB，20000 約 110MB)
+app.config['CHUNKED_THRESHOLD'] = int(os.environ.get('CHUNKED_THRESHOLD', 50 * 1024 * 1024))
+app.config['CHUNK_ROWS'] = int(os.environ.get('CHUNK_ROWS', CHUNK_ROWS))
+CHUNKED_PEAK_MEMORY = 192 * 1024 * 1024  # 分批處理時每個檔案的估計峰值記憶體
+
+# 詳細資料 CSV 的寫出方式 (JSON 與串流模式)：dataframe 先轉成 DataFrame 再以 to_csv 輸出；
+# passthrough 直接沿用原始資料列，只正規化日期 (YYYY-MM-DD) 並附上步驟名稱與秒數欄位，數值保留測試機的原始格式，
+# 不經過 DataFrame，記憶體與分批處理相同 (欄位式輸出 ?format=columnar 仍使用 dataframe)
+# pandas 只在第一次需要 DataFrame 時才載入 (冷啟動不付出載入時間)；passthrough 只需要標準函式庫與 NumPy，
+# 未安裝 pandas 時預設改用 passthrough，欄位式輸出、預覽、背景工作與 /store 的 CSV 匯出則無法使用
+HAS_PANDAS = importlib.util.find_spec('pandas') is not None
+app.config['DETAIL_WRITER'] = os.environ.get('DETAIL_WRITER', 'dataframe' if HAS_PANDAS else 'passthrough')
+if app.config['DETAIL_WRITER'] not in ('dataframe', 'passthrough'):
+    raise ValueError(f"DETAIL_WRITER 必須是 dataframe 或 passthrough: {app.config['DETAIL_WRITER']}")
+
+# gzip 壓縮：parallel 以 COMPRESSION_THREADS 個執行緒平行壓縮 (共用一個 os.cpu_count() 大小的執行緒池；輸出仍是單一標準 gzip member)，zlib 為單執行緒
+# 輸出必須是 gzip：前端以 pako 解壓縮，下載時直接以 Content-Encoding: gzip 送出快取中的壓縮檔
+app.config['COMPRESSION_ENGINE'] = os.environ.get('COMPRESSION_ENGINE', 'parallel')
+app.config['COMPRESSION_LEVEL'] = int(os.environ.get('COMPRESSION_LEVEL', COMPRESSION_LEVEL))
+app.config['COMPRESSION_THREADS'] = int(os.environ.get('COMPRESSION_THREADS', os.cpu_count() or 1))
+compressor = GzipCompressor.from_config(app.config['COMPRESSION_ENGINE'], app.config['COMPRESSION_LEVEL'],
+                                        app.config['COMPRESSION_THREADS'])
+
+# 背景工作 (/jobs)：以執行緒處理，完成後保留 JOB_TTL 秒供查詢與下載
+# 工作狀態存在 JOBS_FOLDER 下的 SQLite 資料庫，多個 gunicorn worker 都查得到 (JOBS_FOLDER 須為共用的本機目錄)
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_TTL'] = int(os.environ.get('JOB_TTL', 3600))
+JOB_CHUNK_SIZE = 1024 * 1024  # 背景工作每次餵給解析器的位元組數 (也是進度更新的間隔)
+
+# 結果快取：以上傳內容的 SHA-256 與 PARSER_VERSION 為 key，超過 RESULT_CACHE_SIZE 時淘汰最久未使用的項目 (0 表示停用)
+app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('RESULT_CACHE_SIZE', 256 * 1024 * 1024))
+CACHE_OUTPUTS = ('detail.csv.gz', 'step.csv.gz')  # 快取項目中的 (詳細資料, 步驟資料)
+COLUMNAR_OUTPUTS = ('detail.bcol', 'step.bcol')  # 背景工作另外快取的欄位式二進位輸出
+CYCLE_OUTPUT = 'cycle.csv.gz'  # 檔案含 "$" 迴圈標記時另外快取的每圈統計
+
+# 效能指標：記錄各處理階段 (接收、解析、建立 DataFrame、CSV、gzip、base64...) 的耗時與位元組數，
+# 於 /upload 回應的 Server-Timing 標頭回報，並彙整在 /metrics (Prometheus 文字格式)。關閉時不記錄任何資料
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+metrics = Metrics(app.config['METRICS_ENABLED'])
 
 # 確保資料夾存在
 # 在 Vercel 等 Serverless 環境中，通常只能寫入 /tmp 目錄
 UPLOAD_FOLDER = '/tmp/uploads'
 PROCESSED_FOLDER = '/tmp/processed'
+SPOOL_FOLDER = '/tmp/spool'  # 超過門檻的上傳檔與平行處理的暫存輸出
+JOBS_FOLDER = '/tmp/jobs'  # 背景工作的輸出，每個工作一個子資料夾
+JOBS_DATABASE = 'jobs.sqlite3'  # JOBS_FOLDER 下的工作狀態資料庫 (jobs.JobStore)
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
+os.makedirs(SPOOL_FOLDER, exist_ok=True)
+os.makedirs(JOBS_FOLDER, exist_ok=True)
+# 兩種寫出方式的輸出格式不同，各自使用一個快取資料夾
+CACHE_FOLDER = os.path.join(PROCESSED_FOLDER, 'cache' if app.config['DETAIL_WRITER'] == 'dataframe' else 'cache-passthrough')
+result_cache = ResultCache(CACHE_FOLDER, app.config['RESULT_CACHE_SIZE'])
 
-def convert_to_seconds(row):
-    """將時間字串轉換為秒數"""
-    try:
-        hours, minutes, seconds = map(float, row.split(":"))
-        total_seconds = float(hours) * 3600 + float(minutes) * 60 + float(seconds)
-        return total_seconds
-    except Exception as e:
-        logger.error(f"Error processing row: {row}, Error: {e}")
-        return None
-
-def get_n_cols(fpath: str):
+def load_battery_frames(file_path, upload=None, timer=None, compact=False, with_loops=False):
     """
-    Get the number of columns
+    解析檔案並回傳 (詳細資料, 步驟資料) 兩個 DataFrame
+    upload 為上傳時已邊接收邊解析的 UploadStream，此時 file_path 只用來命名輸出
+    timer (StageTimer) 記錄 parse 與 dataframe 兩個階段的耗時
+    compact 時建立精簡 DataFrame (ColumnBuilder.to_dataframe(compact=True))，須以 iter_csv 輸出
+    with_loops 時另外回傳 "$" 迴圈標記 (OriginParser.loop_list)：(詳細資料, 步驟資料, 迴圈標記)
     """
-    f = open(fpath, 'r')
-    for line in f.readlines():
-        row = line.strip().rsplit(",")
-        if len(row) > 0 and row[0] == "System Time":
-            return len(row)
-    return 0
+    logger.info(f"開始處理檔案: {file_path}")
+    timer = timer or StageTimer(enabled=False)
+    
+    # 檢查檔案大小，如果太大可能導致超時
+    file_size = upload.bytes_received if upload is not None else os.path.getsize(file_path)
+    if file_size > 50 * 1024 * 1024: # 50MB
+        logger.warning(f"檔案過大 ({file_size/1024/1024:.2f} MB)，可能會導致處理超時")
 
-def is_match_date_string(ds: str):
-    pattern = r"^\d{2}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}$"
-    if re.match(pattern, ds):
-        return True
-    return False
+    with timer.stage('parse', file_size):
+        if upload is not None:
+            columns, steps = upload.result()
+        else:
+            columns, steps = extract_origin_csv(file_path)
+    
+    # 建立 DataFrame (直接使用解析器產生的型別化欄位，不再經過 read_csv)
+    if len(columns) == 0:
+        raise Exception("無法從檔案中提取有效數據，請確認檔案內容。")
+    started = time.perf_counter()
+    df = columns.to_dataframe(compact=compact)
+    loops = columns.loops
+    del columns
 
-def extract_origin_csv(fpath: str):
-    """
-    處理承德充放電機CSV檔案格式 (優化版)
-    避免使用 list 儲存所有 rows 以減少記憶體佔用
-    """
-    last_time_per_step_list = []
-    step_name = "Unknown"
-    n_cols = get_n_cols(fpath=fpath)
-    is_reading_protocol = False
+    df = df.dropna(subset=["System Time"]) # Ensure valid date
+    
+    # 使用 loc 以配合 test.ipynb 的邏輯 (注意：如果 steps 包含 -1，這裡可能會出錯，但為了保持與 notebook 一致先這樣改)
+    # 前提是 steps 索引必須有效
+    # notebook 中是 step_df = df.loc[steps]
     
-    # 使用 StringIO 作為緩衝區
-    csv_buffer = io.StringIO()
-    row_count = 0
+    # 為了避免 crash，我們過濾掉負值索引 (notebook 中如果有 -1 應該也會錯，除非資料特性讓它剛好避開)
+    # 但既然使用者要求一致，我們先嘗試直接 filter 掉顯然錯誤的索引，或者假設 notebook 正確
+    # 這裡我們保留最小限度的保護：只取有效的索引
+    valid_steps = [s for s in steps if s in df.index]
+    step_df = df.loc[valid_steps]
+    timer.add('dataframe', time.perf_counter() - started)
+    
+    logger.info(f"處理完成: {len(df)} 行資料, {len(step_df)} 個步驟")
+    if with_loops:
+        return df, step_df, loops
+    return df, step_df
 
-    try:
-        # 嘗試多種編碼
-        encodings = ['utf-8', 'cp950', 'latin1']
-        file_iterator = None
-        
-        for encoding in encodings:
-            try:
-                with open(fpath, 'r', encoding=encoding) as f:
-                    f.read(1024) 
-                file_iterator = open(fpath, 'r', encoding=encoding)
-                break
-            except UnicodeDecodeError:
-                continue
-        
-        if file_iterator is None:
-            file_iterator = open(fpath, 'r', encoding='utf-8', errors='replace')
+def output_names(file_path, extension='.csv'):
+    """輸出檔名 (詳細資料, 步驟資料)"""
+    filename_head = os.path.basename(file_path).split(".")[0]
+    return f"{filename_head}_detail{extension}", f"{filename_head}_step{extension}"
 
-        try:
-            for line in file_iterator:
-                stripped_line = line.strip()
-                if not stripped_line:
-                    continue
+def cycle_name(file_path):
+    """每圈統計的輸出檔名"""
+    return f"{os.path.basename(file_path).split('.')[0]}_cycle.csv"
 
-                if stripped_line.startswith(("%", "@", "Label", "$", "System Time", "Start Time")):
-                    row = stripped_line.rsplit(",")
-                    
-                    if len(row) > 0 and row[0] == "Label":
-                         is_reading_protocol = True
-                    elif is_reading_protocol: # Previous logic had this check slightly different, adapting
-                         if len(row) > 2:
-                            step_name = row[2]
-                         is_reading_protocol = False
-                         
-                    # Re-implementing the exact logic from original function but with efficient parsing
-                    if is_reading_protocol and len(row) >= 3 and row[0] == "" and row[1] == "": # Wait, strict logic check
-                        pass # The original logic was line-based state machine.
-                    
-                    # Original logic revisited:
-                    # if len(row) > 0 and row[0].startswith(...):
-                    #    if len(row) == 5 and row[0] == "Label": is_reading_protocol = True
-                    #    elif len(row) == 2 and row[0] == '%': last_time_per_step_list.append(...)
-                    
-                    # But wait, step_name was extracted when?
-                    # Original:
-                    # if is_reading_protocol:
-                    #    step_name = row[2]
-                    #    is_reading_protocol = False
-                    
-                    if len(row) == 5 and row[0] == "Label":
-                        is_reading_protocol = True
-                    elif len(row) == 2 and row[0] == '%':
-                        last_time_per_step_list.append(row_count - 1)
-                elif is_reading_protocol:
-                     # This handle the line AFTER "Label"
-                     row = stripped_line.rsplit(",")
-                     if len(row) > 2:
-                        step_name = row[2]
-                     is_reading_protocol = False
-                else:
-                    if stripped_line[0].isdigit(): # Simple check for date
-                        row = stripped_line.rsplit(",")
-                        if len(row) == n_cols and is_match_date_string(row[0]):
-                            csv_buffer.write(f"{stripped_line},{step_name}\n")
-                            row_count += 1
-        finally:
-             if file_iterator:
-                file_iterator.close()
+def iter_csv(df, chunk_rows=STREAM_CHUNK_ROWS):
+    """逐批將 DataFrame 轉成 CSV 文字 (精簡 DataFrame 的時間欄位逐批還原為文字)"""
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield expand_durations(df.iloc[start:start + chunk_rows]).to_csv(index=False, header=(start == 0))
 
-        last_time_per_step_list.append(row_count - 1)
-        csv_buffer.seek(0)
-        
-        return csv_buffer, last_time_per_step_list
-    
-    except Exception as e:
-        logger.error(f"Error processing file {fpath}: {e}")
-        raise Exception("此檔案並非'承德充放電機'檔案格式，請確認選擇檔案。")
+def iter_gzip_csv(df, chunk_rows=STREAM_CHUNK_ROWS):
+    """逐批將 DataFrame 轉成 CSV 並以 gzip 壓縮輸出，不需要在記憶體中保留完整的壓縮結果"""
+    yield from compressor.iter_compress(text.encode('utf-8') for text in iter_csv(df, chunk_rows))
 
-def process_battery_data(file_path, output_folder):
-    """完整的電池資料處理函數"""
-    try:
-        logger.info(f"開始處理檔案: {file_path}")
-        
-        # 檢查檔案大小，如果太大可能導致超時
-        file_size = os.path.getsize(file_path)
-        if file_size > 50 * 1024 * 1024: # 50MB
-            logger.warning(f"檔案過大 ({file_size/1024/1024:.2f} MB)，可能會導致處理超時")
+def write_gzip_csv(df, path):
+    """將 DataFrame 以 gzip CSV 寫入 path"""
+    with open(path, 'wb') as f:
+        for chunk in iter_gzip_csv(df):
+            f.write(chunk)
 
-        rows, steps = extract_origin_csv(file_path)
-        
-        # 建立 DataFrame (Optimized)
-        try:
-            # rows now is a StringIO buffer
-            col_names = ["System Time", "Step Time", "V", "I", "T", "R", "P", "mAh", "Wh", "Total Time", "Step name"]
-            df = pd.read_csv(rows, names=col_names, header=None)
-            
-            # Close buffer
-            rows.close()
-            del rows
-            gc.collect()
-            
-        except Exception as e:
-             logger.error(f"DataFrame creation failed: {e}")
-             return False, "無法從檔案中提取有效數據，請確認檔案內容。"
+def cycle_output(df, step_df, loops, timer):
+    """
+    每圈 (cycle) 統計 (summary.step_summary / cycle_summary) 的 gzip CSV；檔案沒有 "$" 迴圈標記時回傳 None
+    依步驟結束列做分段彙總，上萬圈也只需數毫秒
+    """
+    if not loops:
+        return None
+    with timer.stage('summary') as stage:
+        data = cycle_gzip(step_summary(df, step_df.index, loops))
+        stage['bytes'] = len(data)
+    return data
 
-        df["System Time"] = pd.to_datetime(df["System Time"], format="%y/%m/%d %H:%M:%S", errors='coerce')
-        df = df.dropna(subset=["System Time"]) # Ensure valid date
+def cycle_gzip(steps):
+    """每步驟統計 (summary.step_summary 或分批處理的 StepAccumulator 結果) 轉成每圈統計的 gzip CSV"""
+    return compressor.compress(summary_csv(cycle_summary(steps)).encode('utf-8'))
 
-        numeric_cols = ["V", "I", "T", "R", "P", "mAh", "Wh"]
-        for col in numeric_cols:
-             df[col] = pd.to_numeric(df[col], errors='coerce')
-        
-        filename_head = os.path.basename(file_path).split(".")[0]
+def write_temp_store(df, step_df, timer):
+    """
+    將欄位儲存 (colstore.write_store) 寫到 SPOOL_FOLDER 下的暫存資料夾並回傳其路徑，由 add_store 放進結果快取
+    寫入失敗時只記錄警告並回傳 None (不影響 CSV 輸出)
+    """
+    folder = tempfile.mkdtemp(dir=SPOOL_FOLDER)
+    try:
+        with timer.stage('store'):
+            write_store(df, step_df, folder)
+        return folder
+    except Exception as e:
+        logger.warning(f"寫入欄位儲存失敗: {e}")
+        shutil.rmtree(folder, ignore_errors=True)
+        return None
+
+def add_store(writer, result):
+    """將結果的暫存欄位儲存 ('store_folder') 加入快取項目，回傳是否有加入"""
+    folder = result.get('store_folder')
+    if not folder:
+        return False
+    for name in os.listdir(folder):
+        writer.add_file(name, os.path.join(folder, name))
+    return True
+
+def process_battery_data(file_path, output_folder, upload=None, columnar=False, timings=False, store=False):
+    """
+    完整的電池資料處理函數
+    columnar 時另外附上欄位式二進位格式 (.bcol)，export_stats 列出各格式的大小 (base64 後) 與編碼時間
+    timings 時結果附上各階段的耗時記錄 ('timings')
+    store 時另外寫出欄位儲存 ('store_folder'，見 write_temp_store)
+    檔案含 "$" 迴圈標記時另外附上每圈 (cycle) 的統計 ('cycle_file', 'cycle_content_b64')
+    """
+    timer = StageTimer(timings)
+    compact = app.config['COMPACT_FRAMES']
+    try:
+        df, step_df, loops = load_battery_frames(file_path, upload, timer, compact, with_loops=True)
+        detail_file, step_file = output_names(file_path)
+        row_counts = (len(df), len(step_df))
+        frame_memory = memory_report(df) if compact else None
+        export_stats = {}
+        cycle_result = {}
+        started = time.perf_counter()
+        cycle_gz = cycle_output(df, step_df, loops, timer)
+        if cycle_gz is not None:
+            cycle_b64 = base64.b64encode(cycle_gz).decode('ascii')
+            export_stats['summary'] = {'bytes': len(cycle_b64), 'seconds': round(time.perf_counter() - started, 3)}
+            cycle_result = {'cycle_file': cycle_name(file_path), 'cycle_content_b64': cycle_b64}
+        columnar_result = {}
+        if columnar:
+            started = time.perf_counter()
+            with timer.stage('columnar') as stage:
+                detail_bcol, step_bcol = (base64.b64encode(encode_columnar(frame)).decode('ascii') for frame in (df, step_df))
+                stage['bytes'] = len(detail_bcol) + len(step_bcol)
+            export_stats['columnar'] = {'bytes': len(detail_bcol) + len(step_bcol),
+                                        'seconds': round(time.perf_counter() - started, 3)}
+            columnar_file, step_columnar_file = output_names(file_path, '.bcol')
+            columnar_result = {'detail_columnar_file': columnar_file, 'step_columnar_file': step_columnar_file,
+                               'detail_columnar_b64': detail_bcol, 'step_columnar_b64': step_bcol}
+            del detail_bcol, step_bcol
         
         # 移除寫入磁碟的操作以節省 IO 和空間
         # detail_file_path = os.path.join(output_folder, f"{filename_head}_detail.csv")
@@ -195,58 +296,666 @@ def process_battery_data(file_path, output_folder):
         # step_df = df.loc[steps]
         # step_file_path = os.path.join(output_folder, f"{filename_head}_step.csv")
         # step_df.to_csv(step_file_path, index=False)
-        
-        # 使用 loc 以配合 test.ipynb 的邏輯 (注意：如果 steps 包含 -1，這裡可能會出錯，但為了保持與 notebook 一致先這樣改)
-        # 前提是 steps 索引必須有效
-        # notebook 中是 step_df = df.loc[steps]
-        
-        # 為了避免 crash，我們過濾掉負值索引 (notebook 中如果有 -1 應該也會錯，除非資料特性讓它剛好避開)
-        # 但既然使用者要求一致，我們先嘗試直接 filter 掉顯然錯誤的索引，或者假設 notebook 正確
-        # 這裡我們保留最小限度的保護：只取有效的索引
-        valid_steps = [s for s in steps if s in df.index]
-        step_df = df.loc[valid_steps]
-        
-        logger.info(f"處理完成: {len(df)} 行資料, {len(step_df)} 個步驟")
 
         # 壓縮資料以減少傳輸大小 (解決 Vercel 4.5MB 限制)
-        def compress_data(data_str):
-            try:
-                compressed = gzip.compress(data_str.encode('utf-8'))
+        # 逐批轉成 CSV 並直接壓縮，不保留完整的 CSV 文字 (含中文步驟名稱時 str 約佔 CSV 大小的 2 倍記憶體)
+        def compress_frame(frame):
+            csv_seconds = 0.0
+            nbytes = 0
+
+            def texts():
+                nonlocal csv_seconds, nbytes
+                chunks = iter_csv(frame)
+                while True:
+                    started = time.perf_counter()
+                    text = next(chunks, None)
+                    if text is None:
+                        return
+                    data = text.encode('utf-8')
+                    csv_seconds += time.perf_counter() - started
+                    nbytes += len(data)
+                    yield data
+
+            started = time.perf_counter()
+            compressed = b''.join(compressor.iter_compress(texts()))
+            timer.add('csv', csv_seconds, nbytes)
+            timer.add('gzip', time.perf_counter() - started - csv_seconds, nbytes)
+            with timer.stage('base64', len(compressed)):
                 return base64.b64encode(compressed).decode('ascii')
-            except Exception as e:
-                logger.error(f"壓縮失敗: {e}")
-                return None
-        
-        # 檢查資料大小
-        detail_csv = df.to_csv(index=False)
-        step_csv = step_df.to_csv(index=False)
-        
+
+        started = time.perf_counter()
+        detail_b64 = compress_frame(df)
+        step_b64 = compress_frame(step_df)
+        export_stats['csv'] = {'bytes': len(detail_b64) + len(step_b64),
+                               'seconds': round(time.perf_counter() - started, 3)}
+        store_folder = write_temp_store(df, step_df, timer) if store else None
+
         # 釋放 DataFrame
         del df
         del step_df
         gc.collect()
         
-        detail_b64 = compress_data(detail_csv)
-        step_b64 = compress_data(step_csv)
-        
-        # 釋放 CSV 字串
-        del detail_csv
-        del step_csv
-        gc.collect()
-        
         return True, {
-            'detail_file': f"{filename_head}_detail.csv",
-            'step_file': f"{filename_head}_step.csv",
+            **columnar_result,
+            **cycle_result,
+            'export_stats': export_stats,
+            'detail_file': detail_file,
+            'step_file': step_file,
             'detail_content_b64': detail_b64,
             'step_content_b64': step_b64,
             'total_rows': len(detail_b64) if detail_b64 else 0, # 這裡回傳長度作為參考
-            'step_rows': len(step_b64) if step_b64 else 0
+            'step_rows': len(step_b64) if step_b64 else 0,
+            'row_counts': row_counts,  # 實際列數，供結果快取使用
+            'timings': timer.records,
+            **({'frame_memory': frame_memory} if frame_memory else {}),
+            **({'store_folder': store_folder} if store_folder else {})
         }
         
     except Exception as e:
         logger.error(f"處理檔案失敗: {e}")
         return False, str(e)
 
+def make_upload_job(file):
+    """
+    將上傳檔案整理成處理工作
+    UploadStream 已在接收時解析完成；SpoolStream 的內容 (記憶體中的 data 或落地的檔案) 交給 worker 解析
+    """
+    filename = secure_filename(file.filename)
+    job = {'filename': filename, 'file_path': os.path.join(UPLOAD_FOLDER, filename),
+           'upload': None, 'data': None, 'spool': None, 'digest': None}
+    if isinstance(file.stream, UploadStream):
+        job['upload'] = file.stream
+        job['size'] = file.stream.bytes_received
+        job['digest'] = file.stream.digest
+    elif isinstance(file.stream, SpoolStream):
+        job['spool'] = file.stream
+        job['size'] = file.stream.size
+        job['digest'] = file.stream.digest
+        if file.stream.path is not None:
+            job['file_path'] = file.stream.path
+        else:
+            job['data'] = file.stream.getvalue()
+    else:
+        file.save(job['file_path'])
+        job['size'] = os.path.getsize(job['file_path'])
+    return job
+
+def cleanup_upload_job(job):
+    """清理上傳的原始檔案"""
+    if job['spool'] is not None:
+        job['spool'].cleanup()
+    elif os.path.exists(job['file_path']):
+        os.remove(job['file_path'])
+
+def run_upload_job(file_path, data, output_folder, mode, upload=None, columnar=False, preview=None, timings=False,
+                   store=False):
+    """
+    處理單一檔案 (可在 worker process 中執行)
+    mode 'json'：回傳 process_battery_data 的結果 (columnar 時附上 .bcol)
+    mode 'preview'：回傳每個步驟抽樣後的曲線 (preview 為 build_preview 的參數)
+    mode 'stream'：在 output_folder 寫出 gzip CSV 並回傳路徑；在目前的 process 中執行時直接回傳 DataFrame
+    (檔案含迴圈標記時另外附上每圈統計的 gzip CSV：'cycle_file'、'cycle_gz')
+    timings 時結果附上各階段的耗時記錄 ('timings')
+    store 時 (JSON 與串流模式) 另外寫出欄位儲存 ('store_folder')，由 store_result / stream_upload_response 放進結果快取
+    超過 CHUNKED_THRESHOLD 的檔案 (預覽除外) 以及 DETAIL_WRITER=passthrough (欄位式輸出除外) 改由 run_chunked_job 處理
+    """
+    passthrough = app.config['DETAIL_WRITER'] == 'passthrough' and not columnar
+    if (upload is None and mode != 'preview'
+            and (passthrough or upload_size(file_path, data) > app.config['CHUNKED_THRESHOLD'])):
+        return run_chunked_job(file_path, data, output_folder, mode, timings, store)
+    if upload is None and data is not None:
+        upload = UploadStream(os.path.basename(file_path))
+        try:
+            for chunk in iter_upload_chunks(file_path, data):
+                upload.write(chunk)
+        except Exception as e:
+            logger.error(f"讀取檔案失敗: {e}")
+            return False, f"無法讀取檔案: {e}"
+    if mode == 'json':
+        return process_battery_data(file_path, output_folder, upload=upload, columnar=columnar, timings=timings,
+                                    store=store)
+
+    timer = StageTimer(timings)
+    try:
+        df, step_df, loops = load_battery_frames(file_path, upload, timer,
+                                                 app.config['COMPACT_FRAMES'] and mode == 'stream', with_loops=True)
+    except Exception as e:
+        logger.error(f"處理檔案失敗: {e}")
+        return False, str(e)
+    if mode == 'preview':
+        with timer.stage('preview'):
+            preview_data = build_preview(df, step_df, **(preview or {}))
+        return True, {'preview': preview_data, 'total_rows': len(df), 'step_rows': len(step_df),
+                      'timings': timer.records}
+    detail_file, step_file = output_names(file_path)
+    result = {'detail_file': detail_file, 'step_file': step_file,
+              'total_rows': len(df), 'step_rows': len(step_df), 'timings': timer.records}
+    cycle_gz = cycle_output(df, step_df, loops, timer)
+    if cycle_gz is not None:
+        result.update(cycle_file=cycle_name(file_path), cycle_gz=cycle_gz)
+    store_folder = write_temp_store(df, step_df, timer) if store else None
+    if store_folder:
+        result['store_folder'] = store_folder
+    if output_folder is None:
+        result['frames'] = (df, step_df)
+        return True, result
+    for key, name, frame in (('detail_path', detail_file, df), ('step_path', step_file, step_df)):
+        result[key] = os.path.join(output_folder, name + '.gz')
+        with timer.stage('gzip') as stage:
+            write_gzip_csv(frame, result[key])
+            stage['bytes'] = os.path.getsize(result[key])
+    return True, result
+
+def upload_size(file_path, data):
+    return len(data) if data is not None else os.path.getsize(file_path)
+
+def run_chunked_job(file_path, data, output_folder, mode, timings=False, store=False):
+    """
+    大檔分批處理 (chunked.export_chunks；DETAIL_WRITER=passthrough 時為 passthrough.passthrough_chunks)：
+    gzip CSV 寫到 output_folder，結果格式與 run_upload_job 相同
+    JSON 模式以及沒有 output_folder 的串流模式寫到暫存資料夾 ('temp_folder')，由呼叫端以 discard_temp_outputs 刪除
+    JSON 模式的詳細資料超過 MAX_RESPONSE_SIZE 時省略 (detail_content_b64 為 None)；columnar 不支援分批處理
+    每圈統計由各批的部分彙總 (summary.StepAccumulator) 合併而成，與 run_upload_job 的結果相同
+    store 時欄位儲存也逐批寫入 (colstore.StoreWriter) SPOOL_FOLDER 下的暫存資料夾 ('store_folder')
+    """
+    timer = StageTimer(timings)
+    size = upload_size(file_path, data)
+    logger.info(f"分批處理大檔: {file_path} ({size/1024/1024:.2f} MB)")
+    temp_folder = None
+    if mode == 'json' or output_folder is None:
+        temp_folder = output_folder = tempfile.mkdtemp(dir=SPOOL_FOLDER)
+    detail_file, step_file = output_names(file_path)
+    detail_path, step_path = (os.path.join(output_folder, name + '.gz') for name in (detail_file, step_file))
+    chunks = iter_upload_chunks(file_path, data)
+    store_folder = tempfile.mkdtemp(dir=SPOOL_FOLDER) if store else None
+
+    started = time.perf_counter()
+    try:
+        if app.config['DETAIL_WRITER'] == 'passthrough':
+            summary = passthrough_chunks(chunks, detail_path, step_path, compressor, summary=True, store=store_folder)
+        else:
+            summary = export_chunks(chunks, detail_path, step_path, app.config['CHUNK_ROWS'], compressor,
+                                    summary=True, store=store_folder)
+    except Exception as e:
+        logger.error(f"處理檔案失敗: {e}")
+        for folder in (temp_folder, store_folder):
+            if folder is not None:
+                shutil.rmtree(folder, ignore_errors=True)
+        return False, str(e)
+    seconds = time.perf_counter() - started
+    stage_seconds = summary['seconds']
+    timer.add('parse', seconds - sum(stage_seconds.values()), size)
+    for stage, stage_time in stage_seconds.items():
+        timer.add(stage, stage_time, summary['csv_bytes'] if stage in ('csv', 'gzip') else 0)
+    logger.info(f"處理完成: {summary['rows']} 行資料, {summary['step_rows']} 個步驟")
+    cycle_gz = None
+    summary_seconds = stage_seconds['summary']
+    if summary['step_summary'] is not None:
+        cycle_started = time.perf_counter()
+        cycle_gz = cycle_gzip(summary['step_summary'])
+        timer.add('summary', time.perf_counter() - cycle_started, len(cycle_gz))
+        summary_seconds += time.perf_counter() - cycle_started
+
+    result = {'detail_file': detail_file, 'step_file': step_file,
+              'total_rows': summary['rows'], 'step_rows': summary['step_rows'],
+              'detail_path': detail_path, 'step_path': step_path, 'temp_folder': temp_folder,
+              'timings': timer.records, **({'store_folder': store_folder} if store_folder else {})}
+    if cycle_gz is not None:
+        result.update(cycle_file=cycle_name(file_path), cycle_gz=cycle_gz)
+    if mode == 'json':
+        with timer.stage('base64'):
+            with open(step_path, 'rb') as f:
+                step_b64 = base64.b64encode(f.read()).decode('ascii')
+            detail_b64 = None
+            if os.path.getsize(detail_path) * 4 / 3 <= MAX_RESPONSE_SIZE:
+                with open(detail_path, 'rb') as f:
+                    detail_b64 = base64.b64encode(f.read()).decode('ascii')
+        result.update({
+            'detail_content_b64': detail_b64, 'step_content_b64': step_b64,
+            'total_rows': len(detail_b64 or ''), 'step_rows': len(step_b64),
+            'row_counts': (summary['rows'], summary['step_rows']),
+            'export_stats': {'csv': {'bytes': len(detail_b64 or '') + len(step_b64),
+                                     'seconds': round(time.perf_counter() - started, 3)}},
+        })
+        if cycle_gz is not None:
+            cycle_b64 = base64.b64encode(result.pop('cycle_gz')).decode('ascii')
+            result['cycle_content_b64'] = cycle_b64
+            result['export_stats']['summary'] = {'bytes': len(cycle_b64), 'seconds': round(summary_seconds, 3)}
+    return True, result
+
+def discard_temp_outputs(result):
+    """刪除 run_chunked_job 的暫存輸出與暫存的欄位儲存"""
+    if isinstance(result, dict):
+        for key in ('temp_folder', 'store_folder'):
+            if result.get(key):
+                shutil.rmtree(result[key], ignore_errors=True)
+
+def cached_result(job, mode):
+    """結果快取命中時，組出與 run_upload_job 相同格式的結果；未命中回傳 None"""
+    timer = metrics.timer()
+    with timer.stage('cache'):
+        entry = result_cache.get(job['digest'])
+        if entry is None:
+            return None
+        logger.info(f"結果快取命中: {job['filename']}")
+        detail_file, step_file = output_names(job['file_path'])
+        detail_path, step_path = (entry.path(name) for name in CACHE_OUTPUTS)
+        if mode == 'json':
+            with open(detail_path, 'rb') as f:
+                detail_b64 = base64.b64encode(f.read()).decode('ascii')
+            with open(step_path, 'rb') as f:
+                step_b64 = base64.b64encode(f.read()).decode('ascii')
+            result = {'detail_file': detail_file, 'step_file': step_file,
+                      'detail_content_b64': detail_b64, 'step_content_b64': step_b64,
+                      'total_rows': len(detail_b64), 'step_rows': len(step_b64),
+                      'row_counts': (entry.meta['total_rows'], entry.meta['step_rows'])}
+        else:
+            result = {'detail_file': detail_file, 'step_file': step_file,
+                      'total_rows': entry.meta['total_rows'], 'step_rows': entry.meta['step_rows'],
+                      'detail_path': detail_path, 'step_path': step_path}
+        cycle_path = entry.path(CYCLE_OUTPUT)
+        if os.path.exists(cycle_path):
+            result['cycle_file'] = cycle_name(job['file_path'])
+            if mode == 'json':
+                with open(cycle_path, 'rb') as f:
+                    result['cycle_content_b64'] = base64.b64encode(f.read()).decode('ascii')
+            else:
+                result['cycle_path'] = cycle_path
+    return True, {**result, 'timings': timer.records}
+
+def add_cycle(writer, result):
+    """將結果的每圈統計 ('cycle_gz' 或 JSON 模式的 'cycle_content_b64') 加入快取項目"""
+    data = result.get('cycle_gz')
+    if data is None and result.get('cycle_content_b64'):
+        data = base64.b64decode(result['cycle_content_b64'])
+    if data is not None:
+        with open(writer.path(CYCLE_OUTPUT), 'wb') as f:
+            f.write(data)
+
+def store_result(job, mode, result):
+    """
+    將處理結果存入結果快取
+    串流模式直接回傳 DataFrame 的結果 ('frames') 由 stream_upload_response 邊送出邊寫入
+    """
+    success, result = result
+    if not success or (mode == 'stream' and 'detail_path' not in result):
+        return
+    if (mode == 'json' and 'detail_path' not in result
+            and not (result.get('detail_content_b64') and result.get('step_content_b64'))):
+        return
+    writer = result_cache.writer(job['digest'])
+    if writer is None:
+        return
+    try:
+        if 'detail_path' in result:
+            for name, key in zip(CACHE_OUTPUTS, ('detail_path', 'step_path')):
+                writer.add_file(name, result[key])
+        else:
+            for name, key in zip(CACHE_OUTPUTS, ('detail_content_b64', 'step_content_b64')):
+                with open(writer.path(name), 'wb') as f:
+                    f.write(base64.b64decode(result[key]))
+        add_cycle(writer, result)
+        if mode == 'json':
+            total_rows, step_rows = result['row_counts']
+        else:
+            total_rows, step_rows = result['total_rows'], result['step_rows']
+        writer.commit({'total_rows': total_rows, 'step_rows': step_rows, 'filename': job['filename'],
+                       **({'store': True} if add_store(writer, result) else {})})
+    except Exception as e:
+        logger.warning(f"寫入結果快取失敗: {e}")
+        writer.abort()
+
+_upload_pool = None
+
+def get_upload_pool():
+    """延遲建立 process pool；環境不支援 multiprocessing (例如部分 Serverless 平台) 時回傳 None"""
+    global _upload_pool
+    if _upload_pool is None and app.config['UPLOAD_WORKERS'] > 1:
+        try:
+            from concurrent.futures import ProcessPoolExecutor
+            _upload_pool = ProcessPoolExecutor(max_workers=app.config['UPLOAD_WORKERS'])
+        except (OSError, NotImplementedError, ImportError) as e:
+            logger.warning(f"無法建立 process pool，改為逐一處理: {e}")
+            app.config['UPLOAD_WORKERS'] = 1
+    return _upload_pool
+
+def discard_upload_pool(pool, error):
+    """
+    worker 異常結束 (例如超過記憶體被 OOM killer 終止) 後 process pool 無法再使用：關閉它，
+    下一個平行處理的請求再重新建立；回傳 None
+    """
+    global _upload_pool
+    if pool is not None:
+        logger.error(f"process pool 已中斷，其餘檔案改為逐一處理: {error}")
+        if _upload_pool is pool:
+            _upload_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+    return None
+
+def run_one_upload_job(job, mode, output_folder, columnar, preview, use_cache, store):
+    """在目前的 process 處理一個上傳工作 (先查結果快取)，回傳 (success, result)"""
+    result = cached_result(job, mode) if use_cache else None
+    if result is None:
+        result = run_upload_job(job['file_path'], job['data'], output_folder, mode, upload=job['upload'],
+                                columnar=columnar, preview=preview, timings=metrics.enabled, store=store)
+        if use_cache:
+            store_result(job, mode, result)
+    return result
+
+def run_upload_jobs(jobs, mode, output_folder, parallel=False, columnar=False, preview=None):
+    """
+    處理所有上傳工作並依上傳順序逐一 yield (job, (success, result))
+    parallel 時分派到 process pool；只有在估計峰值記憶體總和不超過 MEMORY_BUDGET 時才放行下一個檔案
+    (至少保持一個檔案在處理中)。未平行處理時則在取用結果時才處理下一個檔案
+    結果快取命中的檔案不再處理，未命中的處理結果則存入快取 (連同欄位儲存，供 /store 查詢)
+    (快取只有 CSV，因此 columnar 與 preview 模式不使用快取)
+    worker 異常結束時 (BrokenProcessPool) 處理中的檔案回報錯誤，pool 捨棄 (見 discard_upload_pool)，尚未分派的檔案改為逐一處理
+    """
+    use_cache = not columnar and mode != 'preview'
+    store = use_cache and result_cache.enabled
+    pool = get_upload_pool() if parallel and len(jobs) > 1 else None
+    if pool is None:
+        for job in jobs:
+            yield job, run_one_upload_job(job, mode, output_folder, columnar, preview, use_cache, store)
+        return
+
+    budget = app.config['MEMORY_BUDGET']
+    chunked = mode != 'preview'
+    estimates = [CHUNKED_PEAK_MEMORY if chunked and job['size'] > app.config['CHUNKED_THRESHOLD']
+                 else job['size'] * (COMPACT_PEAK_MEMORY_FACTOR if app.config['COMPACT_FRAMES'] and mode != 'preview'
+                                     else PEAK_MEMORY_FACTOR) for job in jobs]
+    if chunked and app.config['DETAIL_WRITER'] == 'passthrough' and not columnar:
+        estimates = [min(estimate, CHUNKED_PEAK_MEMORY) for estimate in estimates]
+    finished = {}
+    for index, job in enumerate(jobs):
+        result = cached_result(job, mode) if use_cache else None
+        if result is not None:
+            finished[index] = result
+    waiting = [index for index in range(len(jobs)) if index not in finished]
+    running = {}
+    in_use = 0
+    next_index = 0
+    try:
+        while next_index < len(jobs):
+            while pool is not None and waiting and (not running or in_use + estimates[waiting[0]] <= budget):
+                job = jobs[waiting[0]]
+                try:
+                    future = pool.submit(run_upload_job, job['file_path'], job['data'], output_folder, mode,
+                                         columnar=columnar, preview=preview, timings=metrics.enabled, store=store)
+                except BrokenProcessPool as e:
+                    pool = discard_upload_pool(pool, e)
+                    break
+                index = waiting.pop(0)
+                running[future] = index
+                in_use += estimates[index]
+
+            if next_index not in finished and not running:
+                # pool 已捨棄：依序在目前的 process 處理 (next_index 是 waiting 中最小的)
+                index = waiting.pop(0)
+                finished[index] = run_one_upload_job(jobs[index], mode, output_folder, columnar, preview,
+                                                     use_cache, store)
+            elif next_index not in finished:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = running.pop(future)
+                    in_use -= estimates[index]
+                    try:
+                        finished[index] = future.result()
+                        if use_cache:
+                            store_result(jobs[index], mode, finished[index])
+                    except BrokenProcessPool as e:
+                        logger.error(f"處理檔案 {jobs[index]['filename']} 時 worker 異常結束: {e}")
+                        finished[index] = (False, "處理程序異常結束 (可能是記憶體不足)，請稍後再試或改為逐一上傳。")
+                        pool = discard_upload_pool(pool, e)
+                    except Exception as e:
+                        logger.error(f"處理檔案 {jobs[index]['filename']} 時發生錯誤: {e}")
+                        finished[index] = (False, str(e))
+
+            while next_index in finished:
+                yield jobs[next_index], finished.pop(next_index)
+                next_index += 1
+    finally:
+        for future in running:
+            future.cancel()
+
+def run_background_job(job, upload_job):
+    """
+    背景工作 (/jobs)：逐塊把上傳內容餵給解析器並回報進度 (已解析位元組、列數、目前階段)
+    結果以 gzip CSV 與欄位式二進位格式 (.bcol) 寫到 JOBS_FOLDER/<job id>/，並記錄兩者的大小與編碼時間
+    """
+    try:
+        output_folder = os.path.join(JOBS_FOLDER, job.id)
+        os.makedirs(output_folder, exist_ok=True)
+        names = output_names(upload_job['filename']) + output_names(upload_job['filename'], '.bcol')
+        paths = [os.path.join(output_folder, name + '.gz') for name in names[:2]]
+        paths += [os.path.join(output_folder, name) for name in names[2:]]
+        cached_names = CACHE_OUTPUTS + COLUMNAR_OUTPUTS
+
+        cycle_file = cycle_name(upload_job['filename'])
+        cycle_path = os.path.join(output_folder, cycle_file + '.gz')
+
+        entry = result_cache.get(upload_job['digest'])
+        if entry is not None and 'export_stats' in entry.meta and entry.meta.get('store'):
+            for cached, path in zip(cached_names, paths):
+                link_file(entry.path(cached), path)
+            if os.path.exists(entry.path(CYCLE_OUTPUT)):
+                link_file(entry.path(CYCLE_OUTPUT), cycle_path)
+                names, paths = names + (cycle_file,), paths + [cycle_path]
+            job.update(bytes_total=upload_job['size'], bytes_parsed=upload_job['size'],
+                       rows=entry.meta['total_rows'], outputs=dict(zip(names, paths)),
+                       details={'export_stats': entry.meta['export_stats'], 'store_id': upload_job['digest']})
+            return
+
+        job.update(stage='parsing', bytes_total=upload_job['size'])
+        upload = UploadStream(upload_job['filename'])
+        for chunk in iter_upload_chunks(upload_job['file_path'], upload_job['data']):
+            upload.write(chunk)
+            # Excel 的進度以轉成文字後的位元組計算，不超過檔案大小
+            job.update(bytes_parsed=min(upload.bytes_received, upload_job['size']), rows=upload.parser.row_count)
+
+        job.update(stage='building')
+        df, step_df, loops = load_battery_frames(upload_job['file_path'], upload, with_loops=True)
+        del upload
+
+        job.update(stage='writing', rows=len(df))
+        export_stats = {}
+        started = time.perf_counter()
+        for path, frame in zip(paths[:2], (df, step_df)):
+            write_gzip_csv(frame, path)
+        export_stats['csv'] = {'bytes': sum(os.path.getsize(path) for path in paths[:2]),
+                               'seconds': round(time.perf_counter() - started, 3)}
+        started = time.perf_counter()
+        for path, frame in zip(paths[2:], (df, step_df)):
+            with open(path, 'wb') as f:
+                f.write(encode_columnar(frame))
+        export_stats['columnar'] = {'bytes': sum(os.path.getsize(path) for path in paths[2:]),
+                                    'seconds': round(time.perf_counter() - started, 3)}
+        cycle_gz = cycle_output(df, step_df, loops, StageTimer(enabled=False))
+        if cycle_gz is not None:
+            with open(cycle_path, 'wb') as f:
+                f.write(cycle_gz)
+            names, paths = names + (cycle_file,), paths + [cycle_path]
+        job.update(outputs=dict(zip(names, paths)), details={'export_stats': export_stats})
+
+        # 快取中既有的項目若缺少 .bcol (由 /upload 建立)，以完整的結果取代
+        # 欄位儲存 (每欄一個 .npy，供 /store/<id>/rows 以 memory map 查詢) 只放在快取項目中
+        writer = result_cache.writer(upload_job['digest'])
+        if writer is not None:
+            try:
+                job.update(stage='indexing')
+                for cached, path in zip(cached_names, paths):
+                    writer.add_file(cached, path)
+                if cycle_gz is not None:
+                    writer.add_file(CYCLE_OUTPUT, cycle_path)
+                write_store(df, step_df, writer.folder)
+                writer.commit({'total_rows': len(df), 'step_rows': len(step_df), 'export_stats': export_stats,
+                               'store': True, 'filename': upload_job['filename']}, replace=True)
+                job.update(details={**job.details, 'store_id': upload_job['digest']})
+            except Exception as e:
+                logger.warning(f"寫入結果快取失敗: {e}")
+                writer.abort()
+    finally:
+        cleanup_upload_job(upload_job)
+
+def remove_job_outputs(job):
+    """工作過期時刪除其輸出"""
+    shutil.rmtree(os.path.join(JOBS_FOLDER, job.id), ignore_errors=True)
+
+job_queue = JobQueue(os.path.join(JOBS_FOLDER, JOBS_DATABASE), app.config['JOB_WORKERS'], app.config['JOB_TTL'],
+                     on_expire=remove_job_outputs)
+
+def iter_file_chunks(path, chunk_size=64 * 1024):
+    """逐塊讀出檔案內容"""
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            yield chunk
+
+def iter_upload_chunks(file_path, data, chunk_size=JOB_CHUNK_SIZE):
+    """
+    逐塊產生要餵給解析器的內容：data 為記憶體中的上傳內容 (None 時讀取 file_path)
+    Excel 檔 (.xlsx) 逐列轉成與文字檔相同的格式
+    """
+    if is_excel(file_path):
+        yield from iter_excel_chunks(io.BytesIO(data) if data is not None else file_path, chunk_size)
+    elif data is not None:
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+    else:
+        yield from iter_file_chunks(file_path, chunk_size)
+
+def upload_error(filename):
+    """不支援的檔案格式回傳錯誤訊息，否則回傳 None"""
+    if is_legacy_excel(filename):
+        return f"{filename}: 不支援舊版 Excel (.xls) 格式，請另存為 .xlsx 或 .csv 後再上傳"
+    if not filename.endswith(ALLOWED_EXTENSIONS):
+        return f"{filename}: 不是有效的檔案格式（支援 .csv, .xlsx, .001）"
+    return None
+
+def multipart_part(headers, body):
+    """multipart/mixed 的單一段落，body 可為 bytes 或逐塊產生 bytes 的 iterator"""
+    head = ''.join(f"{key}: {value}\r\n" for key, value in headers.items())
+    yield head.encode('utf-8') + b"\r\n"
+    if isinstance(body, bytes):
+        yield body
+    else:
+        yield from body
+    yield b"\r\n"
+
+def stream_upload_response(files, parallel=False):
+    """
+    串流回應模式 (/upload?mode=stream)
+    以 multipart/mixed 逐檔回傳：每個檔案先送一段 JSON 說明，接著是 gzip 壓縮的
+    詳細資料與步驟資料 CSV。壓縮結果邊產生邊送出，不受 MAX_RESPONSE_SIZE 限制
+    結果存入快取後再送一段補充的 JSON ('update': true)，帶有 result_id 與 download_urls (與 JSON 模式相同)
+    平行處理時 worker 先把 gzip CSV 寫到 SPOOL_FOLDER，再由這裡依序送出
+    """
+    boundary = uuid.uuid4().hex
+    delimiter = f"--{boundary}\r\n".encode('ascii')
+
+    def json_part(payload):
+        return multipart_part({'Content-Type': 'application/json; charset=utf-8'},
+                              json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+
+    def csv_part(name, chunks):
+        return multipart_part({
+            'Content-Type': 'text/csv; charset=utf-8',
+            'Content-Encoding': 'gzip',
+            'Content-Disposition': f'attachment; filename="{name}"',
+        }, chunks)
+
+    def generate():
+        jobs = []
+        for file in files:
+            if not upload_error(file.filename):
+                jobs.append(make_upload_job(file))
+            else:
+                yield delimiter
+                yield from json_part({'original': file.filename,
+                                      'error': upload_error(file.filename)})
+
+        output_folder = tempfile.mkdtemp(dir=SPOOL_FOLDER) if parallel else None
+        try:
+            for job, (success, result) in run_upload_jobs(jobs, 'stream', output_folder, parallel):
+                cleanup_upload_job(job)
+                filename = job['filename']
+                if not success:
+                    yield delimiter
+                    yield from json_part({'original': filename, 'error': f"{filename}: {result}"})
+                    continue
+                metrics.observe_stages(result.get('timings'))
+
+                yield delimiter
+                yield from json_part({
+                    'original': filename,
+                    'detail_file': result['detail_file'],
+                    'step_file': result['step_file'],
+                    **({'cycle_file': result['cycle_file']} if 'cycle_file' in result else {}),
+                    'total_rows': result['total_rows'],
+                    'step_rows': result['step_rows'],
+                    'message': f"成功處理 {result['total_rows']} 行資料，產生 {result['step_rows']} 個步驟記錄"
+                })
+                writer = None
+                if 'frames' in result:
+                    df, step_df = result.pop('frames')
+                    detail_chunks, step_chunks = iter_gzip_csv(df), iter_gzip_csv(step_df)
+                    writer = result_cache.writer(job['digest'])
+                    if writer is not None:
+                        detail_chunks = writer.tee(CACHE_OUTPUTS[0], detail_chunks)
+                        step_chunks = writer.tee(CACHE_OUTPUTS[1], step_chunks)
+                else:
+                    detail_chunks, step_chunks = iter_file_chunks(result['detail_path']), iter_file_chunks(result['step_path'])
+                try:
+                    yield delimiter
+                    yield from csv_part(result['detail_file'], detail_chunks)
+                    yield delimiter
+                    yield from csv_part(result['step_file'], step_chunks)
+                    del detail_chunks, step_chunks
+                    if 'cycle_file' in result:
+                        yield delimiter
+                        yield from csv_part(result['cycle_file'], [result['cycle_gz']] if 'cycle_gz' in result
+                                            else iter_file_chunks(result['cycle_path']))
+                    if writer is not None:
+                        add_cycle(writer, result)
+                        writer.commit({'total_rows': result['total_rows'], 'step_rows': result['step_rows'],
+                                       'filename': filename, **({'store': True} if add_store(writer, result) else {})})
+                        writer = None
+                finally:
+                    if writer is not None:
+                        writer.abort()
+                    discard_temp_outputs(result)
+                if job['digest'] and result_cache.get(job['digest'], count=False) is not None:
+                    yield delimiter
+                    yield from json_part({
+                        'original': filename, 'update': True, 'result_id': job['digest'],
+                        'download_urls': {key: url_for('cached_result_file', result_id=job['digest'], name=result[key])
+                                          for key in ('detail_file', 'step_file', 'cycle_file') if key in result},
+                    })
+        finally:
+            for job in jobs:
+                cleanup_upload_job(job)
+            if output_folder is not None:
+                shutil.rmtree(output_folder, ignore_errors=True)
+        yield f"--{boundary}--\r\n".encode('ascii')
+
+    return Response(stream_with_context(generate()), mimetype=f'multipart/mixed; boundary={boundary}')
+
+@app.before_request
+def start_request_timer():
+    if metrics.enabled:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """請求數與耗時計入 /metrics；/upload 記錄的處理階段放進 Server-Timing 標頭 (串流回應只計到送出標頭為止)"""
+    if metrics.enabled and 'request_started' in g:
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('http_request_seconds', time.perf_counter() - g.request_started,
+                        'Time until the response headers are ready', endpoint=endpoint)
+        metrics.inc('http_requests_total', 1, 'HTTP requests', endpoint=endpoint, status=str(response.status_code))
+        if g.get('server_timing'):
+            response.headers['Server-Timing'] = server_timing(g.server_timing)
+    return response
+
 @app.route('/')
 def index():
     """主頁面"""
@@ -254,7 +963,11 @@ def index():
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
-    """處理檔案上傳"""
+    """處理檔案上傳 (各階段耗時以 Server-Timing 標頭回報)"""
+    timer = metrics.timer()
+    g.server_timing = timer.records
+    with timer.stage('receive', request.content_length or 0):
+        request.files  # 接收上傳內容 (文字檔邊接收邊解析，因此也包含大部分的解析時間)
     if 'files[]' not in request.files:
         return jsonify({'success': False, 'message': '沒有選擇檔案'})
     
@@ -263,77 +976,300 @@ def upload_files():
     if not files or files[0].filename == '':
         return jsonify({'success': False, 'message': '沒有選擇檔案'})
     
+    if request.args.get('mode') == 'stream':
+        # 串流模式的處理在送出標頭之後才進行，Server-Timing 只有接收階段；其餘階段仍計入 /metrics
+        metrics.observe_stages(timer.records)
+        return stream_upload_response(files, parallel=request.use_pool)
+    
     processed_files = []
     errors = []
     current_response_size = 0
+    columnar = request.args.get('format') == 'columnar'  # 另外附上欄位式二進位格式 (.bcol)
     
+    jobs = []
     for file in files:
-        if file and (file.filename.endswith('.csv') or file.filename.endswith('.xls') or file.filename.endswith('.xlsx') or file.filename.endswith('.001')):
+        if file and not upload_error(file.filename):
             try:
-                # 檢查目前回應大小是否已接近上限
-                if current_response_size > MAX_RESPONSE_SIZE:
-                    errors.append(f"{file.filename}: 略過處理，因為單次請求的總回應大小已達上限 (4.5MB)。請分批上傳。")
-                    continue
-
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(UPLOAD_FOLDER, filename)
-                file.save(file_path)
-                
-                success, result = process_battery_data(file_path, PROCESSED_FOLDER)
+                jobs.append(make_upload_job(file))
+            except Exception as e:
+                logger.error(f"處理檔案 {file.filename} 時發生錯誤: {e}")
+                errors.append(f"{file.filename}: {str(e)}")
+        else:
+            errors.append(upload_error(file.filename))
+    
+    results = run_upload_jobs(jobs, 'json', PROCESSED_FOLDER, parallel=request.use_pool, columnar=columnar)
+    try:
+        for index, (job, (success, result)) in enumerate(results):
+            filename = job['filename']
+            cleanup_upload_job(job)
+            
+            if success:
+                discard_temp_outputs(result)
+                timer.extend(result.get('timings'))
+                # 計算新增的大小
+                detail_len = len(result.get('detail_content_b64', '')) if result.get('detail_content_b64') else 0
+                step_len = len(result.get('step_content_b64', '')) if result.get('step_content_b64') else 0
+                detail_len += len(result.get('detail_columnar_b64') or '')
+                step_len += len(result.get('step_columnar_b64') or '') + len(result.get('cycle_content_b64') or '')
+                total_len = detail_len + step_len
+                extras = {key: result[key] for key in ('detail_columnar_file', 'step_columnar_file', 'detail_columnar_b64',
+                                                       'step_columnar_b64', 'export_stats', 'frame_memory', 'cycle_file',
+                                                       'cycle_content_b64') if key in result}
+                if job['digest'] and result_cache.get(job['digest'], count=False) is not None:
+                    # 結果已在快取中：可由 /results/<result_id>/<檔名> 直接下載 gzip 壓縮檔
+                    extras['result_id'] = job['digest']
+                    extras['download_urls'] = {
+                        key: url_for('cached_result_file', result_id=job['digest'], name=result[key])
+                        for key in ('detail_file', 'step_file', 'cycle_file') if key in result}
                 
-                if success:
-                    # 計算新增的大小
-                    detail_len = len(result.get('detail_content_b64', '')) if result.get('detail_content_b64') else 0
-                    step_len = len(result.get('step_content_b64', '')) if result.get('step_content_b64') else 0
-                    total_len = detail_len + step_len
-                    
-                    if current_response_size + total_len > MAX_RESPONSE_SIZE:
-                        # 如果加上這個檔案會超過限制，則只回傳步驟資料或報錯
-                        if current_response_size + step_len < MAX_RESPONSE_SIZE:
-                             processed_files.append({
-                                'original': filename,
-                                'detail_file': result['detail_file'],
-                                'step_file': result['step_file'],
-                                'detail_content_b64': None, # 省略詳細資料
-                                'step_content_b64': result.get('step_content_b64'),
-                                'message': f"成功處理 (詳細資料過大已省略，僅提供步驟資料)"
-                            })
-                             current_response_size += step_len
-                        else:
-                            errors.append(f"{filename}: 處理成功但結果過大無法回傳。")
-                    else:
-                        processed_files.append({
+                if current_response_size + total_len > MAX_RESPONSE_SIZE:
+                    # 如果加上這個檔案會超過限制，則只回傳步驟資料或報錯
+                    if current_response_size + step_len < MAX_RESPONSE_SIZE:
+                         processed_files.append({
                             'original': filename,
                             'detail_file': result['detail_file'],
                             'step_file': result['step_file'],
-                            'detail_content_b64': result.get('detail_content_b64'),
+                            'detail_content_b64': None, # 省略詳細資料
                             'step_content_b64': result.get('step_content_b64'),
-                            'message': f"成功處理" # 簡化訊息，因為 total_rows 現在是長度
+                            'message': f"成功處理 (詳細資料過大已省略，僅提供步驟資料；請改用串流模式取得完整資料)",
+                            **extras,
+                            **({'detail_columnar_b64': None} if columnar else {})
                         })
-                        current_response_size += total_len
+                         current_response_size += step_len
+                    else:
+                        errors.append(f"{filename}: 處理成功但結果過大無法回傳。")
                 else:
-                    errors.append(f"{filename}: {result}")
-                
-                # 清理上傳的原始檔案
-                os.remove(file_path)
-                
+                    processed_files.append({
+                        'original': filename,
+                        'detail_file': result['detail_file'],
+                        'step_file': result['step_file'],
+                        'detail_content_b64': result.get('detail_content_b64'),
+                        'step_content_b64': result.get('step_content_b64'),
+                        # 簡化訊息，因為 total_rows 現在是長度；分批處理的大檔可能已省略詳細資料
+                        'message': "成功處理" if result.get('detail_content_b64') or not result.get('step_content_b64')
+                                   else "成功處理 (詳細資料過大已省略，僅提供步驟資料；請改用串流模式取得完整資料)",
+                        **extras
+                    })
+                    current_response_size += total_len
+            else:
+                errors.append(f"{filename}: {result}")
+            
+            # 檢查目前回應大小是否已接近上限，剩下的檔案不再處理
+            if current_response_size > MAX_RESPONSE_SIZE:
+                for skipped in jobs[index + 1:]:
+                    errors.append(f"{skipped['filename']}: 略過處理，因為單次請求的總回應大小已達上限 (4.5MB)。請分批上傳。")
+                break
+    finally:
+        results.close()
+        for job in jobs:
+            cleanup_upload_job(job)
+    metrics.observe_stages(timer.records)
+    
+    return jsonify({
+        'success': len(processed_files) > 0,
+        'processed_files': processed_files,
+        'errors': errors
+    })
+
+@app.route('/preview', methods=['POST'])
+def preview_files():
+    """
+    回傳每個步驟抽樣後的 V/I/T 曲線供預覽圖使用，不回傳 CSV
+    參數：points (每個步驟最多保留的點數) 與 method (minmax：保留每個區間的最大最小值；lttb)
+    """
+    if 'files[]' not in request.files:
+        return jsonify({'success': False, 'message': '沒有選擇檔案'})
+
+    files = request.files.getlist('files[]')
+
+    if not files or files[0].filename == '':
+        return jsonify({'success': False, 'message': '沒有選擇檔案'})
+
+    method = request.args.get('method', 'minmax')
+    try:
+        points = min(int(request.args.get('points', PREVIEW_POINTS)), MAX_PREVIEW_POINTS)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'points 必須是整數'})
+    if method not in PREVIEW_METHODS:
+        return jsonify({'success': False, 'message': f"method 必須是 {' 或 '.join(PREVIEW_METHODS)}"})
+
+    previews = []
+    errors = []
+    jobs = []
+    for file in files:
+        if file and not upload_error(file.filename):
+            try:
+                jobs.append(make_upload_job(file))
             except Exception as e:
                 logger.error(f"處理檔案 {file.filename} 時發生錯誤: {e}")
                 errors.append(f"{file.filename}: {str(e)}")
-                try:
-                    if 'file_path' in locals() and os.path.exists(file_path):
-                        os.remove(file_path)
-                except:
-                    pass
         else:
-            errors.append(f"{file.filename}: 不是有效的檔案格式（支援 .csv, .xls, .xlsx, .001）")
-    
+            errors.append(upload_error(file.filename))
+
+    results = run_upload_jobs(jobs, 'preview', None, parallel=request.use_pool,
+                              preview={'points': points, 'method': method})
+    try:
+        for job, (success, result) in results:
+            cleanup_upload_job(job)
+            if success:
+                previews.append({'original': job['filename'], 'total_rows': result['total_rows'],
+                                 'step_rows': result['step_rows'], **result['preview']})
+            else:
+                errors.append(f"{job['filename']}: {result}")
+    finally:
+        results.close()
+        for job in jobs:
+            cleanup_upload_job(job)
+
     return jsonify({
-        'success': len(processed_files) > 0,
-        'processed_files': processed_files,
+        'success': len(previews) > 0,
+        'previews': previews,
         'errors': errors
     })
 
+@app.route('/jobs', methods=['POST'])
+def submit_jobs():
+    """
+    提交背景處理工作，每個檔案一個工作並立即回傳 job id
+    以 GET /jobs/<job_id> 查詢進度，完成後由 /jobs/<job_id>/result/<檔名> 下載結果
+    """
+    if 'files[]' not in request.files:
+        return jsonify({'success': False, 'message': '沒有選擇檔案'})
+
+    files = request.files.getlist('files[]')
+
+    if not files or files[0].filename == '':
+        return jsonify({'success': False, 'message': '沒有選擇檔案'})
+
+    submitted = []
+    errors = []
+    for file in files:
+        if file and not upload_error(file.filename):
+            try:
+                upload_job = make_upload_job(file)
+                job = job_queue.submit(run_background_job, upload_job, original=upload_job['filename'])
+                submitted.append({'original': upload_job['filename'], 'job_id': job.id,
+                                  'status_url': url_for('job_status', job_id=job.id)})
+            except Exception as e:
+                logger.error(f"提交檔案 {file.filename} 時發生錯誤: {e}")
+                errors.append(f"{file.filename}: {str(e)}")
+        else:
+            errors.append(upload_error(file.filename))
+
+    return jsonify({
+        'success': len(submitted) > 0,
+        'jobs': submitted,
+        'errors': errors
+    }), 202 if submitted else 200
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """查詢背景工作的狀態與進度"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': '工作不存在或已過期'}), 404
+    status = job.to_dict()
+    status['results'] = {name: url_for('job_result', job_id=job_id, name=name) for name in status['outputs']}
+    if 'store_id' in status['details']:
+        status['store_url'] = url_for('query_store', store_id=status['details']['store_id'])
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/result/<name>')
+def job_result(job_id, name):
+    """
+    下載背景工作的結果
+    CSV 在用戶端接受 gzip 時直接送出壓縮檔 (Content-Encoding: gzip)，否則邊解壓縮邊送出；.bcol 直接送出
+    """
+    job = job_queue.get(job_id)
+    if job is None or name not in job.outputs:
+        return "檔案不存在", 404
+    path = job.outputs[name]
+    if not path.endswith('.gz'):
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True, download_name=name)
+    return send_gzip_csv(path, name)
+
+def send_gzip_csv(path, name):
+    """
+    送出 gzip CSV：用戶端接受 gzip 時直接送出壓縮檔 (Content-Encoding: gzip，不重新壓縮)，否則邊解壓縮邊送出
+    """
+    if 'gzip' in request.accept_encodings:
+        response = send_file(path, mimetype='text/csv', as_attachment=True, download_name=name)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        def generate():
+            with gzip.open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(64 * 1024), b''):
+                    yield chunk
+        response = Response(generate(), mimetype='text/csv',
+                            headers={'Content-Disposition': f'attachment; filename="{name}"'})
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.route('/results/<result_id>/<name>')
+def cached_result_file(result_id, name):
+    """
+    下載結果快取中的 CSV (result_id 為 /upload 回傳的 result_id)，name 以 _detail.csv / _step.csv / _cycle.csv 結尾
+    快取中存放的是已壓縮的 gzip，因此下載不需要重新處理或壓縮
+    """
+    for suffix, cached in zip(('_detail.csv', '_step.csv', '_cycle.csv'), CACHE_OUTPUTS + (CYCLE_OUTPUT,)):
+        if name.endswith(suffix):
+            break
+    else:
+        return "檔案不存在", 404
+    entry = result_cache.get(result_id, count=False) if re.fullmatch(r'[0-9a-f]{64}', result_id) else None
+    if entry is None or not os.path.exists(entry.path(cached)):
+        return "檔案不存在或已從快取中移除", 404
+    return send_gzip_csv(entry.path(cached), secure_filename(name))
+
+@app.route('/store/<store_id>/rows')
+def query_store(store_id):
+    """
+    查詢欄位儲存 (store_id 為上傳檔案的 SHA-256)：背景工作 (/jobs) 與 /upload 處理的檔案 (包括分批處理的大檔) 都會寫入結果快取
+    以 step=<步驟編號> 或 start / end=<System Time> 選擇資料列 (步驟索引與二分搜尋，不需掃描全部資料)
+    offset、limit 分頁；columns 以逗號選擇欄位；format=csv 時回傳 CSV，否則回傳 JSON
+    """
+    if not re.fullmatch(r'[0-9a-f]{64}', store_id):
+        return jsonify({'success': False, 'message': '資料不存在或已過期'}), 404
+    entry = result_cache.get(store_id, count=False)
+    if entry is None or not ColumnStore.exists(entry.folder):
+        return jsonify({'success': False, 'message': '資料不存在或已過期'}), 404
+    store = ColumnStore(entry.folder)
+
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', QUERY_ROWS)), 0), MAX_QUERY_ROWS)
+        if 'step' in request.args:
+            rows = store.step_rows(int(request.args['step']))
+        else:
+            start, end = (request.args.get(key) for key in ('start', 'end'))
+            rows = store.time_rows(np.datetime64(start.replace(' ', 'T')) if start else None,
+                                   np.datetime64(end.replace(' ', 'T')) if end else None)
+        names = request.args['columns'].split(',') if request.args.get('columns') else store.names
+        unknown = [name for name in names if name not in store.specs]
+        if unknown:
+            raise ValueError(f"沒有這些欄位: {', '.join(unknown)}")
+    except (ValueError, IndexError) as e:
+        return jsonify({'success': False, 'message': f'查詢參數錯誤: {e}'}), 400
+
+    if isinstance(rows, slice):
+        total = rows.stop - rows.start
+        page = slice(min(rows.start + offset, rows.stop), min(rows.start + offset + limit, rows.stop))
+    else:
+        total = len(rows)
+        page = rows[offset:offset + limit]
+    data = store.read(page, names)
+
+    if request.args.get('format') == 'csv':
+        import pandas as pd
+        return Response(pd.DataFrame(data).to_csv(index=False), mimetype='text/csv')
+    return jsonify({
+        'success': True,
+        'total': int(total),
+        'offset': offset,
+        'returned': len(next(iter(data.values()))) if data else 0,
+        'columns': json_columns(data)
+    })
+
 @app.route('/download/<filename>')
 def download_file(filename):
     """下載處理後的檔案"""
@@ -349,29 +1285,55 @@ def download_file(filename):
 
 @app.route('/download_all')
 def download_all():
-    """打包下載所有處理後的檔案"""
-    try:
-        temp_dir = tempfile.mkdtemp()
-        zip_path = os.path.join(temp_dir, 'processed_files.zip')
-        
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for filename in os.listdir(PROCESSED_FOLDER):
-                if filename.endswith('.csv'):
-                    file_path = os.path.join(PROCESSED_FOLDER, filename)
-                    zipf.write(file_path, filename)
-        
-        return send_file(zip_path, as_attachment=True, download_name='battery_test_results.zip')
-    
-    except Exception as e:
-        logger.error(f"打包檔案時發生錯誤: {e}")
-        return f"打包錯誤: {str(e)}", 500
+    """
+    打包下載所有處理後的檔案 (zip)
+    壓縮檔邊建立邊送出，不使用暫存檔：PROCESSED_FOLDER 中的 CSV 即時壓縮，
+    ?id=<result_id> (可重複) 指定的快取結果直接沿用 gzip 檔中的 deflate 資料，不重新壓縮
+    """
+    files = []  # (壓縮檔中的名稱, 路徑, 是否為 gzip)
+    for result_id in request.args.getlist('id'):
+        entry = result_cache.get(result_id, count=False) if re.fullmatch(r'[0-9a-f]{64}', result_id) else None
+        if entry is None:
+            logger.warning(f"打包時找不到快取結果: {result_id}")
+            continue
+        filename = entry.meta.get('filename') or result_id[:12]
+        files += [(name, entry.path(cached), True) for name, cached in zip(output_names(filename), CACHE_OUTPUTS)]
+        if os.path.exists(entry.path(CYCLE_OUTPUT)):
+            files.append((cycle_name(filename), entry.path(CYCLE_OUTPUT), True))
+    for filename in sorted(os.listdir(PROCESSED_FOLDER)):
+        file_path = os.path.join(PROCESSED_FOLDER, filename)
+        if filename.endswith('.csv') and os.path.isfile(file_path):
+            files.append((filename, file_path, False))
+
+    def generate():
+        archive = ZipStream(app.config['COMPRESSION_LEVEL'])
+        used = set()
+        for name, path, gzipped in files:
+            base, ext = os.path.splitext(name)
+            unique, n = name, 1
+            while unique in used:
+                n += 1
+                unique = f"{base} ({n}){ext}"
+            try:
+                yield from (archive.add_gzip(unique, path) if gzipped else archive.add_file(unique, path))
+            except FileNotFoundError:
+                logger.warning(f"打包時檔案已被移除: {name}")  # 檔案在送出前被移除 (例如快取淘汰)，略過
+                continue
+            used.add(unique)
+        yield archive.finish()
+
+    return Response(stream_with_context(generate()), mimetype='application/zip',
+                    headers={'Content-Disposition': 'attachment; filename="battery_test_results.zip"'})
 
 @app.route('/clear')
 def clear_files():
     """清理所有處理後的檔案"""
     try:
+        result_cache.clear()
         for filename in os.listdir(PROCESSED_FOLDER):
-            os.remove(os.path.join(PROCESSED_FOLDER, filename))
+            file_path = os.path.join(PROCESSED_FOLDER, filename)
+            if os.path.isfile(file_path):
+                os.remove(file_path)
         return jsonify({'success': True, 'message': '檔案已清理'})
     except Exception as e:
         logger.error(f"清理檔案時發生錯誤: {e}")
@@ -380,7 +1342,28 @@ def clear_files():
 @app.route('/health')
 def health_check():
     """健康檢查端點"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat(),
+                    'result_cache': result_cache.stats()})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Prometheus 文字格式的指標：各處理階段的耗時分佈與位元組數、請求數與耗時、結果快取統計
+    數值為目前 process 的累計 (gunicorn 多個 worker 時各自獨立)；METRICS_ENABLED=0 時回傳 404
+    """
+    if not metrics.enabled:
+        return "metrics disabled", 404
+    stats = result_cache.stats()
+    gauges = {
+        'result_cache_enabled': (stats['enabled'], 'Whether the result cache is enabled'),
+        'result_cache_entries': (stats['entries'], 'Entries in the result cache'),
+        'result_cache_bytes': (stats['bytes'], 'Bytes used by the result cache'),
+        'result_cache_max_bytes': (stats['max_bytes'], 'Result cache size limit'),
+        'result_cache_hits_total': (stats['hits'], 'Result cache hits'),
+        'result_cache_misses_total': (stats['misses'], 'Result cache misses'),
+        'result_cache_evictions_total': (stats['evictions'], 'Result cache evictions'),
+    }
+    return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5002))
@@ -0,0 +1,342 @@
+"""
+Headless batch converter.
+
+    python batch.py DATA/ "runs/**/*.001" -o converted -j 4
+
+Inputs may be files, directories or glob patterns.  Files are converted on a
+process pool and a summary line (rows, steps, MB/s, peak RSS) is printed as
+each one finishes.  Outputs that are already up to date are skipped, judged
+by modification time or by the SHA-256 of the source (--skip hash).  The exit
+status is 1 when any file failed.
+
+Files above --chunked-threshold MB are converted in batches of rows like the
+web app does (chunked.export_file), so the memory of a worker does not grow
+with the file; --writer passthrough streams every file
+(passthrough.passthrough_file).  --columnar needs the full frames and always
+builds them.
+"""
+import argparse
+import glob
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from chunked import export_file
+from compression import GzipCompressor, PlainWriter
+from excel import EXCEL_EXTENSIONS
+from passthrough import passthrough_file
+from utils import PARSER_VERSION, extract_origin_csv
+
+INPUT_EXTENSIONS = (".csv", ".001") + EXCEL_EXTENSIONS
+OUTPUT_SUFFIXES = ("_detail", "_step")
+MANIFEST_NAME = ".batch_manifest.json"
+HASH_CHUNK_SIZE = 1024 * 1024
+CHUNKED_THRESHOLD = 50 * 1024 * 1024  # Same default as the web app
+WRITERS = ("dataframe", "passthrough")
+DEFAULT_WRITER = "dataframe" if importlib.util.find_spec("pandas") is not None else "passthrough"
+
+
+def expand_inputs(patterns, recursive=False):
+    """
+    Files named by patterns (files, directories or globs), in order and
+    without duplicates.  Converter outputs found in directories are ignored.
+    """
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            walker = os.walk(pattern) if recursive else [(pattern, [], sorted(os.listdir(pattern)))]
+            for folder, _, names in walker:
+                for name in sorted(names):
+                    stem, extension = os.path.splitext(name)
+                    if extension.lower() in INPUT_EXTENSIONS and not stem.endswith(OUTPUT_SUFFIXES):
+                        found.append(os.path.join(folder, name))
+        elif glob.has_magic(pattern):
+            found.extend(path for path in sorted(glob.glob(pattern, recursive=True)) if os.path.isfile(path))
+        else:
+            found.append(pattern)
+
+    seen = set()
+    unique = []
+    for path in found:
+        key = os.path.realpath(path)
+        if key not in seen:
+            seen.add(key)
+            unique.append(path)
+    return unique
+
+
+def output_paths(source, output_folder, gzip_output=False, columnar=False):
+    """
+    Output files of source: detail/step CSV (optionally gzip) and, with
+    columnar, the .bcol pair.
+    """
+    head = os.path.basename(source).split(".")[0]
+    folder = output_folder or os.path.dirname(source)
+    extension = ".csv.gz" if gzip_output else ".csv"
+    paths = [os.path.join(folder, f"{head}{suffix}{extension}") for suffix in OUTPUT_SUFFIXES]
+    if columnar:
+        paths += [os.path.join(folder, f"{head}{suffix}.bcol") for suffix in OUTPUT_SUFFIXES]
+    return paths
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def is_up_to_date(source, outputs, skip, digest=None, manifest=None):
+    if skip == "none" or not all(os.path.exists(path) for path in outputs):
+        return False
+    if skip == "mtime":
+        source_mtime = os.path.getmtime(source)
+        return all(os.path.getmtime(path) >= source_mtime for path in outputs)
+    record = (manifest or {}).get(os.path.basename(outputs[0]))
+    return record == {"sha256": digest, "parser_version": PARSER_VERSION}
+
+
+def convert_file(source, outputs, gzip_output=False, columnar=False, writer=DEFAULT_WRITER,
+                 chunked_threshold=CHUNKED_THRESHOLD):
+    """
+    Convert one file (runs in a worker process) and return its summary.
+    Outputs are written under temporary names and renamed at the end, so an
+    interrupted run never leaves outputs that look up to date.  Files above
+    chunked_threshold bytes, and every file with the passthrough writer, are
+    streamed with bounded memory unless columnar output is asked for.
+    """
+    reset_peak_rss()
+    started = time.perf_counter()
+    summary = {"file": source, "bytes": os.path.getsize(source)}
+    try:
+        temp_paths = [path + ".part" for path in outputs]
+        if not columnar and (writer == "passthrough" or summary["bytes"] > chunked_threshold):
+            rows, steps = stream_outputs(source, temp_paths, gzip_output, writer)
+        else:
+            rows, steps = frame_outputs(source, temp_paths, gzip_output, columnar)
+        for temp_path, path in zip(temp_paths, outputs):
+            os.replace(temp_path, path)
+        summary.update(ok=True, rows=rows, steps=steps)
+    except Exception as e:
+        for path in outputs:
+            if os.path.exists(path + ".part"):
+                os.remove(path + ".part")
+        summary.update(ok=False, error=str(e))
+    summary["seconds"] = time.perf_counter() - started
+    summary["peak_rss"] = peak_rss()
+    return summary
+
+
+def frame_outputs(source, paths, gzip_output=False, columnar=False):
+    """
+    Write the outputs from the full detail and step frames; returns
+    (rows, steps).
+    """
+    columns, steps = extract_origin_csv(source)
+    if len(columns) == 0:
+        raise Exception("無法從檔案中提取有效數據，請確認檔案內容。")
+    df = columns.to_dataframe()
+    del columns
+    df = df.dropna(subset=["System Time"])
+    step_df = df.loc[[s for s in steps if s in df.index]]
+
+    frames = (df, step_df)
+    for path, frame in zip(paths, frames):
+        frame.to_csv(path, index=False, compression="gzip" if gzip_output else None)
+    if columnar:
+        from columnar import encode_columnar
+
+        for path, frame in zip(paths[2:], frames):
+            with open(path, "wb") as f:
+                f.write(encode_columnar(frame))
+    return len(df), len(step_df)
+
+
+def stream_outputs(source, paths, gzip_output=False, writer=DEFAULT_WRITER):
+    """
+    Write the detail and step CSV in batches of rows; returns (rows, steps).
+    """
+    compressor = GzipCompressor() if gzip_output else PlainWriter()
+    if writer == "passthrough":
+        summary = passthrough_file(source, paths[0], paths[1], compressor)
+    else:
+        summary = export_file(source, paths[0], paths[1], compressor=compressor)
+    return summary["rows"], summary["step_rows"]
+
+
+def reset_peak_rss():
+    """
+    Reset the kernel's peak RSS counter (Linux), so pool workers report the
+    peak of the current file rather than of their whole lifetime.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process in bytes (None if unknown).
+    """
+    peak = _proc_status("VmHWM")
+    if peak is not None:
+        return peak
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss():
+    return _proc_status("VmRSS")
+
+
+def _proc_status(field):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def format_summary(summary):
+    name = summary["file"]
+    if summary.get("skipped"):
+        return f"SKIP {name} (up to date)"
+    if not summary["ok"]:
+        return f"FAIL {name}: {summary['error']}"
+    megabytes = summary["bytes"] / 1024 / 1024
+    rate = megabytes / summary["seconds"] if summary["seconds"] > 0 else 0.0
+    peak = f"{summary['peak_rss'] / 1024 / 1024:.1f} MB" if summary["peak_rss"] else "n/a"
+    return (f"OK   {name}: {summary['rows']} rows, {summary['steps']} steps, "
+            f"{megabytes:.2f} MB in {summary['seconds']:.2f} s ({rate:.1f} MB/s), peak RSS {peak}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert tester exports to detail/step CSV files in parallel.")
+    parser.add_argument("inputs", nargs="+", help="files, directories or glob patterns (quote them)")
+    parser.add_argument("-o", "--output", help="output folder (default: next to each input)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    parser.add_argument("-r", "--recursive", action="store_true", help="also search subdirectories")
+    parser.add_argument("--skip", choices=("mtime", "hash", "none"), default="mtime",
+                        help="how to decide that outputs are up to date (default: mtime)")
+    parser.add_argument("--gzip", action="store_true", help="write .csv.gz instead of .csv")
+    parser.add_argument("--columnar", action="store_true", help="also write the .bcol columnar export")
+    parser.add_argument("--json", action="store_true", help="print summaries as JSON lines")
+    parser.add_argument("--writer", choices=WRITERS, default=DEFAULT_WRITER,
+                        help=f"detail CSV writer; passthrough streams every file (default: {DEFAULT_WRITER})")
+    parser.add_argument("--chunked-threshold", type=float, default=CHUNKED_THRESHOLD / 1024 / 1024,
+                        help="files above this many MB are converted in batches of rows (default: %(default)g)")
+    args = parser.parse_args(argv)
+    chunked_threshold = int(args.chunked_threshold * 1024 * 1024)
+
+    sources = expand_inputs(args.inputs, args.recursive)
+    if not sources:
+        print("no input files found", file=sys.stderr)
+        return 1
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    def report(summary):
+        print(json.dumps(summary, ensure_ascii=False) if args.json else format_summary(summary), flush=True)
+
+    failures = 0
+    skipped = 0
+    tasks = []
+    claimed = {}
+    manifests = {}
+    digests = {}
+    for source in sources:
+        outputs = output_paths(source, args.output, args.gzip, args.columnar)
+        if not os.path.isfile(source):
+            failures += 1
+            report({"file": source, "ok": False, "error": "file not found"})
+            continue
+        if outputs[0] in claimed:
+            failures += 1
+            report({"file": source, "ok": False, "error": f"same output name as {claimed[outputs[0]]}"})
+            continue
+        claimed[outputs[0]] = source
+        folder = os.path.dirname(outputs[0])
+        if args.skip == "hash":
+            digests[source] = file_digest(source)
+            if folder not in manifests:
+                manifests[folder] = load_manifest(folder)
+        if is_up_to_date(source, outputs, args.skip, digests.get(source), manifests.get(folder)):
+            skipped += 1
+            report({"file": source, "skipped": True})
+        else:
+            tasks.append((source, outputs))
+
+    started = time.perf_counter()
+    total_bytes = 0
+    converted = 0
+
+    def finish(source, outputs, summary):
+        nonlocal failures, total_bytes, converted
+        report(summary)
+        if not summary["ok"]:
+            failures += 1
+            return
+        converted += 1
+        total_bytes += summary["bytes"]
+        if args.skip == "hash":
+            folder = os.path.dirname(outputs[0])
+            manifests[folder][os.path.basename(outputs[0])] = {"sha256": digests[source],
+                                                              "parser_version": PARSER_VERSION}
+            save_manifest(folder, manifests[folder])
+
+    if args.jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(tasks))) as pool:
+            futures = {pool.submit(convert_file, source, outputs, args.gzip, args.columnar, args.writer,
+                                   chunked_threshold): (source, outputs)
+                       for source, outputs in tasks}
+            for future in as_completed(futures):
+                source, outputs = futures[future]
+                try:
+                    summary = future.result()
+                except Exception as e:  # e.g. a worker killed by the OOM killer
+                    summary = {"file": source, "ok": False, "error": str(e)}
+                finish(source, outputs, summary)
+    else:
+        for source, outputs in tasks:
+            finish(source, outputs, convert_file(source, outputs, args.gzip, args.columnar, args.writer,
+                                                 chunked_threshold))
+
+    elapsed = time.perf_counter() - started
+    if not args.json:
+        rate = total_bytes / 1024 / 1024 / elapsed if elapsed > 0 and total_bytes else 0.0
+        print(f"{converted} converted, {skipped} skipped, {failures} failed "
+              f"in {elapsed:.2f} s ({rate:.1f} MB/s)", flush=True)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
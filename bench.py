@@ -0,0 +1,294 @@
+"""
+Parser and export benchmark.
+
+    python bench.py --generate 1MB,100MB,1GB --repeat 3 -o results.json
+    python bench.py data/*.001 --pipelines dataframe --compare results.json
+
+Every pipeline is a list of stages run in order on one file; each stage
+reports wall time, rows/s, MB/s of the bytes it handled and the peak RSS
+(absolute and above the RSS before the stage); the DataFrame stages also keep
+the per-column memory report of the frame.  Each run happens in a fresh
+process so the memory figures of one run do not leak into the next.  The
+results are written as JSON together with the environment, and --compare
+prints the speed ratio of the best runs against an earlier results file.
+"""
+import argparse
+import base64
+import gzip
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+from batch import current_rss, peak_rss, reset_peak_rss
+from synthetic import generate, parse_size
+from utils import PARSER_VERSION, READ_CHUNK_SIZE, OriginParser, expand_durations, extract_origin_csv, memory_report
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "chroma-bench")
+
+
+def _read(ctx):
+    with open(ctx["path"], "rb") as f:
+        size = sum(len(chunk) for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""))
+    return 0, size
+
+
+def _scan(ctx):
+    """
+    The parser alone, with a sink that only counts rows.
+    """
+    parser = OriginParser(lambda data, n_rows, step_name: None)
+    with open(ctx["path"], "rb") as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b""):
+            parser.feed(chunk)
+    parser.finish()
+    return parser.row_count, parser.bytes_fed
+
+
+def _columns(ctx):
+    ctx["columns"], ctx["steps"] = extract_origin_csv(ctx["path"])
+    return len(ctx["columns"]), ctx["bytes"]
+
+
+def _dataframe(ctx, compact=False):
+    columns = ctx.pop("columns")
+    df = columns.to_dataframe(compact=compact)
+    del columns
+    df = df.dropna(subset=["System Time"])
+    ctx["frames"] = (df, df.loc[[s for s in ctx["steps"] if s in df.index]])
+    ctx["memory"] = memory_report(df)
+    return len(df), ctx["memory"]["total"]
+
+
+def _compact(ctx):
+    return _dataframe(ctx, compact=True)
+
+
+def _csv(ctx):
+    ctx["csv"] = [expand_durations(frame).to_csv(index=False).encode("utf-8") for frame in ctx["frames"]]
+    return len(ctx["frames"][0]), sum(len(text) for text in ctx["csv"])
+
+
+def _gzip(ctx):
+    texts = ctx.pop("csv")
+    ctx["gzip"] = [gzip.compress(text) for text in texts]
+    return len(ctx["frames"][0]), sum(len(text) for text in texts)
+
+
+def _pgzip(ctx):
+    from compression import GzipCompressor
+
+    texts = ctx.pop("csv")
+    compressor = GzipCompressor.from_config("parallel")
+    ctx["gzip"] = [compressor.compress(text) for text in texts]
+    return len(ctx["frames"][0]), sum(len(text) for text in texts)
+
+
+def _passthrough(ctx):
+    """
+    Parse, format and gzip the detail and step CSV without a DataFrame;
+    rows counts the rows written (rows with an impossible date are dropped).
+    """
+    from passthrough import passthrough_file
+
+    with tempfile.TemporaryDirectory() as folder:
+        summary = passthrough_file(ctx["path"], os.path.join(folder, "detail.csv.gz"),
+                                   os.path.join(folder, "step.csv.gz"))
+    return summary["rows"], ctx["bytes"]
+
+
+def _base64(ctx):
+    blobs = ctx.pop("gzip")
+    ctx["b64"] = [base64.b64encode(blob) for blob in blobs]
+    return len(ctx["frames"][0]), sum(len(blob) for blob in blobs)
+
+
+def _columnar(ctx):
+    from columnar import encode_columnar
+
+    ctx["bcol"] = [encode_columnar(frame) for frame in ctx["frames"]]
+    return len(ctx["frames"][0]), sum(len(blob) for blob in ctx["bcol"])
+
+
+STAGES = {
+    "read": _read,
+    "scan": _scan,
+    "columns": _columns,
+    "dataframe": _dataframe,
+    "compact": _compact,
+    "csv": _csv,
+    "gzip": _gzip,
+    "pgzip": _pgzip,
+    "base64": _base64,
+    "columnar": _columnar,
+    "passthrough": _passthrough,
+}
+
+PIPELINES = {
+    "scan": ("read", "scan"),
+    "dataframe": ("columns", "dataframe", "csv", "gzip", "base64"),
+    "compact": ("columns", "compact", "csv", "gzip", "base64"),
+    "parallel-gzip": ("columns", "dataframe", "csv", "pgzip", "base64"),
+    "columnar": ("columns", "dataframe", "columnar"),
+    "passthrough": ("passthrough",),
+}
+
+
+def run_pipeline(path, pipeline):
+    """
+    Run the stages of pipeline on path and return one record per stage.
+    """
+    import columnar  # noqa: F401  Import outside the timed stages
+    import pandas  # noqa: F401
+
+    ctx = {"path": path, "bytes": os.path.getsize(path)}
+    records = []
+    for name in PIPELINES[pipeline]:
+        rss_before = current_rss()
+        reset_peak_rss()
+        started = time.perf_counter()
+        rows, size = STAGES[name](ctx)
+        seconds = time.perf_counter() - started
+        peak = peak_rss()
+        memory = ctx.pop("memory", None)
+        records.append({
+            "stage": name,
+            "seconds": round(seconds, 6),
+            "rows": rows,
+            "bytes": size,
+            "rows_per_s": round(rows / seconds, 1) if seconds > 0 else None,
+            "mb_per_s": round(size / 1024 / 1024 / seconds, 3) if seconds > 0 else None,
+            "peak_rss": peak,
+            "peak_delta": peak - rss_before if peak is not None and rss_before is not None else None,
+            **({"memory": memory} if memory is not None else {}),
+        })
+    return records
+
+
+def environment():
+    import numpy
+    import pandas
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "parser_version": PARSER_VERSION,
+    }
+
+
+def synthetic_files(sizes, steps, encoding, junk, data_dir):
+    """
+    Generate (or reuse) one synthetic file per size; returns {path: summary}.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    files = {}
+    for size in sizes:
+        path = os.path.join(data_dir, f"synthetic-{size}-{steps}-{encoding}-{junk:g}.001")
+        summary_path = path + ".json"
+        if os.path.exists(path) and os.path.exists(summary_path):
+            with open(summary_path, encoding="utf-8") as f:
+                files[path] = json.load(f)
+            continue
+        summary = generate(path, parse_size(size), steps, encoding, junk)
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False)
+        files[path] = summary
+    return files
+
+
+def best_runs(results):
+    """
+    {(file name, pipeline, stage): fastest record} of a results document.
+    """
+    best = {}
+    for run in results["runs"]:
+        for record in run["stages"]:
+            key = (run["file"], run["pipeline"], record["stage"])
+            if key not in best or record["seconds"] < best[key]["seconds"]:
+                best[key] = record
+    return best
+
+
+def format_record(run, record):
+    peak = record["peak_rss"] / 1024 / 1024 if record["peak_rss"] else 0.0
+    delta = record["peak_delta"] / 1024 / 1024 if record["peak_delta"] is not None else 0.0
+    return (f"{run['file']:<40} {run['pipeline']:<10} {record['stage']:<10} {record['seconds']:9.3f} s "
+            f"{record['rows_per_s'] or 0:12.0f} rows/s {record['mb_per_s'] or 0:9.1f} MB/s "
+            f"peak {peak:8.1f} MB (+{delta:.1f})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark parse and export throughput and memory.")
+    parser.add_argument("files", nargs="*", help="tester files to benchmark")
+    parser.add_argument("--generate", metavar="SIZES", help="comma-separated sizes of synthetic files, e.g. 1MB,100MB")
+    parser.add_argument("--steps", type=int, default=50, help="steps per synthetic file (default: 50)")
+    parser.add_argument("--encoding", default="utf-8", help="encoding of synthetic files (default: utf-8)")
+    parser.add_argument("--junk", type=float, default=0.001, help="junk line fraction of synthetic files")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="where synthetic files are kept and reused")
+    parser.add_argument("--pipelines", default=",".join(PIPELINES),
+                        help=f"comma-separated pipelines (default: {','.join(PIPELINES)})")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per file and pipeline")
+    parser.add_argument("--in-process", action="store_true", help="run in this process instead of a fresh one per run")
+    parser.add_argument("-o", "--output", help="results file (default: bench-<timestamp>.json)")
+    parser.add_argument("--compare", metavar="RESULTS", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    pipelines = [name.strip() for name in args.pipelines.split(",") if name.strip()]
+    unknown = [name for name in pipelines if name not in PIPELINES]
+    if unknown:
+        parser.error(f"unknown pipelines: {', '.join(unknown)} (choose from {', '.join(PIPELINES)})")
+
+    files = {path: None for path in args.files}
+    if args.generate:
+        files.update(synthetic_files(args.generate.split(","), args.steps, args.encoding, args.junk, args.data_dir))
+    if not files:
+        parser.error("no files given; pass tester files or --generate SIZES")
+
+    results = {"created": datetime.now().isoformat(timespec="seconds"), "environment": environment(), "runs": []}
+    for path, summary in files.items():
+        for pipeline in pipelines:
+            for repeat in range(args.repeat):
+                if args.in_process:
+                    stages = run_pipeline(path, pipeline)
+                else:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                        stages = pool.submit(run_pipeline, path, pipeline).result()
+                run = {"file": os.path.basename(path), "bytes": os.path.getsize(path), "pipeline": pipeline,
+                       "repeat": repeat, "stages": stages}
+                if summary is not None:
+                    run["expected_rows"] = summary["rows"]
+                    parsed = next((s["rows"] for s in stages if s["stage"] in ("scan", "columns")), None)
+                    if parsed is not None and parsed != summary["rows"]:
+                        print(f"warning: {run['file']} parsed {parsed} rows, expected {summary['rows']}",
+                              file=sys.stderr)
+                results["runs"].append(run)
+                for record in stages:
+                    print(format_record(run, record), flush=True)
+
+    output = args.output or f"bench-{datetime.now():%Y%m%d-%H%M%S}.json"
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = best_runs(json.load(f))
+        for key, record in sorted(best_runs(results).items()):
+            if key in baseline and record["seconds"] > 0:
+                ratio = baseline[key]["seconds"] / record["seconds"]
+                print(f"{key[0]:<40} {key[1]:<10} {key[2]:<10} {ratio:6.2f}x "
+                      f"({baseline[key]['seconds']:.3f} s -> {record['seconds']:.3f} s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+Content-addressed cache for processed outputs.
+
+Entries are keyed by the SHA-256 of the upload plus PARSER_VERSION, so the
+same file uploaded again (under any name) skips parsing and conversion.
+Each entry is a directory holding the output files and a meta.json.  Once
+the entries add up to more than max_bytes the least recently used ones are
+evicted.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from utils import PARSER_VERSION
+
+META_NAME = "meta.json"
+TEMP_PREFIX = ".tmp-"
+
+
+def cache_key(digest):
+    return f"{digest}-{PARSER_VERSION}"
+
+
+def link_file(source, target):
+    """
+    Hard-link source to target, copying when linking is not possible.
+    """
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+class CacheEntry:
+    """
+    A committed entry: its folder and the metadata stored with it.
+    """
+
+    def __init__(self, folder, meta):
+        self.folder = folder
+        self.meta = meta
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+
+class CacheWriter:
+    """
+    Collects the files of a new entry in a temporary folder; commit() moves
+    the folder into place so readers never see a partial entry.
+    """
+
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.folder = tempfile.mkdtemp(dir=cache.folder, prefix=TEMP_PREFIX)
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def add_file(self, name, source):
+        """
+        Add an existing file, hard-linked when possible.
+        """
+        link_file(source, self.path(name))
+
+    def tee(self, name, chunks):
+        """
+        Yield chunks unchanged while also writing them to name.
+        """
+        with open(self.path(name), "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+
+    def commit(self, meta, replace=False):
+        """
+        Publish the entry.  An existing entry for the same key is kept unless
+        replace is set.
+        """
+        self.cache._commit(self, meta, replace)
+
+    def abort(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+
+class ResultCache:
+    """
+    LRU cache of processed outputs in folder, capped at max_bytes (0 disables
+    it).  Safe to share between threads; other processes using the same
+    folder see each other's entries on lookup.
+    """
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if self.enabled:
+            os.makedirs(folder, exist_ok=True)
+            self._load()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _load(self):
+        found = []
+        for name in os.listdir(self.folder):
+            folder = os.path.join(self.folder, name)
+            if name.startswith(TEMP_PREFIX) or not os.path.exists(os.path.join(folder, META_NAME)):
+                shutil.rmtree(folder, ignore_errors=True)
+            else:
+                found.append((os.path.getmtime(folder), name, _folder_size(folder)))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._size += size
+        self._evict()
+
+    def get(self, digest, count=True):
+        """
+        Return the CacheEntry for an upload digest, or None on a miss.
+        count=False leaves the hit/miss counters alone (lookups that are not
+        a request for a processed result).
+        """
+        if not self.enabled or not digest:
+            return None
+        key = cache_key(digest)
+        folder = os.path.join(self.folder, key)
+        with self._lock:
+            try:
+                with open(os.path.join(folder, META_NAME), encoding="utf-8") as f:
+                    meta = json.load(f)
+                size = self._entries[key] if key in self._entries else _folder_size(folder)
+                os.utime(folder)
+            except (OSError, ValueError):
+                # Missing, or evicted by another thread or worker process after the metadata was read
+                self._forget(key)
+                self.misses += count
+                return None
+            if key not in self._entries:
+                self._entries[key] = size
+                self._size += size
+            self._entries.move_to_end(key)
+            self.hits += count
+        return CacheEntry(folder, meta)
+
+    def writer(self, digest):
+        """
+        Start a new entry for an upload digest; None when caching is off.
+        """
+        if not self.enabled or not digest:
+            return None
+        return CacheWriter(self, cache_key(digest))
+
+    def _commit(self, writer, meta, replace):
+        with open(writer.path(META_NAME), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        size = _folder_size(writer.folder)
+        folder = os.path.join(self.folder, writer.key)
+        with self._lock:
+            if os.path.exists(folder):
+                if not replace:
+                    writer.abort()
+                    return
+                self._forget(writer.key)
+                shutil.rmtree(folder, ignore_errors=True)
+            os.rename(writer.folder, folder)
+            self._entries[writer.key] = size
+            self._size += size
+            self._evict()
+
+    def _forget(self, key):
+        size = self._entries.pop(key, None)
+        if size is not None:
+            self._size -= size
+
+    def _evict(self):
+        while self._size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._size -= size
+            self.evictions += 1
+            shutil.rmtree(os.path.join(self.folder, key), ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            if os.path.isdir(self.folder):
+                for name in os.listdir(self.folder):
+                    if name.startswith(TEMP_PREFIX):
+                        continue  # entries still being written
+                    shutil.rmtree(os.path.join(self.folder, name), ignore_errors=True)
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def _folder_size(folder):
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
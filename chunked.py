@@ -0,0 +1,178 @@
+"""
+Bounded-memory conversion of large tester files.
+
+Accepted rows are collected in batches of chunk_rows rows.  Every batch is
+converted to a DataFrame on its own, written as CSV through one gzip stream
+into the detail file and then dropped; only the CSV line of the last row of
+each step is kept for the step file.  Peak memory therefore depends on
+chunk_rows, not on the size of the file, and the outputs are the same bytes
+as gzip-compressing the CSV of the full detail and step frames.  With
+summary, every batch is also reduced into a summary.StepAccumulator, and
+with store appended to a colstore.StoreWriter.
+"""
+import time
+
+import numpy as np
+
+from colstore import StoreWriter
+from compression import GzipCompressor
+from summary import SUMMARY_COLUMNS, StepAccumulator
+from utils import ColumnBuilder, OriginParser, iter_source_chunks
+
+CHUNK_ROWS = 100000
+
+
+class ChunkedExport:
+    """
+    Push interface like OriginParser: feed() bytes as they come, finish()
+    writes the step file and returns a summary.  compressor is a
+    compression.GzipCompressor (single-threaded at the default level if None).
+    summary adds the per-step summary of the file (see finish()); store is a
+    folder to write the column store of the detail rows to.
+    """
+
+    def __init__(self, detail_path, step_path, chunk_rows=CHUNK_ROWS, compressor=None, summary=False,
+                 store=None):
+        self.step_path = step_path
+        self.chunk_rows = chunk_rows
+        self.compressor = compressor or GzipCompressor()
+        self.parser = OriginParser(self._add_rows)
+        self.rows = 0  # Detail rows written (rows with a valid System Time)
+        self.seconds = {"dataframe": 0.0, "csv": 0.0, "gzip": 0.0, **({"summary": 0.0} if summary else {}),
+                        **({"store": 0.0} if store else {})}
+        self.csv_bytes = 0
+        self.steps = StepAccumulator() if summary else None
+        self.store = StoreWriter(store) if store else None
+        self._columns = ColumnBuilder()
+        self._base = 0  # Row index of the first row in _columns
+        self._header = None
+        self._end_lines = {}  # Row index -> CSV line, for step ends and the last row of each batch
+        self._detail = open(detail_path, "wb")
+        self._compressor = self.compressor.compressobj()
+
+    def feed(self, data: bytes):
+        self.parser.feed(data)
+
+    def finish(self):
+        """
+        Flush the last batch and write the step file.  Returns
+        {"rows", "step_rows", "csv_bytes", "seconds"}, plus with summary
+        "step_summary": summary.step_summary() of the file, or None when it
+        has no "$" loop lines.
+        """
+        try:
+            ends = self.parser.finish()
+            self._convert()
+            if self.parser.row_count == 0:
+                raise Exception("無法從檔案中提取有效數據，請確認檔案內容。")
+            self._write(self._compressor.flush())
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self._detail.close()
+
+        if self.store is not None:
+            started = time.perf_counter()
+            self.store.finish(ends)
+            self.seconds["store"] += time.perf_counter() - started
+        lines = [self._end_lines[end] for end in ends if end in self._end_lines]
+        text = (self._header + "".join(lines)).encode("utf-8")
+        with open(self.step_path, "wb") as f:
+            f.write(self.compressor.compress(text))
+        result = {"rows": self.rows, "step_rows": len(lines), "csv_bytes": self.csv_bytes, "seconds": self.seconds}
+        if self.steps is not None:
+            started = time.perf_counter()
+            loops = self.parser.loop_list
+            result["step_summary"] = self.steps.finish(ends, loops) if loops else None
+            self.seconds["summary"] += time.perf_counter() - started
+        return result
+
+    def abort(self):
+        self._detail.close()
+        if self.store is not None:
+            self.store.abort()
+
+    def _add_rows(self, data: bytes, n_rows: int, step_name: str):
+        while n_rows:
+            room = self.chunk_rows - len(self._columns)
+            if n_rows < room:
+                self._columns(data, n_rows, step_name)
+                break
+            # Fill the batch with the first room rows of the run
+            cut = int(np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n"))[room - 1]) + 1
+            self._columns(data[:cut], room, step_name)
+            self._convert()
+            data, n_rows = data[cut:], n_rows - room
+
+    def _convert(self):
+        """
+        Write the collected batch and keep the lines of its step ends.  The
+        last row of the batch is kept too: whether it ends a step is only
+        known when the next header line arrives.
+        """
+        n_rows = len(self._columns)
+        if n_rows == 0 and self._header is not None:
+            return
+        started = time.perf_counter()
+        df = self._columns.to_dataframe()
+        df.index += self._base
+        df = df.dropna(subset=["System Time"])
+        self._columns = ColumnBuilder()
+        last = self._base + n_rows - 1
+        self._base += n_rows
+        self.seconds["dataframe"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        if self._header is None:
+            self._header = ",".join(df.columns) + "\n"
+            text = df.to_csv(index=False)
+        else:
+            text = df.to_csv(index=False, header=False)
+        known = [end for end in self.parser.last_time_per_step_list if end >= last - n_rows + 1]
+        if self.steps is not None:
+            summary_started = time.perf_counter()
+            self.steps.add(df.index.to_numpy(), {name: df[name].to_numpy() for name in SUMMARY_COLUMNS}, known)
+            self.seconds["summary"] += time.perf_counter() - summary_started
+        if self.store is not None:
+            store_started = time.perf_counter()
+            self.store.append({name: df[name] for name in df.columns}, df.index.to_numpy(), known + [last])
+            self.seconds["store"] += time.perf_counter() - store_started
+        kept = [index for index in dict.fromkeys(known + [last]) if index in df.index]
+        if kept:
+            step_lines = df.loc[kept].to_csv(index=False, header=False).splitlines(keepends=True)
+            self._end_lines.update(zip(kept, step_lines))
+        self.rows += len(df)
+        del df
+        data = text.encode("utf-8")
+        del text
+        self.csv_bytes += len(data)
+        self.seconds["csv"] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        self._write(self._compressor.compress(data))
+        self.seconds["gzip"] += time.perf_counter() - started
+
+    def _write(self, data):
+        if data:
+            self._detail.write(data)
+
+
+def export_chunks(chunks, detail_path, step_path, chunk_rows=CHUNK_ROWS, compressor=None, summary=False,
+                  store=None):
+    """
+    Convert the byte chunks of one tester file into gzip-compressed detail
+    and step CSV files; returns the ChunkedExport summary.
+    """
+    export = ChunkedExport(detail_path, step_path, chunk_rows, compressor, summary, store)
+    try:
+        for chunk in chunks:
+            export.feed(chunk)
+    except BaseException:
+        export.abort()
+        raise
+    return export.finish()
+
+
+def export_file(source, detail_path, step_path, chunk_rows=CHUNK_ROWS, compressor=None, summary=False, store=None):
+    return export_chunks(iter_source_chunks(source), detail_path, step_path, chunk_rows, compressor, summary, store)
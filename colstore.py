@@ -0,0 +1,270 @@
+"""
+Memory-mapped per-column store for processed data.
+
+Every column is a .npy file opened with mmap_mode="r", so a query only
+touches the pages it returns.  A step-boundary index (first row of every
+step) and binary search over System Time turn step and time-window queries
+into row ranges without scanning the data.
+
+StoreWriter builds the store batch by batch, for the writers that never
+hold the whole file (chunked, passthrough): rows are appended to the .npy
+files, whose headers get the final row count in finish().
+"""
+import json
+import os
+import struct
+
+import numpy as np
+
+from utils import DURATION_COLUMNS, format_durations, widen_float32
+
+STORE_META = "store.json"
+STEP_INDEX = "steps.npy"
+SORTED_TIMES = "sorted_times.npy"
+TIME_ORDER = "time_order.npy"
+NPY_HEADER_SIZE = 128  # Fixed, so the header can be rewritten in place
+WIDEN_ROWS = 1024 * 1024  # Rows copied at a time when a text column gets wider
+
+
+def write_store(df, step_df, folder):
+    """
+    Write the detail frame as one .npy file per column plus the step index.
+    Step name is stored as int32 codes into a dictionary kept in the metadata
+    and the H:MM:SS text columns as fixed-width bytes.  Compact frames
+    (ColumnBuilder.to_dataframe(compact=True)) give the same store.
+    """
+    writer = StoreWriter(folder)
+    writer.append({name: df[name] for name in df.columns}, df.index.to_numpy(), step_df.index.to_numpy())
+    return writer.finish(step_df.index.to_numpy())
+
+
+def npy_header(dtype, rows):
+    """
+    .npy (version 1.0) header of a 1-D array, padded to NPY_HEADER_SIZE bytes.
+    """
+    header = repr({"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False,
+                   "shape": (rows,)})
+    header = header.ljust(NPY_HEADER_SIZE - 11) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode("latin1")
+
+
+class StoreWriter:
+    """
+    write_store() in batches: append() adds the rows of a batch to the column
+    files, finish() writes the step index and the metadata.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.rows = 0
+        self.time_sorted = True
+        self.columns = None
+        self._files = {}
+        self._dtypes = {}
+        self._dictionary = {}  # Step name -> code
+        self._positions = {}  # Row label -> row number, for the rows that may end a step
+        self._last_time = None
+
+    def append(self, columns, labels, candidates=()):
+        """
+        Add one batch.  columns is {name: values} in detail column order;
+        Step name may be given as (codes, names) instead of values.  labels
+        are the (increasing) row labels of the batch and candidates the
+        labels that may end a step, which finish() gets as step ends.
+        """
+        if self.columns is None:
+            self.columns = [{"name": name, "file": f"col{i}.npy"} for i, name in enumerate(columns)]
+        for spec in self.columns:
+            self._write(spec, self._values(spec, columns[spec["name"]]))
+
+        labels = np.asarray(labels)
+        if len(labels):
+            candidates = np.asarray(candidates, dtype=labels.dtype)
+            found = np.minimum(np.searchsorted(labels, candidates), len(labels) - 1)
+            hit = labels[found] == candidates
+            self._positions.update(zip(candidates[hit].tolist(), (self.rows + found[hit]).tolist()))
+
+        times = np.asarray(columns["System Time"], dtype="datetime64[ns]")
+        if len(times):
+            self.time_sorted &= bool(np.all(times[1:] >= times[:-1])) and (
+                self._last_time is None or bool(times[0] >= self._last_time))
+            self._last_time = times[-1]
+        self.rows += len(labels)
+
+    def _values(self, spec, values):
+        name = spec["name"]
+        if name == "System Time":
+            return np.asarray(values, dtype="datetime64[ns]")
+        if name == "Step name":
+            if isinstance(values, tuple):
+                codes, uniques = values
+            else:
+                codes, uniques = values.factorize()
+            remap = np.array([self._dictionary.setdefault(str(value), len(self._dictionary)) for value in uniques],
+                             dtype=np.int32)
+            spec["dictionary"] = list(self._dictionary)
+            return remap[np.asarray(codes)] if len(remap) else np.zeros(0, dtype=np.int32)
+        values = np.asarray(values)
+        if name in DURATION_COLUMNS and values.dtype.kind in "iu":
+            spec["text"] = True
+            return format_durations(values)
+        if values.dtype == np.float32:
+            return widen_float32(values)
+        if values.dtype.kind in "OS":
+            spec["text"] = True
+            return values.astype(np.bytes_)
+        return values
+
+    def _write(self, spec, values):
+        name = spec["name"]
+        f = self._files.get(name)
+        if f is None:
+            f = self._files[name] = open(os.path.join(self.folder, spec["file"]), "wb")
+            f.write(npy_header(values.dtype, 0))
+            self._dtypes[name] = values.dtype
+        dtype = self._dtypes[name]
+        if dtype.kind == "S" and values.dtype.itemsize > dtype.itemsize:
+            f = self._widen(spec, values.dtype)
+            dtype = values.dtype
+        f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+    def _widen(self, spec, dtype):
+        """
+        Rewrite a text column with a wider fixed width.
+        """
+        name = spec["name"]
+        path = os.path.join(self.folder, spec["file"])
+        self._files[name].close()
+        old = np.memmap(path, dtype=self._dtypes[name], mode="r", offset=NPY_HEADER_SIZE, shape=(self.rows,))
+        with open(path + ".tmp", "wb") as f:
+            f.write(npy_header(dtype, 0))
+            for start in range(0, self.rows, WIDEN_ROWS):
+                f.write(old[start:start + WIDEN_ROWS].astype(dtype).tobytes())
+        del old
+        os.replace(path + ".tmp", path)
+        self._dtypes[name] = dtype
+        f = self._files[name] = open(path, "r+b")
+        f.seek(0, os.SEEK_END)
+        return f
+
+    def finish(self, step_ends):
+        """
+        Write the headers, the step index (step_ends are the labels of the
+        last rows of the steps) and the metadata; returns the metadata.
+        """
+        for spec in self.columns or []:
+            f = self._files.pop(spec["name"])
+            f.seek(0)
+            f.write(npy_header(self._dtypes[spec["name"]], self.rows))
+            f.close()
+
+        ends = np.unique([self._positions[end] for end in step_ends if end in self._positions]).astype(np.int64)
+        if self.rows and (len(ends) == 0 or ends[-1] != self.rows - 1):
+            ends = np.append(ends, self.rows - 1)
+        starts = np.concatenate(([0], ends[:-1] + 1)).astype(np.int64) if self.rows else np.zeros(0, dtype=np.int64)
+        np.save(os.path.join(self.folder, STEP_INDEX), np.append(starts, self.rows).astype(np.int64))
+
+        # Binary search needs sorted times; keep a sorted copy and its order when the log is not monotonic
+        if not self.time_sorted:
+            time_file = next(spec["file"] for spec in self.columns if spec["name"] == "System Time")
+            times = np.load(os.path.join(self.folder, time_file), mmap_mode="r")
+            order = np.argsort(times, kind="stable")
+            np.save(os.path.join(self.folder, TIME_ORDER), order)
+            np.save(os.path.join(self.folder, SORTED_TIMES), times[order])
+
+        meta = {"rows": self.rows, "steps": len(starts), "time_sorted": self.time_sorted, "columns": self.columns}
+        with open(os.path.join(self.folder, STORE_META), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        return meta
+
+    def abort(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+
+
+class ColumnStore:
+    """
+    Read side of write_store().  Row selections are slices for step queries
+    and sorted time windows, and sorted index arrays otherwise.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, STORE_META), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.rows = meta["rows"]
+        self.n_steps = meta["steps"]
+        self.time_sorted = meta["time_sorted"]
+        self.specs = {spec["name"]: spec for spec in meta["columns"]}
+        self.names = [spec["name"] for spec in meta["columns"]]
+        self.step_index = self._load(STEP_INDEX)
+        self._arrays = {}
+
+    @staticmethod
+    def exists(folder):
+        return os.path.exists(os.path.join(folder, STORE_META))
+
+    def _load(self, filename):
+        return np.load(os.path.join(self.folder, filename), mmap_mode="r")
+
+    def column(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = self._load(self.specs[name]["file"])
+        return self._arrays[name]
+
+    def step_rows(self, step):
+        """
+        Rows of a step, numbered from 1.
+        """
+        if not 1 <= step <= self.n_steps:
+            raise IndexError(f"step {step} out of range 1..{self.n_steps}")
+        return slice(int(self.step_index[step - 1]), int(self.step_index[step]))
+
+    def time_rows(self, start=None, end=None):
+        """
+        Rows whose System Time lies in [start, end] (datetime64, either may be None).
+        """
+        if self.time_sorted:
+            times = self.column("System Time")
+        else:
+            times = self._load(SORTED_TIMES)
+        lo = 0 if start is None else int(np.searchsorted(times, np.datetime64(start, "ns"), side="left"))
+        hi = len(times) if end is None else int(np.searchsorted(times, np.datetime64(end, "ns"), side="right"))
+        hi = max(lo, hi)
+        if self.time_sorted:
+            return slice(lo, hi)
+        return np.sort(self._load(TIME_ORDER)[lo:hi])
+
+    def read(self, rows, names=None):
+        """
+        {column name: array} for the selected rows, with Step name and the text
+        columns decoded to str.
+        """
+        out = {}
+        for name in names or self.names:
+            spec = self.specs[name]
+            values = np.asarray(self.column(name)[rows])
+            if "dictionary" in spec:
+                values = np.array(spec["dictionary"], dtype=object)[values]
+            elif spec.get("text"):
+                values = values.astype(str).astype(object)
+            out[name] = values
+        return out
+
+
+def json_columns(arrays):
+    """
+    Convert read() output to JSON-friendly lists (NaN becomes None).
+    """
+    out = {}
+    for name, values in arrays.items():
+        if values.dtype.kind == "M":
+            out[name] = [text.replace("T", " ") for text in np.datetime_as_string(values, unit="s").tolist()]
+        elif values.dtype.kind == "f":
+            listed = values.astype(object)
+            listed[np.isnan(values)] = None
+            out[name] = listed.tolist()
+        else:
+            out[name] = values.tolist()
+    return out
@@ -0,0 +1,173 @@
+"""
+Columnar binary export for processed tester data (.bcol).
+
+Layout: MAGIC, a little-endian uint32 header length, a UTF-8 JSON header and
+one compressed blob per column, in header order.
+
+- System Time is stored as int64 nanosecond deltas.
+- Numeric columns are delta-coded fixed-point integers when every value
+  round-trips with at most MAX_DECIMALS decimals, and float32 otherwise.
+- Step name is stored as integer codes into a dictionary kept in the header.
+
+Integer blobs use the narrowest dtype that fits and are byte-shuffled before
+compression, and every column picks its own codec.  The H:MM:SS text of Step
+Time / Total Time is not stored; the "(s)" columns carry the same values.
+"""
+import bz2
+import json
+import lzma
+import struct
+import zlib
+
+import numpy as np
+
+from utils import MAX_DECIMALS, ColumnBuilder, fixed_decimals, widen_float32
+
+MAGIC = b"BCOL"
+VERSION = 1
+DEFAULT_CODEC = "zlib"
+DEFAULT_LEVEL = 6
+TEXT_COLUMNS = ("Step Time", "Total Time")
+_INT_TYPES = (np.int8, np.int16, np.int32, np.int64)
+_HEADER_LENGTH = struct.Struct("<I")
+
+CODECS = {
+    "none": (lambda data, level: data, lambda data: data),
+    "zlib": (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    "bz2": (lambda data, level: bz2.compress(data, max(level, 1)), bz2.decompress),
+    "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+
+def encode_columnar(df, channels="fixed", codec=DEFAULT_CODEC, level=DEFAULT_LEVEL):
+    """
+    Encode a detail or step DataFrame.  channels="float32" stores the V..Wh
+    channels as float32 even when they would fit in fixed point.  A column is
+    stored uncompressed when codec does not make it smaller.
+    """
+    if channels not in ("fixed", "float32"):
+        raise ValueError(f"unknown channel encoding: {channels}")
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec: {codec}")
+
+    columns = []
+    blobs = []
+    for name in df.columns:
+        if name in TEXT_COLUMNS:
+            continue
+        series = df[name]
+        spec = {"name": name}
+        if name == "System Time":
+            values = series.to_numpy(dtype="datetime64[ns]").view(np.int64)
+            spec["kind"] = "time"
+            data = _encode_integers(values, spec)
+        elif series.dtype == object or series.dtype.name == "category":
+            codes, uniques = series.factorize()
+            spec["kind"] = "dict"
+            spec["dictionary"] = [str(value) for value in uniques]
+            data = _encode_integers(codes.astype(np.int64), spec, delta=False)
+        else:
+            if series.dtype == np.float32:  # Compact frames
+                values = widen_float32(series.to_numpy())
+            else:
+                values = series.to_numpy(dtype=np.float64)
+            if channels == "float32" and name in ColumnBuilder.CHANNELS:
+                decimals = None
+            else:
+                decimals = fixed_decimals(values)
+            if decimals is None:
+                spec["kind"] = "float"
+                spec["dtype"] = "float32"
+                spec["shuffle"] = True
+                data = _shuffle(values.astype("<f4"))
+            else:
+                spec["kind"] = "fixed"
+                spec["decimals"] = decimals
+                data = _encode_integers(np.round(values * 10.0 ** decimals).astype(np.int64), spec)
+
+        compressed = CODECS[codec][0](data, level)
+        spec["codec"] = codec if len(compressed) < len(data) else "none"
+        blob = compressed if spec["codec"] != "none" else data
+        spec["size"] = len(blob)
+        columns.append(spec)
+        blobs.append(blob)
+
+    header = json.dumps({"version": VERSION, "rows": len(df), "columns": columns}).encode("utf-8")
+    return b"".join([MAGIC, _HEADER_LENGTH.pack(len(header)), header] + blobs)
+
+
+def decode_columnar(data):
+    """
+    Decode .bcol bytes into (header, {column name: NumPy array}).
+    System Time comes back as datetime64[ns], Step name as an object array
+    and every other column as float64.
+    """
+    data = memoryview(data)
+    if bytes(data[:4]) != MAGIC:
+        raise ValueError("not a columnar export")
+    (header_length,) = _HEADER_LENGTH.unpack_from(data, 4)
+    start = 4 + _HEADER_LENGTH.size
+    header = json.loads(bytes(data[start:start + header_length]).decode("utf-8"))
+    if header["version"] > VERSION:
+        raise ValueError(f"unsupported columnar export version: {header['version']}")
+
+    offset = start + header_length
+    arrays = {}
+    for spec in header["columns"]:
+        raw = CODECS[spec["codec"]][1](bytes(data[offset:offset + spec["size"]]))
+        offset += spec["size"]
+        if spec["kind"] == "float":
+            arrays[spec["name"]] = _unshuffle(raw, np.dtype("<f4")).astype(np.float64)
+            continue
+        values = _decode_integers(raw, spec)
+        if spec["kind"] == "time":
+            arrays[spec["name"]] = values.view("datetime64[ns]")
+        elif spec["kind"] == "dict":
+            arrays[spec["name"]] = np.array(spec["dictionary"], dtype=object)[values]
+        else:
+            arrays[spec["name"]] = values / 10.0 ** spec["decimals"]
+    return header, arrays
+
+
+def read_columnar(path):
+    """
+    Read a .bcol file into a pandas DataFrame.
+    """
+    import pandas as pd
+
+    with open(path, "rb") as f:
+        _, arrays = decode_columnar(f.read())
+    return pd.DataFrame(arrays)
+
+
+def _encode_integers(values, spec, delta=True):
+    spec["delta"] = delta
+    if delta:
+        # The first value goes into the header so the deltas stay small
+        spec["first"] = int(values[0]) if len(values) else 0
+        values = np.diff(values, prepend=values[:1])
+    lo, hi = (int(values.min()), int(values.max())) if len(values) else (0, 0)
+    dtype = next(t for t in _INT_TYPES if np.iinfo(t).min <= lo and hi <= np.iinfo(t).max)
+    spec["dtype"] = np.dtype(dtype).name
+    spec["shuffle"] = np.dtype(dtype).itemsize > 1
+    stored = values.astype(np.dtype(dtype).newbyteorder("<"))
+    return _shuffle(stored) if spec["shuffle"] else stored.tobytes()
+
+
+def _decode_integers(raw, spec):
+    dtype = np.dtype(spec["dtype"]).newbyteorder("<")
+    values = _unshuffle(raw, dtype) if spec["shuffle"] else np.frombuffer(raw, dtype=dtype)
+    values = values.astype(np.int64)
+    return spec["first"] + np.cumsum(values) if spec["delta"] else values
+
+
+def _shuffle(values):
+    """
+    Group byte 0 of every value, then byte 1, ... (compresses much better).
+    """
+    return np.ascontiguousarray(values.view(np.uint8).reshape(-1, values.dtype.itemsize).T).tobytes()
+
+
+def _unshuffle(raw, dtype):
+    planes = np.frombuffer(raw, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).reshape(-1)
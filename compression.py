@@ -0,0 +1,174 @@
+"""
+Gzip compression engine for the CSV outputs.
+
+With more than one thread the input is cut into blocks that are deflated in
+parallel on a shared thread pool (zlib releases the GIL), the way pigz does:
+each block is raw deflate primed with the last 32 KB of the previous block
+as dictionary and ends with a sync flush, so the blocks concatenate into one
+deflate stream.  An empty final block and the gzip trailer (CRC-32 computed
+on the calling thread) close it.  The result is a single ordinary gzip
+member, readable by every gzip decoder, and within a fraction of a percent
+of the size of serial compression.  With one thread plain zlib is used.
+"""
+import os
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+ENGINES = ("zlib", "parallel")
+DEFAULT_LEVEL = 6
+BLOCK_SIZE = 1024 * 1024
+DICT_SIZE = 32 * 1024
+# Gzip header: magic, deflate, no flags, mtime 0, no extra flags, unknown OS
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+FINAL_BLOCK = b"\x03\x00"  # Empty fixed-Huffman block with BFINAL set
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class GzipCompressor:
+    """
+    Compression settings; compressobj() returns a zlib-style object
+    (compress() / flush()) that produces one gzip member.
+    """
+
+    def __init__(self, level=DEFAULT_LEVEL, threads=1, block_size=BLOCK_SIZE):
+        if not 0 <= level <= 9:
+            raise ValueError(f"invalid compression level: {level}")
+        self.level = level
+        self.threads = max(int(threads), 1)
+        self.block_size = max(int(block_size), DICT_SIZE)
+
+    @classmethod
+    def from_config(cls, engine="parallel", level=DEFAULT_LEVEL, threads=None):
+        if engine not in ENGINES:
+            raise ValueError(f"unknown compression engine: {engine}")
+        threads = (threads or os.cpu_count() or 1) if engine == "parallel" else 1
+        return cls(level, threads)
+
+    @property
+    def engine(self):
+        return "parallel" if self.threads > 1 else "zlib"
+
+    def compressobj(self):
+        if self.threads == 1:
+            return zlib.compressobj(self.level, zlib.DEFLATED, 31)
+        return ParallelGzip(self.level, self.block_size, _shared_pool(), 2 * self.threads)
+
+    def compress(self, data):
+        stream = self.compressobj()
+        return stream.compress(data) + stream.flush()
+
+    def iter_compress(self, chunks):
+        """
+        Compress an iterable of bytes, yielding output as it is ready.
+        """
+        stream = self.compressobj()
+        for chunk in chunks:
+            data = stream.compress(chunk)
+            if data:
+                yield data
+        yield stream.flush()
+
+
+class PlainWriter:
+    """
+    GzipCompressor interface without compression, for writers that are
+    asked for plain files; compressobj() returns the writer itself.
+    """
+
+    engine = "none"
+
+    def compressobj(self):
+        return self
+
+    def compress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+class ParallelGzip:
+    """
+    Streaming pigz-style compressor, see the module docstring.  At most
+    max_pending blocks are in flight, which bounds the memory used.
+    """
+
+    def __init__(self, level, block_size, pool, max_pending):
+        self.level = level
+        self.block_size = block_size
+        self._pool = pool
+        self._max_pending = max_pending
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._dictionary = b""
+        self._crc = 0
+        self._size = 0
+        self._started = False
+
+    def compress(self, data):
+        out = []
+        if not self._started:
+            out.append(GZIP_HEADER)
+            self._started = True
+        self._crc = zlib.crc32(data, self._crc)
+        self._size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        while self._pending and (self._pending[0].done() or len(self._pending) > self._max_pending):
+            out.append(self._pending.popleft().result())
+        return b"".join(out)
+
+    def flush(self):
+        out = [] if self._started else [GZIP_HEADER]
+        self._started = True
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            out.append(self._pending.popleft().result())
+        out.append(FINAL_BLOCK)
+        out.append(struct.pack("<II", self._crc, self._size & 0xFFFFFFFF))
+        return b"".join(out)
+
+    def _submit(self, block):
+        self._pending.append(self._pool.submit(_deflate_block, block, self._dictionary, self.level))
+        self._dictionary = block[-DICT_SIZE:]
+
+
+def _deflate_block(block, dictionary, level):
+    if dictionary:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _reset_pool():
+    # Threads do not survive fork(): a forked child starts its own pool
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pool)
+
+
+def _shared_pool():
+    """
+    One thread pool per process, sized once to the CPU count.  It is never
+    replaced, so no executor is left behind; each stream bounds its own share
+    of the pool through max_pending.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="gzip")
+        return _pool
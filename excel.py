@@ -0,0 +1,111 @@
+"""
+Excel (.xlsx) tester exports.
+
+The workbook is opened with openpyxl in read-only mode, which streams the
+sheet XML and yields one row at a time, and every row is written back as a
+line of the text export.  The lines go through the same OriginParser state
+machine as .csv / .001 files, so the results are the same for the same data
+and memory stays bounded on sheets of any length.  Sheets are read in
+workbook order, which also covers exports that continue a long record on
+further sheets.  Legacy .xls workbooks are not supported.
+"""
+import datetime
+
+EXCEL_EXTENSIONS = (".xlsx", ".xlsm")
+LEGACY_EXTENSIONS = (".xls",)
+CHUNK_SIZE = 1024 * 1024
+# openpyxl returns elapsed-time cells ([h]:mm:ss) of a day or more as datetimes
+# counted from the 1900 epoch, with serial numbers below 60 shifted by Excel's
+# phantom 1900-02-29
+DURATION_LIMIT = datetime.datetime(1901, 1, 1)
+LEAP_BUG_END = datetime.datetime(1900, 3, 1)
+
+
+def is_excel(filename):
+    return bool(filename) and str(filename).lower().endswith(EXCEL_EXTENSIONS)
+
+
+def is_legacy_excel(filename):
+    return bool(filename) and str(filename).lower().endswith(LEGACY_EXTENSIONS)
+
+
+def format_duration(seconds):
+    """
+    Seconds as the tester writes durations: "H:MM:SS.s".
+    """
+    tenths = round(seconds * 10)
+    hours, rest = divmod(tenths, 36000)
+    minutes, rest = divmod(rest, 600)
+    return f"{hours}:{minutes:02d}:{rest // 10:02d}.{rest % 10}"
+
+
+def format_cell(value):
+    """
+    A cell value as it appears in the text export.
+    """
+    if type(value) is float:  # Most cells
+        return repr(value)
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, datetime.datetime):
+        if value < DURATION_LIMIT:
+            epoch = datetime.datetime(1899, 12, 31 if value < LEAP_BUG_END else 30)
+            return format_duration((value - epoch).total_seconds())
+        # Excel keeps times as fractions of a day; round off the float error
+        value = (value + datetime.timedelta(microseconds=500000)).replace(microsecond=0)
+        return value.strftime("%y/%m/%d %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.strftime("%y/%m/%d 00:00:00")
+    if isinstance(value, datetime.time):
+        return format_duration(value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6)
+    if isinstance(value, datetime.timedelta):
+        return format_duration(value.total_seconds())
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def iter_excel_rows(source):
+    """
+    Rows of every sheet of the workbook source (a path or a binary file
+    object) as tuples of values, without trailing empty cells.
+    """
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ImportError("openpyxl is required to read Excel files") from e
+
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            # Rows are not padded to the sheet dimensions, so they need not be
+            # known; without this a sheet that lacks them is read twice
+            sheet.reset_dimensions()
+            for row in sheet.iter_rows(values_only=True):
+                end = len(row)
+                while end and (row[end - 1] is None or row[end - 1] == ""):
+                    end -= 1
+                yield row[:end]
+    finally:
+        workbook.close()
+
+
+def iter_excel_chunks(source, chunk_size=CHUNK_SIZE):
+    """
+    The workbook as UTF-8 text export, in chunks of about chunk_size bytes
+    for OriginParser.feed().
+    """
+    lines = []
+    size = 0
+    for row in iter_excel_rows(source):
+        line = ",".join(map(format_cell, row)) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(lines).encode("utf-8")
+            lines = []
+            size = 0
+    if lines:
+        yield "".join(lines).encode("utf-8")
@@ -0,0 +1,169 @@
+"""
+Ingestion helpers that feed tester data into OriginParser without a
+round trip through a saved file.
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+
+from werkzeug.utils import secure_filename
+
+from utils import ColumnBuilder, OriginParser
+
+TEXT_EXTENSIONS = (".csv", ".001")
+
+
+def is_text_upload(filename):
+    return bool(filename) and filename.lower().endswith(TEXT_EXTENSIONS)
+
+
+class UploadStream:
+    """
+    Writable stream for werkzeug's multipart parser.
+
+    Every chunk of the upload goes straight into OriginParser as it comes off
+    the socket, so parsing overlaps the transfer and the raw upload is never
+    kept in memory or written to disk.  werkzeug seeks back to the start once
+    the part is complete, which is where the parse is finished.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.columns = ColumnBuilder()
+        self.parser = OriginParser(self.columns)
+        self.steps = None
+        self.error = None
+        self._hash = hashlib.sha256()
+
+    @property
+    def bytes_received(self):
+        return self.parser.bytes_fed
+
+    @property
+    def digest(self):
+        """
+        SHA-256 of everything received so far.
+        """
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self._hash.update(data)
+        if self.error is None:
+            try:
+                self.parser.feed(data)
+            except Exception as e:
+                self.error = e
+        return len(data)
+
+    def seek(self, offset, whence=0):
+        if self.steps is None and self.error is None:
+            try:
+                self.steps = self.parser.finish()
+                self.columns.loops = self.parser.loop_list
+            except Exception as e:
+                self.error = e
+        return 0
+
+    def tell(self):
+        return 0
+
+    def read(self, size=-1):
+        return b""
+
+    def readline(self, size=-1):
+        return b""
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def result(self):
+        """
+        Return (columns, steps) like extract_origin_csv.
+        """
+        self.seek(0)
+        if self.error is not None:
+            raise Exception("此檔案並非'承德充放電機'檔案格式，請確認選擇檔案。") from self.error
+        return self.columns, self.steps
+
+
+class SpoolStream:
+    """
+    Writable stream for uploads that have to be kept as they are.
+
+    Data stays in memory until spill_threshold bytes have been written and
+    only then moves to a file, which keeps the upload's own name inside a
+    fresh directory under spill_dir so it can be parsed by path.
+    """
+
+    def __init__(self, filename, spill_threshold, spill_dir):
+        self.filename = filename
+        self.spill_threshold = spill_threshold
+        self.spill_dir = spill_dir
+        self.path = None
+        self._file = io.BytesIO()
+        self._hash = hashlib.sha256()
+
+    @property
+    def size(self):
+        position = self._file.tell()
+        size = self._file.seek(0, io.SEEK_END)
+        self._file.seek(position)
+        return size
+
+    @property
+    def digest(self):
+        """
+        SHA-256 of everything written so far.
+        """
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self._hash.update(data)
+        if self.path is None and self._file.tell() + len(data) > self.spill_threshold:
+            self._spill()
+        return self._file.write(data)
+
+    def _spill(self):
+        name = secure_filename(self.filename or "") or "upload"
+        self.path = os.path.join(tempfile.mkdtemp(dir=self.spill_dir), name)
+        spilled = open(self.path, "wb+")
+        spilled.write(self._file.getvalue())
+        self._file = spilled
+
+    def getvalue(self):
+        """
+        The upload as bytes, or None once it has been spilled to disk.
+        """
+        return None if self.path is not None else self._file.getvalue()
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def read(self, size=-1):
+        return self._file.read(size)
+
+    def readline(self, size=-1):
+        return self._file.readline(size)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def cleanup(self):
+        """
+        Remove the spilled copy, if any.
+        """
+        self.close()
+        if self.path is not None:
+            shutil.rmtree(os.path.dirname(self.path), ignore_errors=True)
+            self.path = None
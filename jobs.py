@@ -0,0 +1,187 @@
+"""
+Background jobs with progress reporting.
+
+Jobs run on a thread pool of the process that accepted them.  Their state
+is kept in a SQLite table (JobStore) that every update writes through, so
+all the processes of the server (gunicorn workers) that open the same file
+see every job, and no external broker is needed.  Finished jobs are dropped
+(and their outputs removed through on_expire) once they are older than the
+TTL, and so are unfinished jobs that stopped reporting for that long (the
+process running them is gone); cleanup runs whenever jobs are submitted or looked up.
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+PROGRESS_FIELDS = {"bytes_parsed", "rows"}
+SAVE_INTERVAL = 0.25  # Seconds between saves of progress-only updates
+
+
+class Job:
+    """
+    State of one background job.  The worker reports progress with update(),
+    which also saves the state to store (progress-only updates at most every
+    SAVE_INTERVAL seconds).
+    """
+
+    def __init__(self, job_id, info, store=None):
+        self.id = job_id
+        self.store = store
+        self.info = dict(info)
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.bytes_total = 0
+        self.bytes_parsed = 0
+        self.rows = 0
+        self.error = None
+        self.outputs = {}
+        self.details = {}
+        self.created = self.updated = time.time()
+        self._saved = 0.0
+        self._lock = threading.Lock()
+
+    def update(self, **fields):
+        with self._lock:
+            for key, value in fields.items():
+                setattr(self, key, value)
+            self.updated = time.time()
+            if self.store is not None and (not fields.keys() <= PROGRESS_FIELDS
+                                           or self.updated - self._saved >= SAVE_INTERVAL):
+                self.store.save(self)
+                self._saved = self.updated
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                **self.info,
+                "status": self.status,
+                "stage": self.stage,
+                "bytes_total": self.bytes_total,
+                "bytes_parsed": self.bytes_parsed,
+                "progress": self.bytes_parsed / self.bytes_total if self.bytes_total else 0.0,
+                "rows": self.rows,
+                "error": self.error,
+                "outputs": sorted(self.outputs),
+                "details": self.details,
+                "created": self.created,
+                "updated": self.updated,
+            }
+
+
+class JobStore:
+    """
+    Job states in a SQLite table keyed by job id; info, outputs and details
+    are stored as JSON.  Every call opens its own connection, so the store
+    can be shared by threads and processes.
+    """
+
+    COLUMNS = ("id", "info", "status", "stage", "bytes_total", "bytes_parsed", "rows", "error", "outputs",
+               "details", "created", "updated")
+    JSON_COLUMNS = ("info", "outputs", "details")
+
+    def __init__(self, path):
+        self.path = path
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+        finally:
+            db.close()
+        with self._connect(immediate=True) as db:
+            db.execute(f"CREATE TABLE IF NOT EXISTS jobs ({', '.join(self.COLUMNS)}, PRIMARY KEY (id))")
+
+    @contextmanager
+    def _connect(self, immediate=False):
+        """
+        A connection whose changes are committed at the end of the with block;
+        immediate takes the write lock at the start.
+        """
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def save(self, job):
+        values = [json.dumps(getattr(job, name)) if name in self.JSON_COLUMNS else getattr(job, name)
+                  for name in self.COLUMNS]
+        with self._connect() as db:
+            db.execute(f"INSERT OR REPLACE INTO jobs VALUES ({', '.join('?' * len(values))})", values)
+
+    def load(self, job_id):
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else self._job(row)
+
+    def expire(self, before):
+        """
+        Delete the jobs last updated before the time before; returns them.
+        """
+        with self._connect(immediate=True) as db:
+            rows = db.execute("SELECT * FROM jobs WHERE updated < ?", (before,)).fetchall()
+            db.execute("DELETE FROM jobs WHERE updated < ?", (before,))
+        return [self._job(row) for row in rows]
+
+    def _job(self, row):
+        fields = dict(zip(self.COLUMNS, row))
+        job = Job(fields.pop("id"), json.loads(fields.pop("info")), self)
+        for name, value in fields.items():
+            setattr(job, name, json.loads(value) if name in self.JSON_COLUMNS else value)
+        return job
+
+
+class JobQueue:
+    """
+    Runs fn(job, *args) on a thread pool and keeps the job state in the
+    JobStore at path for ttl seconds after it has finished.
+    """
+
+    def __init__(self, path, workers=2, ttl=3600, on_expire=None):
+        self.ttl = ttl
+        self.on_expire = on_expire
+        self.store = JobStore(path)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+
+    def submit(self, fn, *args, **info):
+        self.cleanup()
+        job = Job(uuid.uuid4().hex, info, self.store)
+        self.store.save(job)
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        """
+        The saved state of the job (a copy, also for jobs of this process),
+        or None.
+        """
+        self.cleanup()
+        return self.store.load(job_id)
+
+    def cleanup(self):
+        expired = self.store.expire(time.time() - self.ttl)
+        for job in expired:
+            if self.on_expire is not None:
+                self.on_expire(job)
+
+    def _run(self, job, fn, args):
+        job.update(status=RUNNING)
+        try:
+            fn(job, *args)
+        except Exception as e:
+            job.update(status=FAILED, stage=FAILED, error=str(e))
+        else:
+            job.update(status=DONE, stage=DONE)
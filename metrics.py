@@ -0,0 +1,170 @@
+"""
+Per-stage timing and Prometheus text metrics.
+
+A StageTimer records the wall time and bytes of each stage of one unit of
+work (a file, a request).  Its records are plain dicts, so they can come back
+from pool workers inside a result and be merged into a Server-Timing header or
+the process-wide Metrics registry.  A disabled timer keeps nothing.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = "chroma"
+
+
+class StageTimer:
+    """
+    Ordered stage records: {"stage", "seconds", "bytes"}.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, nbytes=0):
+        """
+        Time the with block; set record["bytes"] inside it when the size is
+        only known at the end.
+        """
+        record = {"stage": name, "seconds": 0.0, "bytes": nbytes}
+        if not self.enabled:
+            yield record
+            return
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - started
+            self.records.append(record)
+
+    def add(self, name, seconds, nbytes=0):
+        if self.enabled:
+            self.records.append({"stage": name, "seconds": seconds, "bytes": nbytes})
+
+    def extend(self, records):
+        if self.enabled and records:
+            self.records.extend(records)
+
+
+def server_timing(records):
+    """
+    Server-Timing header value with the records summed per stage, in order of
+    first appearance.
+    """
+    totals = {}
+    for record in records:
+        seconds, nbytes = totals.get(record["stage"], (0.0, 0))
+        totals[record["stage"]] = (seconds + record["seconds"], nbytes + record["bytes"])
+    return ", ".join(
+        f'{stage};dur={seconds * 1000:.1f}' + (f';desc="{nbytes} bytes"' if nbytes else "")
+        for stage, (seconds, nbytes) in totals.items()
+    )
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class Metrics:
+    """
+    Process-wide counters and histograms, rendered in the Prometheus text
+    exposition format.
+    """
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> Histogram
+        self._counters = {}  # (name, labels) -> value
+        self._help = {}
+
+    def timer(self):
+        return StageTimer(self.enabled)
+
+    def observe(self, name, value, help_text="", **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help_text))
+            if key not in self._histograms:
+                self._histograms[key] = Histogram(self.buckets)
+            self._histograms[key].observe(value)
+
+    def inc(self, name, value=1, help_text="", **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("counter", help_text))
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe_stages(self, records):
+        for record in records or ():
+            self.observe("stage_seconds", record["seconds"], "Wall time of processing stages", stage=record["stage"])
+            self.inc("stage_bytes_total", record["bytes"], "Bytes handled by processing stages", stage=record["stage"])
+
+    def render(self, gauges=None):
+        """
+        Prometheus text of every metric; gauges is {name: (value, help)} of
+        values sampled at scrape time.
+        """
+        lines = []
+        with self._lock:
+            names = sorted(self._help)
+            for name in names:
+                kind, help_text = self._help[name]
+                full = f"{PREFIX}_{name}"
+                lines.append(f"# HELP {full} {help_text}")
+                lines.append(f"# TYPE {full} {kind}")
+                if kind == "counter":
+                    for (metric, labels), value in sorted(self._counters.items()):
+                        if metric == name:
+                            lines.append(f"{full}{_labels(labels)} {_number(value)}")
+                    continue
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{full}_bucket{_labels(labels + (('le', _number(bound)),))} {cumulative}")
+                    lines.append(f"{full}_bucket{_labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{full}_sum{_labels(labels)} {_number(histogram.sum)}")
+                    lines.append(f"{full}_count{_labels(labels)} {histogram.count}")
+        for name, (value, help_text) in sorted((gauges or {}).items()):
+            full = f"{PREFIX}_{name}"
+            kind = "counter" if name.endswith("_total") else "gauge"
+            lines += [f"# HELP {full} {help_text}", f"# TYPE {full} {kind}", f"{full} {_number(value)}"]
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
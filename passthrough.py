@@ -0,0 +1,408 @@
+"""
+Detail CSV straight from the accepted source lines.
+
+Accepted rows already are CSV lines with the columns in output order, so
+instead of parsing every value into a DataFrame and formatting it again the
+lines are copied through: the "yy/mm/dd HH:MM:SS" date is rewritten as
+"YYYY-MM-DD HH:MM:SS" and the step name is appended.  The channel values
+keep the tester's own formatting.  Numbers are only read where an output
+is computed from them: the date (rows with an impossible date are dropped,
+like the dropna() of the DataFrame path) and, with durations, the
+Step Time (s) / Total Time (s) columns, and with summary or store the
+columns that summary.StepAccumulator reduces or colstore.StoreWriter keeps.
+
+Every batch of rows is assembled with one NumPy gather of byte slices, so
+the export runs at about the speed of gzip, and memory is bounded by the
+batch size like chunked.ChunkedExport.
+"""
+import time
+
+import numpy as np
+
+from colstore import StoreWriter
+from compression import GzipCompressor
+from summary import SUMMARY_COLUMNS, StepAccumulator
+from utils import (BATCH_SIZE, COLUMN_NAMES, DURATION_COLUMNS, OriginParser, iter_source_chunks, parse_duration,
+                   parse_system_time, slice_bytes, to_float)
+
+DATE_WIDTH = 17  # yy/mm/dd HH:MM:SS
+ISO_WIDTH = 19  # YYYY-MM-DD HH:MM:SS
+INT_DIGITS = 10  # Whole seconds written by the fast path
+_CONSTANTS = np.frombuffer(b"\n,.0", dtype=np.uint8)
+_NEWLINE, _COMMA, _POINT_ZERO = 0, 1, 2  # Offsets in _CONSTANTS
+_POWERS = 10 ** np.arange(INT_DIGITS - 1, -1, -1, dtype=np.int64)
+FIELD_INDEX = {name: i for i, name in enumerate(COLUMN_NAMES[:-1])}  # Field of every column in the source line
+SECONDS_COLUMNS = {seconds: name for name, seconds in DURATION_COLUMNS.items()}
+
+
+def header(durations=True):
+    columns = COLUMN_NAMES + (list(DURATION_COLUMNS.values()) if durations else [])
+    return ",".join(columns) + "\n"
+
+
+def csv_field(text):
+    """
+    text quoted the way to_csv quotes it.
+    """
+    if any(c in text for c in ',"\n\r'):
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+class LineAssembler:
+    """
+    Output lines built from a fixed sequence of byte slices per row.  The
+    slices point into sources added with source(); join() gathers all of
+    them at once.
+    """
+
+    def __init__(self, n_rows):
+        self.n_rows = n_rows
+        self._sources = [_CONSTANTS]
+        self._size = len(_CONSTANTS)
+        self._lo = []
+        self._hi = []
+
+    def source(self, array):
+        """
+        Add a uint8 array and return the offset of its first byte.
+        """
+        offset = self._size
+        self._sources.append(np.ascontiguousarray(array, dtype=np.uint8).ravel())
+        self._size += len(self._sources[-1])
+        return offset
+
+    def slice(self, lo, hi):
+        self._lo.append(np.broadcast_to(lo, self.n_rows))
+        self._hi.append(np.broadcast_to(hi, self.n_rows))
+
+    def constant(self, offset, length=1):
+        self.slice(offset, offset + length)
+
+    def join(self, keep):
+        """
+        The lines of the rows in keep as bytes, and the end offset of the
+        line of every row (the lines of the other rows are empty).
+        """
+        sources = np.concatenate(self._sources)
+        lo = np.column_stack(self._lo)
+        lengths = np.column_stack(self._hi) - lo
+        lengths[~keep] = 0
+        lengths = lengths.ravel()
+        ends = np.cumsum(lengths)
+        total = int(ends[-1]) if len(ends) else 0
+        index = np.arange(total) + np.repeat(lo.ravel() - (ends - lengths), lengths)
+        return sources[index].tobytes(), ends.reshape(self.n_rows, -1)[:, -1]
+
+
+def format_rows(data: bytes, codes, names, durations=True, values=()):
+    """
+    Output lines for the accepted rows in data; codes[i] is the index in
+    names (CSV-quoted step names) of the step of row i.  Returns (text,
+    ends): the line of row i is text[ends[i - 1]:ends[i]], empty when the
+    row was dropped for its date.  values (detail column names other than
+    Step name) adds a third item, {name: column} for all rows (see
+    source_columns()).
+    """
+    n_rows = len(codes)
+    buf = np.frombuffer(data, dtype=np.uint8)
+    line_ends = np.flatnonzero(buf == ord("\n"))
+    starts = np.empty_like(line_ends)
+    starts[0] = 0
+    starts[1:] = line_ends[:-1] + 1
+    commas = np.flatnonzero(buf == ord(",")).reshape(n_rows, -1)
+    if commas.shape[1] != len(COLUMN_NAMES) - 2:
+        raise ValueError(f"unexpected column count: {commas.shape[1] + 1}")
+
+    dates = buf[starts[:, None] + np.arange(DATE_WIDTH)]
+    system_time = parse_system_time(dates.view(f"S{DATE_WIDTH}").ravel())
+    rows = np.arange(n_rows)
+
+    lines = LineAssembler(n_rows)
+    line_base = lines.source(buf)
+    iso_base = lines.source(iso_dates(dates, system_time))
+    lines.slice(iso_base + rows * ISO_WIDTH, iso_base + (rows + 1) * ISO_WIDTH)
+    lines.slice(line_base + starts + DATE_WIDTH, line_base + line_ends)
+
+    encoded = [("," + name).encode("utf-8") for name in names]
+    name_ends = np.cumsum([len(name) for name in encoded], dtype=np.int64)
+    name_base = lines.source(np.frombuffer(b"".join(encoded), dtype=np.uint8))
+    codes = np.asarray(codes)
+    lines.slice(name_base + (name_ends - np.diff(name_ends, prepend=0))[codes], name_base + name_ends[codes])
+
+    if durations:
+        for lo, hi in ((commas[:, 0] + 1, commas[:, 1]), (commas[:, -1] + 1, line_ends)):
+            lines.constant(_COMMA)
+            add_seconds(lines, buf, line_base, lo, hi)
+    lines.constant(_NEWLINE)
+    text, ends = lines.join(~np.isnat(system_time))
+    if not values:
+        return text, ends
+    return text, ends, source_columns(buf, starts, line_ends, commas, system_time, values)
+
+
+def source_columns(buf, starts, line_ends, commas, system_time, names):
+    """
+    The named detail columns as the DataFrame path reads them: Step Time /
+    Total Time as the raw bytes, their seconds columns parsed, the channels
+    as float64.
+    """
+    lo = np.column_stack((starts, commas + 1))
+    hi = np.column_stack((commas, line_ends))
+    fields = {}
+    columns = {}
+    for name in names:
+        if name == "System Time":
+            columns[name] = system_time
+            continue
+        k = FIELD_INDEX[SECONDS_COLUMNS.get(name, name)]
+        if k not in fields:
+            fields[k] = slice_bytes(buf, lo[:, k], hi[:, k])
+        if name in SECONDS_COLUMNS:
+            columns[name] = parse_duration(fields[k])
+        elif name in DURATION_COLUMNS:
+            columns[name] = fields[k]
+        else:
+            columns[name] = to_float(fields[k])
+    return columns
+
+
+def iso_dates(dates, system_time):
+    """
+    (n, 17) "yy/mm/dd HH:MM:SS" bytes as (n, 19) "YYYY-MM-DD HH:MM:SS"
+    bytes; years follow %y like parse_system_time.
+    """
+    iso = np.empty((len(dates), ISO_WIDTH), dtype=np.uint8)
+    yy = (dates[:, 0].astype(np.int64) - ord("0")) * 10 + dates[:, 1] - ord("0")
+    modern = yy < 69
+    iso[:, 0] = np.where(modern, ord("2"), ord("1"))
+    iso[:, 1] = np.where(modern, ord("0"), ord("9"))
+    iso[:, 2:4] = dates[:, 0:2]
+    iso[:, 4] = iso[:, 7] = ord("-")
+    iso[:, 5:7] = dates[:, 3:5]
+    iso[:, 8:10] = dates[:, 6:8]
+    iso[:, 10:] = dates[:, 8:]
+    # Seconds 60 and 61 roll over into the next minute, as in the DataFrame
+    leap = np.flatnonzero(dates[:, 15] >= ord("6"))
+    leap = leap[~np.isnat(system_time[leap])]
+    if len(leap):
+        text = np.char.replace(np.datetime_as_string(system_time[leap], unit="s"), "T", " ")
+        iso[leap] = text.astype(f"S{ISO_WIDTH}").view(np.uint8).reshape(-1, ISO_WIDTH)
+    return iso
+
+
+def add_seconds(lines, buf, line_base, lo, hi):
+    """
+    Add the seconds of the "H:MM:SS.s" fields buf[lo:hi] as a slice: the
+    whole seconds followed by the field's own decimals (".0" when it has
+    none).  Values that cannot be written that way fall back to repr() and
+    NaN stays empty, as to_csv writes them.
+    """
+    n_rows = len(lo)
+    field = slice_bytes(buf, lo, hi)
+    seconds = parse_duration(field)
+    chars = field.view(np.uint8).reshape(n_rows, -1)
+    positions = np.arange(chars.shape[1])
+    length = hi - lo
+    inside = positions < length[:, None]
+    is_point = (chars == ord(".")) & inside
+    has_point = is_point.any(axis=1)
+    point = np.where(has_point, is_point.argmax(axis=1), length)
+    last_colon = chars.shape[1] - 1 - (chars == ord(":"))[:, ::-1].argmax(axis=1)
+    # Only digits, the two colons and one decimal point after them
+    plain = np.where(inside, ((chars - np.uint8(ord("0"))) < 10) | (chars == ord(":")) | is_point, True).all(axis=1)
+    simple = (plain & (is_point.sum(axis=1) <= 1) & (~has_point | ((point > last_colon) & (length - point > 1)))
+              & (seconds >= 0) & (seconds < 10 ** INT_DIGITS))
+
+    whole = np.where(simple, np.floor(np.where(simple, seconds, 0)), 0).astype(np.int64)
+    digits = (whole[:, None] // _POWERS % 10 + ord("0")).astype(np.uint8)
+    n_digits = 1 + (whole[:, None] >= _POWERS[:-1]).sum(axis=1)
+    digit_ends = lines.source(digits) + (np.arange(n_rows) + 1) * INT_DIGITS
+
+    odd = np.flatnonzero(~simple & ~np.isnan(seconds))
+    texts = [repr(value).encode("ascii") for value in seconds[odd].tolist()]
+    odd_lo = np.zeros(n_rows, dtype=np.int64)
+    odd_hi = np.zeros(n_rows, dtype=np.int64)
+    odd_hi[odd] = lines.source(np.frombuffer(b"".join(texts), dtype=np.uint8)) + np.cumsum(
+        [len(text) for text in texts], dtype=np.int64)
+    odd_lo[odd] = odd_hi[odd] - [len(text) for text in texts]
+
+    lines.slice(np.where(simple, digit_ends - n_digits, odd_lo), np.where(simple, digit_ends, odd_hi))
+    decimals = simple & has_point
+    zero = simple & ~has_point
+    lines.slice(np.where(decimals, line_base + lo + point, np.where(zero, _POINT_ZERO, 0)),
+                np.where(decimals, line_base + hi, np.where(zero, _POINT_ZERO + 2, 0)))
+
+
+class PassthroughExport:
+    """
+    Push interface like chunked.ChunkedExport: feed() bytes as they come,
+    finish() writes the step file and returns a summary.  durations adds
+    the Step Time (s) / Total Time (s) columns; summary adds the per-step
+    summary of the file (see finish()); store is a folder to write the
+    column store of the detail rows to.
+    """
+
+    def __init__(self, detail_path, step_path, compressor=None, durations=True, batch_size=BATCH_SIZE,
+                 summary=False, store=None):
+        self.step_path = step_path
+        self.durations = durations
+        self.batch_size = batch_size
+        self.compressor = compressor or GzipCompressor()
+        self.parser = OriginParser(self._add_rows)
+        self.header = header(durations).encode("utf-8")
+        self.rows = 0  # Detail rows written (rows with a valid System Time)
+        self.seconds = {"csv": 0.0, "gzip": 0.0, **({"summary": 0.0} if summary else {}),
+                        **({"store": 0.0} if store else {})}
+        self.csv_bytes = 0
+        self.steps = StepAccumulator() if summary else None
+        self.store = StoreWriter(store) if store else None
+        self.columns = self.header.decode("utf-8").rstrip("\n").split(",")  # Detail columns, for the store
+        # Columns read from the source for the summary and the store
+        self._values = [name for name in self.columns if name != "Step name"
+                        and ((summary and name in SUMMARY_COLUMNS) or store)]
+        self._names = []  # CSV-quoted step names
+        self._name_index = {}
+        self._batch = []
+        self._batch_codes = []
+        self._batch_rows = []
+        self._batch_bytes = 0
+        self._base = 0  # Row index of the first row in the batch
+        self._end_lines = {}  # Row index -> CSV line, for step ends and the last row of each batch
+        self._detail = open(detail_path, "wb")
+        self._compressor = self.compressor.compressobj()
+        self._output(self.header)
+
+    def feed(self, data: bytes):
+        self.parser.feed(data)
+
+    def finish(self):
+        """
+        Flush the last batch and write the step file.  Returns
+        {"rows", "step_rows", "csv_bytes", "seconds"}, plus with summary
+        "step_summary": summary.step_summary() of the file, or None when it
+        has no "$" loop lines.
+        """
+        try:
+            ends = self.parser.finish()
+            self._convert()
+            if self.parser.row_count == 0:
+                raise Exception("無法從檔案中提取有效數據，請確認檔案內容。")
+            self._write(self._compressor.flush())
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self._detail.close()
+
+        if self.store is not None:
+            started = time.perf_counter()
+            self.store.finish(ends)
+            self.seconds["store"] += time.perf_counter() - started
+        lines = [self._end_lines[end] for end in ends if end in self._end_lines]
+        with open(self.step_path, "wb") as f:
+            f.write(self.compressor.compress(self.header + b"".join(lines)))
+        result = {"rows": self.rows, "step_rows": len(lines), "csv_bytes": self.csv_bytes, "seconds": self.seconds}
+        if self.steps is not None:
+            started = time.perf_counter()
+            loops = self.parser.loop_list
+            result["step_summary"] = self.steps.finish(ends, loops) if loops else None
+            self.seconds["summary"] += time.perf_counter() - started
+        return result
+
+    def abort(self):
+        self._detail.close()
+        if self.store is not None:
+            self.store.abort()
+
+    def _add_rows(self, data: bytes, n_rows: int, step_name: str):
+        code = self._name_index.get(step_name)
+        if code is None:
+            code = self._name_index[step_name] = len(self._names)
+            self._names.append(csv_field(step_name))
+        self._batch.append(data)
+        self._batch_codes.append(code)
+        self._batch_rows.append(n_rows)
+        self._batch_bytes += len(data)
+        if self._batch_bytes >= self.batch_size:
+            self._convert()
+
+    def _convert(self):
+        """
+        Write the batched rows and keep the lines of their step ends (and of
+        the last row, whose step may end with the next header line).
+        """
+        if not self._batch:
+            return
+        started = time.perf_counter()
+        data = b"".join(self._batch)
+        if not data.isascii():
+            data = data.decode(self.parser.encoding, errors="replace").encode("utf-8")
+        codes = np.repeat(np.array(self._batch_codes, dtype=np.int64), self._batch_rows)
+        text, ends, *values = format_rows(data, codes, self._names, self.durations, self._values)
+        del data
+        first, self._base = self._base, self._base + len(codes)
+        self._batch = []
+        self._batch_codes = []
+        self._batch_rows = []
+        self._batch_bytes = 0
+
+        known = [end for end in self.parser.last_time_per_step_list if first <= end < self._base]
+        for index in dict.fromkeys(known + [self._base - 1]):
+            i = index - first
+            start = int(ends[i - 1]) if i else 0
+            if ends[i] > start:
+                self._end_lines[index] = text[start:int(ends[i])]
+        self.rows += int(np.count_nonzero(np.diff(ends, prepend=0)))
+        self.seconds["csv"] += time.perf_counter() - started
+        if values:
+            self._add_values(values[0], codes, first, known)
+        self._output(text)
+
+    def _add_values(self, columns, codes, first, known):
+        """
+        Add the rows that have a valid date to the summary and the store.
+        """
+        keep = np.flatnonzero(~np.isnat(columns["System Time"]))
+        columns = {name: values[keep] for name, values in columns.items()}
+        labels = first + keep
+        if self.steps is not None:
+            started = time.perf_counter()
+            columns["Step name"] = np.array(list(self._name_index), dtype=object)[codes[keep]]
+            self.steps.add(labels, columns, known)
+            self.seconds["summary"] += time.perf_counter() - started
+        if self.store is not None:
+            started = time.perf_counter()
+            columns["Step name"] = (codes[keep], list(self._name_index))
+            self.store.append({name: columns[name] for name in self.columns}, labels, known + [self._base - 1])
+            self.seconds["store"] += time.perf_counter() - started
+
+    def _output(self, text):
+        self.csv_bytes += len(text)
+        started = time.perf_counter()
+        self._write(self._compressor.compress(text))
+        self.seconds["gzip"] += time.perf_counter() - started
+
+    def _write(self, data):
+        if data:
+            self._detail.write(data)
+
+
+def passthrough_chunks(chunks, detail_path, step_path, compressor=None, durations=True, summary=False, store=None):
+    """
+    Convert the byte chunks of one tester file into gzip-compressed detail
+    and step CSV files; returns the PassthroughExport summary.
+    """
+    export = PassthroughExport(detail_path, step_path, compressor, durations, summary=summary, store=store)
+    try:
+        for chunk in chunks:
+            export.feed(chunk)
+    except BaseException:
+        export.abort()
+        raise
+    return export.finish()
+
+
+def passthrough_file(source, detail_path, step_path, compressor=None, durations=True, summary=False, store=None):
+    return passthrough_chunks(iter_source_chunks(source), detail_path, step_path, compressor, durations, summary,
+                              store)
@@ -0,0 +1,151 @@
+"""
+Per-step decimation of the V/I/T channels for previews.
+
+Both methods work on every step at once with segment reductions, so the
+cost does not grow with the number of steps:
+
+- "minmax" keeps the minimum and maximum of every bucket, which preserves
+  spikes exactly.
+- "lttb" is Largest-Triangle-Three-Buckets; it loops over bucket positions
+  (not over steps or rows) and is vectorized across all steps.
+
+Steps with no more rows than the requested points are kept whole.
+"""
+import numpy as np
+
+METHODS = ("minmax", "lttb")
+PREVIEW_CHANNELS = ("V", "I", "T")
+
+
+def build_preview(df, step_df, points=500, method="minmax", channels=PREVIEW_CHANNELS):
+    """
+    Decimate the detail frame per step.  x is seconds since the first row's
+    System Time; NaN values come back as None so the result is valid JSON.
+    """
+    if method not in METHODS:
+        raise ValueError(f"unknown preview method: {method}")
+    points = max(int(points), 4)
+    if len(df) == 0:
+        return {"method": method, "points": points, "start_time": None, "steps": []}
+
+    times = df["System Time"].to_numpy(dtype="datetime64[ns]").view(np.int64)
+    x = (times - times[0]) / 1e9
+    starts, counts = step_ranges(df, step_df)
+    names = df["Step name"].to_numpy()[starts]
+
+    series = {}
+    for channel in channels:
+        y = df[channel].to_numpy(dtype=np.float64)
+        if method == "minmax":
+            selected = minmax_indices(y, starts, counts, points)
+        else:
+            selected = lttb_indices(x, y, starts, counts, points)
+        bounds = np.searchsorted(selected, np.append(starts, len(df)))
+        t_values = np.round(x[selected], 3).tolist()
+        y_values = _json_floats(y[selected])
+        series[channel] = (bounds, t_values, y_values)
+
+    steps = []
+    for k in range(len(starts)):
+        step = {"step": k + 1, "name": str(names[k]), "rows": int(counts[k]), "series": {}}
+        for channel, (bounds, t_values, y_values) in series.items():
+            lo, hi = bounds[k], bounds[k + 1]
+            step["series"][channel] = {"t": t_values[lo:hi], "y": y_values[lo:hi]}
+        steps.append(step)
+
+    return {
+        "method": method,
+        "points": points,
+        "start_time": str(df["System Time"].iloc[0]),
+        "steps": steps,
+    }
+
+
+def step_ranges(df, step_df):
+    """
+    (starts, counts) of every step as row positions in df.  step_df holds the
+    last row of each step, indexed by the same labels as df.
+    """
+    ends = np.unique(df.index.get_indexer(step_df.index))
+    ends = ends[ends >= 0]
+    if len(ends) == 0 or ends[-1] != len(df) - 1:
+        ends = np.append(ends, len(df) - 1)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    return starts, ends - starts + 1
+
+
+def minmax_indices(y, starts, counts, points):
+    """
+    Sorted row indices keeping the min and max of points // 2 buckets per step.
+    """
+    short = counts <= points
+    kept = [_ranges(starts[short], starts[short] + counts[short])[0]]
+    if not short.all():
+        start, count = starts[~short], counts[~short]
+        n_buckets = points // 2
+        edges = start[:, None] + (np.arange(n_buckets + 1)[None, :] * count[:, None]) // n_buckets
+        idx, offsets, lengths = _ranges(edges[:, :-1].ravel(), edges[:, 1:].ravel())
+        values = y[idx]
+        kept.append(idx[_segment_argmax(np.where(np.isnan(values), -np.inf, values), offsets, lengths)])
+        kept.append(idx[_segment_argmax(np.where(np.isnan(values), -np.inf, -values), offsets, lengths)])
+    return np.unique(np.concatenate(kept))
+
+
+def lttb_indices(x, y, starts, counts, points):
+    """
+    Sorted row indices chosen by Largest-Triangle-Three-Buckets per step.
+    """
+    short = counts <= points
+    kept = [_ranges(starts[short], starts[short] + counts[short])[0]]
+    if not short.all():
+        start, count = starts[~short], counts[~short]
+        last = start + count - 1
+        n_buckets = points - 2
+        # Bucket j of a step covers rows edges[:, j] .. edges[:, j + 1] - 1 (first and last row excluded)
+        edges = start[:, None] + 1 + (np.arange(n_buckets + 1)[None, :] * (count[:, None] - 2)) // n_buckets
+        y_filled = np.where(np.isnan(y), 0.0, y)
+        x_sums = np.concatenate(([0.0], np.cumsum(x)))
+        y_sums = np.concatenate(([0.0], np.cumsum(y_filled)))
+
+        selected = start
+        kept.extend((start, last))
+        for j in range(n_buckets):
+            if j + 1 < n_buckets:
+                lo, hi = edges[:, j + 1], edges[:, j + 2]
+                next_x = (x_sums[hi] - x_sums[lo]) / (hi - lo)
+                next_y = (y_sums[hi] - y_sums[lo]) / (hi - lo)
+            else:
+                next_x, next_y = x[last], y_filled[last]
+            idx, offsets, lengths = _ranges(edges[:, j], edges[:, j + 1])
+            segment = np.repeat(np.arange(len(start)), lengths)
+            ax, ay = x[selected][segment], y_filled[selected][segment]
+            area = np.abs((ax - next_x[segment]) * (y[idx] - ay) - (ax - x[idx]) * (next_y[segment] - ay))
+            selected = idx[_segment_argmax(np.where(np.isnan(area), -np.inf, area), offsets, lengths)]
+            kept.append(selected)
+    return np.unique(np.concatenate(kept))
+
+
+def _ranges(lo, hi):
+    """
+    Concatenation of arange(lo[k], hi[k]) for every k, with the offset and
+    length of each range inside it.
+    """
+    lengths = hi - lo
+    offsets = np.cumsum(lengths) - lengths
+    idx = np.arange(lengths.sum()) + np.repeat(lo - offsets, lengths)
+    return idx, offsets, lengths
+
+
+def _segment_argmax(values, offsets, lengths):
+    """
+    Position of the first maximum of every (non-empty) segment of values.
+    """
+    peaks = np.maximum.reduceat(values, offsets)
+    positions = np.where(values == np.repeat(peaks, lengths), np.arange(len(values)), len(values))
+    return np.minimum.reduceat(positions, offsets)
+
+
+def _json_floats(values):
+    out = values.astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
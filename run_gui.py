@@ -44,16 +44,13 @@ def main():
         
         # Process the file
         try:
-            rows, steps = extract_origin_csv(fpath)
+            columns, steps = extract_origin_csv(fpath)
         except Exception as e:
             messagebox.showerror("Processing Error", f"Error processing file:\n\n{str(e)}\n\nPlease check if this is a valid battery tester file.")
             return
         
         # Create DataFrame
-        df = pd.DataFrame(rows)
-        df.columns = ["System Time", "Step Time", "V", "I", "T", "R", "P", "mAh", "Wh", "Total Time", "Step name"]
-        df["System Time"] = df["System Time"].apply(lambda s: pd.to_datetime(s, format="%y/%m/%d %H:%M:%S"))
-        df[["V", "I", "T", "R", "P", "mAh", "Wh"]] = df[["V", "I", "T", "R", "P", "mAh", "Wh"]].astype(dtype=float)
+        df = columns.to_dataframe()
         
         filename_head = os.path.basename(fpath).split(".")[0]
         
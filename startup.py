@@ -0,0 +1,129 @@
+"""
+Startup (cold import) benchmark.
+
+    python startup.py --repeat 5 -o startup.json
+    python startup.py utils passthrough --top 20
+
+Every module is imported in a fresh interpreter with -X importtime, so each
+figure is the cost a cold process pays for it, dependencies included.  For
+every module the report lists the cumulative import time, the heavy
+third-party packages it drags in and its heaviest direct imports; the
+cold start of the app (import, then the first /health response) is timed
+the same way.  The best of --repeat runs is kept.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+from datetime import datetime
+
+MODULES = ("utils", "excel", "compression", "passthrough", "chunked", "columnar", "preview", "colstore",
+           "cache", "ingest", "jobs", "metrics", "zipstream", "app_production")
+HEAVY = ("numpy", "pandas", "openpyxl", "flask", "werkzeug", "multiprocessing")
+COLD_START = """
+import time
+started = time.perf_counter()
+import app_production
+imported = time.perf_counter()
+app_production.app.test_client().get('/health')
+print(imported - started, time.perf_counter() - started)
+"""
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def parse_importtime(text):
+    """
+    [(name, depth, self_us, cumulative_us)] from -X importtime output.
+    """
+    records = []
+    for line in text.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append((name, (len(indent) - 1) // 2, int(self_us), int(cumulative_us)))
+    return records
+
+
+def measure_import(module, cwd):
+    """
+    Import module in a fresh interpreter; returns the record of the run.
+    """
+    code = f"import {module}; import sys, json; print(json.dumps(sorted(set(sys.modules) & set({HEAVY!r}))))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd,
+                          capture_output=True, text=True, check=True)
+    records = parse_importtime(proc.stderr)
+    # Imports are reported after their own imports: the module's subtree is the
+    # run of nested records right before its top-level record
+    end = next((i for i, r in enumerate(records) if r[0] == module and r[1] == 0), None)
+    total = records[end][3] if end is not None else None
+    start = end or 0
+    while start and records[start - 1][1] > 0:
+        start -= 1
+    # Direct imports of the module; a dependency is charged to the first import that loads it
+    imports = [(name, cumulative) for name, depth, _, cumulative in records[start:end] if depth == 1]
+    return {
+        "module": module,
+        "seconds": total / 1e6 if total is not None else None,
+        "heavy": json.loads(proc.stdout.strip().splitlines()[-1]),
+        "imports": sorted(imports, key=lambda item: -item[1]),
+    }
+
+
+def measure_cold_start(cwd):
+    """
+    (import, first /health response) seconds of app_production in a fresh
+    interpreter, counted from the start of the import.
+    """
+    proc = subprocess.run([sys.executable, "-c", COLD_START], cwd=cwd, capture_output=True, text=True, check=True)
+    imported, health = map(float, proc.stdout.split()[-2:])
+    return {"import_seconds": imported, "health_seconds": health}
+
+
+def environment():
+    versions = {}
+    for name in ("numpy", "pandas", "flask", "openpyxl"):
+        proc = subprocess.run([sys.executable, "-c", f"import {name}; print({name}.__version__)"],
+                              capture_output=True, text=True)
+        versions[name] = proc.stdout.strip() if proc.returncode == 0 else None
+    return {"python": platform.python_version(), "platform": platform.platform(), **versions}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the cold import time of each module.")
+    parser.add_argument("modules", nargs="*", help=f"modules to import (default: {' '.join(MODULES)})")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per module; the fastest is kept")
+    parser.add_argument("--top", type=int, default=5, help="heaviest imports listed per module")
+    parser.add_argument("--no-cold-start", action="store_true", help="skip the /health cold start measurement")
+    parser.add_argument("-o", "--output", help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    results = {"created": datetime.now().isoformat(timespec="seconds"), "environment": environment(),
+               "modules": [], "cold_start": None}
+    for module in args.modules or MODULES:
+        runs = [measure_import(module, cwd) for _ in range(args.repeat)]
+        best = min(runs, key=lambda run: run["seconds"] if run["seconds"] is not None else float("inf"))
+        results["modules"].append(best)
+        seconds = f"{best['seconds'] * 1000:9.1f} ms" if best["seconds"] is not None else "  (already loaded)"
+        print(f"{module:<16} {seconds}  heavy: {', '.join(best['heavy']) or '-'}", flush=True)
+        for name, cumulative in best["imports"][:args.top]:
+            print(f"    {name:<40} {cumulative / 1000:9.1f} ms")
+
+    if not args.no_cold_start:
+        runs = [measure_cold_start(cwd) for _ in range(args.repeat)]
+        results["cold_start"] = min(runs, key=lambda run: run["health_seconds"])
+        print(f"cold start: import {results['cold_start']['import_seconds'] * 1000:.1f} ms, "
+              f"first /health {results['cold_start']['health_seconds'] * 1000:.1f} ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=1)
+        print(f"results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
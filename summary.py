@@ -0,0 +1,230 @@
+"""
+Per-step and per-cycle summary of processed tester data.
+
+Steps are the row ranges that end at the step end rows of the step file, so
+every step aggregate is a NumPy segment reduction (ufunc.reduceat) over the
+detail columns.  The writers that never hold the whole file (chunked,
+passthrough) reduce each batch to partial aggregates with StepAccumulator
+and merge them per step at the end; step_summary() is the same with one
+batch.  Cycles are the runs of consecutive steps with the same cycle
+number, taken from the "$" loop lines (OriginParser.loop_list), and are
+reduced the same way over the step aggregates.  Nothing loops in Python per
+row, step or cycle, so tests with tens of thousands of cycles take
+milliseconds.
+
+A step counts as charge or discharge by its name ("Charge" / "充電",
+"Discharge" / "放電", "Rest" / "靜置") and otherwise by the sign of its
+mean current.  Its capacity and energy are the largest |mAh| and |Wh| it
+reaches, as the tester counts both from zero in every step.
+"""
+import csv
+import io
+
+import numpy as np
+
+from utils import widen_float32
+
+STEP_TYPES = ("rest", "charge", "discharge")
+REST, CHARGE, DISCHARGE = range(len(STEP_TYPES))
+# Checked in order, so "discharge" is found before "charge"
+STEP_KEYWORDS = (("rest", REST), ("靜置", REST), ("discharge", DISCHARGE), ("dchg", DISCHARGE),
+                 ("放電", DISCHARGE), ("charge", CHARGE), ("chg", CHARGE), ("充電", CHARGE))
+SUMMARY_COLUMNS = ("System Time", "Step Time (s)", "V", "I", "mAh", "Wh", "Step name")
+CSV_DECIMALS = {"Mean V": 4, "Mean I": 4, "Duration (s)": 1,
+                "Coulombic Efficiency (%)": 3, "Energy Efficiency (%)": 3}
+
+
+def step_type(name):
+    """
+    STEP_TYPES index of a step name, or None when the name does not tell.
+    """
+    lowered = str(name).lower()
+    for keyword, kind in STEP_KEYWORDS:
+        if keyword in lowered:
+            return kind
+    return None
+
+
+def as_float64(values):
+    """
+    A column as float64; compact float32 columns are widened to the float64
+    the full frame holds.
+    """
+    values = np.asarray(values)
+    return widen_float32(values) if values.dtype == np.float32 else values.astype(np.float64)
+
+
+def segment_ends(starts, n):
+    return np.r_[starts[1:], n][:len(starts)] - 1
+
+
+def reduce_segments(labels, columns, starts):
+    """
+    Partial aggregates of the rows labels[starts[i]:starts[i + 1]].
+    """
+    last = segment_ends(starts, len(labels))
+    part = {"first": labels[starts], "last": labels[last], "rows": last - starts + 1}
+    for name in ("V", "I"):
+        values = as_float64(columns[name])
+        valid = ~np.isnan(values)
+        part[name] = np.add.reduceat(np.where(valid, values, 0.0), starts)
+        part[name + " count"] = np.add.reduceat(valid.astype(np.int64), starts)
+    for name in ("mAh", "Wh"):
+        part[name] = np.fmax.reduceat(np.abs(as_float64(columns[name])), starts)
+    part["Step Time (s)"] = np.fmax.reduceat(as_float64(columns["Step Time (s)"]), starts)
+    times = np.asarray(columns["System Time"], dtype="datetime64[ns]")
+    part["Start Time"], part["End Time"] = times[starts], times[last]
+    part["Step name"] = np.asarray(columns["Step name"], dtype=object)[starts].astype(str)
+    return part
+
+
+class StepAccumulator:
+    """
+    Step aggregates collected batch by batch.  add() reduces a batch to one
+    partial aggregate per run of rows between the step ends known so far;
+    finish() merges the partials of every step with the same reductions.
+    """
+
+    def __init__(self):
+        self._parts = []
+
+    def add(self, labels, columns, known_ends=()):
+        """
+        Reduce one batch: labels are the increasing row indices of its rows,
+        columns {name: array} holds SUMMARY_COLUMNS for them and known_ends
+        the step ends known so far (only those inside the batch matter).
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        if len(labels) == 0:
+            return
+        cuts = np.searchsorted(labels, np.asarray(known_ends, dtype=np.int64), side="right")
+        starts = np.unique(np.r_[0, cuts[cuts < len(labels)]])
+        self._parts.append(reduce_segments(labels, columns, starts))
+
+    def finish(self, step_ends, loops=()):
+        """
+        {column: array} with one entry per step that ends at a row of the
+        batches; a step belongs to the cycle of the last loop marker at or
+        before its first row, or cycle 0 before any marker.
+        """
+        if self._parts:
+            part = {key: np.concatenate([part[key] for part in self._parts]) for key in self._parts[0]}
+        else:
+            empty = {name: np.zeros(0) for name in SUMMARY_COLUMNS}
+            empty["System Time"] = np.zeros(0, dtype="datetime64[ns]")
+            part = reduce_segments(np.zeros(0, dtype=np.int64), empty, np.zeros(0, dtype=np.int64))
+
+        # Step ends that are not rows of the output (dropped dates) join their rows to the next step;
+        # the rows after the last step end are dropped
+        step_ends = np.asarray(step_ends, dtype=np.int64)
+        ends = np.unique(step_ends[np.isin(step_ends, part["last"])])
+        step = np.searchsorted(ends, part["first"])
+        keep = step < len(ends)
+        part = {key: values[keep] for key, values in part.items()}
+        step = step[keep]
+        starts = np.flatnonzero(np.r_[True, step[1:] != step[:-1]]) if len(step) else np.zeros(0, dtype=np.int64)
+        last = segment_ends(starts, len(step))
+
+        def total(name):
+            return np.add.reduceat(part[name], starts)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_v = total("V") / total("V count")
+            mean_i = total("I") / total("I count")
+        names = part["Step name"][starts]
+        unique_names, name_codes = np.unique(names, return_inverse=True)
+        by_name = np.array([step_type(name) for name in unique_names], dtype=object)
+        by_name = np.where(by_name == None, -1, by_name).astype(np.int64)  # noqa: E711
+        by_current = np.where(mean_i > 0, CHARGE, np.where(mean_i < 0, DISCHARGE, REST))
+        named = by_name[name_codes]
+        kinds = np.where(named >= 0, named, by_current)
+
+        loops = np.asarray(loops, dtype=np.int64).reshape(-1, 2)
+        cycle_of = np.r_[0, loops[:, 1]]  # [0]: before the first marker
+        cycles = cycle_of[np.searchsorted(loops[:, 0], part["first"][starts], side="right")]
+
+        return {
+            "Step": np.arange(1, len(starts) + 1),
+            "Cycle": cycles,
+            "Step name": names,
+            "Type": np.array(STEP_TYPES, dtype=object)[kinds],
+            "Start Time": part["Start Time"][starts],
+            "End Time": part["End Time"][last],
+            "Duration (s)": np.fmax.reduceat(part["Step Time (s)"], starts),
+            "Rows": total("rows"),
+            "Capacity (mAh)": np.fmax.reduceat(part["mAh"], starts),
+            "Energy (Wh)": np.fmax.reduceat(part["Wh"], starts),
+            "Mean V": mean_v,
+            "Mean I": mean_i,
+        }
+
+
+def step_summary(df, step_ends, loops=()):
+    """
+    {column: array} with one entry per step of df, the steps ending at the
+    index labels step_ends (see StepAccumulator.finish).
+    """
+    steps = StepAccumulator()
+    steps.add(df.index.to_numpy(), {name: df[name].to_numpy() for name in SUMMARY_COLUMNS}, step_ends)
+    return steps.finish(step_ends, loops)
+
+
+def cycle_summary(steps):
+    """
+    {column: array} with one entry per cycle of a step_summary(): charge
+    and discharge capacity and energy, coulombic and energy efficiency (%),
+    the row-weighted mean voltage and the duration.
+    """
+    cycles = steps["Cycle"]
+    starts = np.flatnonzero(np.r_[True, cycles[1:] != cycles[:-1]]) if len(cycles) else np.zeros(0, dtype=np.int64)
+    ends = segment_ends(starts, len(cycles))
+
+    def total(values, mask=True):
+        return np.add.reduceat(np.where(mask, values, 0), starts)
+
+    charge, discharge = steps["Type"] == STEP_TYPES[CHARGE], steps["Type"] == STEP_TYPES[DISCHARGE]
+    charge_capacity = total(steps["Capacity (mAh)"], charge)
+    discharge_capacity = total(steps["Capacity (mAh)"], discharge)
+    charge_energy = total(steps["Energy (Wh)"], charge)
+    discharge_energy = total(steps["Energy (Wh)"], discharge)
+    has_v = ~np.isnan(steps["Mean V"])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        coulombic = np.where(charge_capacity > 0, discharge_capacity / charge_capacity * 100, np.nan)
+        energy = np.where(charge_energy > 0, discharge_energy / charge_energy * 100, np.nan)
+        mean_v = total(steps["Mean V"] * steps["Rows"], has_v) / total(steps["Rows"], has_v)
+    return {
+        "Cycle": cycles[starts],
+        "Steps": ends - starts + 1,
+        "Start Time": steps["Start Time"][starts],
+        "End Time": steps["End Time"][ends],
+        "Duration (s)": total(steps["Duration (s)"]),
+        "Charge Capacity (mAh)": charge_capacity,
+        "Discharge Capacity (mAh)": discharge_capacity,
+        "Charge Energy (Wh)": charge_energy,
+        "Discharge Energy (Wh)": discharge_energy,
+        "Coulombic Efficiency (%)": coulombic,
+        "Energy Efficiency (%)": energy,
+        "Mean V": mean_v,
+    }
+
+
+def summary_csv(table):
+    """
+    CSV text of a summary table, with the means and efficiencies rounded,
+    as DataFrame.to_csv() writes it (without needing pandas).
+    """
+    columns = []
+    for name, values in table.items():
+        if values.dtype.kind == "M":
+            text = np.char.replace(np.datetime_as_string(values, unit="s").astype(str), "T", " ")
+            columns.append(np.where(np.isnat(values), "", text).tolist())
+        elif values.dtype.kind == "f":
+            values = np.round(values, CSV_DECIMALS[name]) if name in CSV_DECIMALS else values
+            columns.append(["" if value != value else repr(value) for value in values.tolist()])
+        else:
+            columns.append([str(value) for value in values.tolist()])
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(table)
+    writer.writerows(zip(*columns))
+    return out.getvalue()
@@ -0,0 +1,149 @@
+"""
+Synthetic tester files for benchmarks.
+
+    python synthetic.py bench.001 --size 100MB --steps 50 --encoding cp950 --junk 0.01
+
+Files follow the tester export layout described in utils.extract_origin_csv:
+a "Start Time" line, then per step the "%", "@", "Label" / protocol, "$" and
+"System Time" header lines followed by one data row per second.  junk is the
+fraction of extra irregular lines mixed into the data: garbage text, blank
+lines, rows with surrounding spaces (accepted after strip), rows with an
+impossible date (accepted, dropped later as NaT) and rows with an extra
+field (rejected).
+"""
+import argparse
+import json
+import random
+import re
+import sys
+from datetime import datetime, timedelta
+
+STEP_NAMES = ("CC-CV 充電", "CC 放電", "靜置", "CC-CV Charge", "CC Discharge", "Rest")
+ENCODINGS = ("utf-8", "cp950")
+ROW_BYTES = 86  # Approximate length of one data row, to size steps
+BLOCK_ROWS = 4096
+EPOCH = datetime(2024, 1, 1)
+START_SECONDS = 2 * 86400  # 24/01/03 00:00:00, in seconds after EPOCH
+_SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+
+
+def parse_size(text):
+    """
+    "1048576", "512K", "100MB" or "1G" in bytes.
+    """
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?\s*", str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError(f"invalid size: {text}")
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).upper()])
+
+
+def generate(path, size=1024 ** 2, steps=20, encoding="utf-8", junk=0.0, newline="\n", seed=0):
+    """
+    Write a tester file of roughly size bytes with steps steps.  Returns a
+    summary with the row count the parser should accept.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f"unsupported encoding: {encoding}")
+    rng = random.Random(seed)
+    rows_per_step = max(1, size // ROW_BYTES // max(steps, 1))
+    summary = {"path": path, "bytes": 0, "steps": steps, "rows": 0, "junk_lines": 0,
+               "encoding": encoding, "newline": newline}
+    second = START_SECONDS
+
+    with open(path, "wb") as f:
+        def write(lines):
+            data = (newline.join(lines) + newline).encode(encoding)
+            f.write(data)
+            summary["bytes"] += len(data)
+
+        write(["Start Time,24/01/02 23:59:00"])
+        for step in range(steps):
+            name = STEP_NAMES[step % len(STEP_NAMES)]
+            loop = step // 4 + 1
+            write([
+                "%,Time",
+                f"@,{step + 1}",
+                "Label,Fuction,Set,Record Time,Change",
+                f",{step},{name},00:01.0,Time=05:00:00--Next",
+                f"$,{step + 1},Loop (S1)={loop}/2000,Loop (S2)={step % 4 + 1}/4",
+                "System Time,Step Time,V,I,T,R,P,mAh,Wh,Total Time",
+            ])
+            current = rng.choice((-2.5, -1.0, 0.0, 1.0, 2.5))
+            for first in range(0, rows_per_step, BLOCK_ROWS):
+                count = min(BLOCK_ROWS, rows_per_step - first)
+                lines = _data_rows(rng, first, count, second, current)
+                summary["rows"] += count
+                if junk:
+                    lines = _add_junk(rng, lines, junk, summary)
+                write(lines)
+                second += count
+    return summary
+
+
+def system_time(t):
+    """
+    "yy/mm/dd HH:MM:SS" of t seconds after EPOCH; valid for any t, so files of
+    any size keep dates the parser accepts.
+    """
+    return (EPOCH + timedelta(seconds=t)).strftime("%y/%m/%d %H:%M:%S")
+
+
+def _data_rows(rng, first, count, second, current):
+    rows = []
+    for i in range(first, first + count):
+        t = second + i - first
+        step_seconds = i + 1
+        rows.append(
+            f"{system_time(t)},"
+            f"{step_seconds // 3600}:{step_seconds // 60 % 60:02d}:{step_seconds % 60:02d}.0,"
+            f"{3.0 + rng.random() * 1.2:.4f},{current + rng.uniform(-0.01, 0.01):.3f},{25 + rng.random():.1f},"
+            f"{rng.random() / 100:.5f},{rng.random() * 9:.3f},{abs(current) * step_seconds / 3.6:.3f},"
+            f"{abs(current) * step_seconds / 1000:.5f},"
+            f"{(t - START_SECONDS + 60) // 3600}:{(t - START_SECONDS + 60) // 60 % 60:02d}:{t % 60:02d}.0"
+        )
+    return rows
+
+
+def _add_junk(rng, lines, fraction, summary):
+    out = []
+    for line in lines:
+        if rng.random() < fraction:
+            kind = rng.randrange(6)
+            if kind == 0:
+                out.append("garbage line here")
+            elif kind == 1:
+                out.append("   ")
+            elif kind == 2:
+                out.append("  " + line + " ")
+                summary["rows"] += 1
+            elif kind == 3:
+                out.append(line[:3] + "13" + line[5:])
+                summary["rows"] += 1
+            elif kind == 4:
+                out.append(line + ",extra")
+            else:
+                out.append("")
+            summary["junk_lines"] += 1
+        out.append(line)
+    return out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic tester file for benchmarks.")
+    parser.add_argument("path", help="output file (.001)")
+    parser.add_argument("--size", default="1MB", help="approximate size, e.g. 512K, 100MB, 1GB (default: 1MB)")
+    parser.add_argument("--steps", type=int, default=20, help="number of steps (default: 20)")
+    parser.add_argument("--encoding", choices=ENCODINGS, default="utf-8")
+    parser.add_argument("--junk", type=float, default=0.0, help="fraction of irregular lines (default: 0)")
+    parser.add_argument("--crlf", action="store_true", help="use \\r\\n line endings")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    summary = generate(args.path, parse_size(args.size), args.steps, args.encoding, args.junk,
+                       "\r\n" if args.crlf else "\n", args.seed)
+    print(json.dumps(summary, ensure_ascii=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+"""
+Incremental (tail-mode) ingestion of a tester file that is still being written.
+
+Every update() parses only the bytes appended since the previous one and
+appends the new rows to <name>_detail.csv and <name>_step.csv.  The parser
+state (offset, encoding, n_cols, step_name, row_count, step ends and the
+unfinished trailing line) is saved to <name>_tail.json next to the outputs,
+so updates can run from separate processes, e.g. a polling loop or cron.
+
+The step file always ends with the latest row of the step in progress; that
+line is replaced on the next update, so the outputs match a full conversion
+of the file as it is at that moment.  The state also records how far each
+output was written, and anything past that (from an interrupted update) is
+cut off before appending.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from utils import READ_CHUNK_SIZE, ColumnBuilder, OriginParser
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class TailIngest:
+    """
+    Tail-mode conversion of source into output_folder.
+    """
+
+    def __init__(self, source, output_folder):
+        self.source = source
+        head = os.path.basename(source).split(".")[0]
+        self.detail_path = os.path.join(output_folder, f"{head}_detail.csv")
+        self.step_path = os.path.join(output_folder, f"{head}_step.csv")
+        self.state_path = os.path.join(output_folder, f"{head}_tail.json")
+
+    def load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save_state(self, state):
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+
+    def update(self, final=False, chunk_size=READ_CHUNK_SIZE):
+        """
+        Parse what was appended to the source since the last update.  final
+        also processes a trailing line without newline (the test has ended).
+        Returns a summary of the update.
+        """
+        stat = os.stat(self.source)
+        state = self.load_state()
+        if state is not None and (state["inode"] != stat.st_ino or stat.st_size < state["parser"]["offset"]):
+            state = None  # The file was replaced or truncated: start over
+        if state is None:
+            state = {"detail_size": 0, "step_size": 0, "open_index": None, "open_line": None}
+
+        columns = ColumnBuilder()
+        if "parser" in state:
+            parser = OriginParser.from_state(columns, state["parser"])
+        else:
+            parser = OriginParser(columns)
+        base = parser.row_count
+        known_ends = len(parser.last_time_per_step_list)
+
+        with open(self.source, "rb") as f:
+            f.seek(parser.bytes_fed)
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                parser.feed(chunk)
+        if parser.encoding is None:
+            # A new test grows by about 86 bytes a second: do not wait for SNIFF_SIZE bytes
+            parser.sniff_now()
+        step_ends = parser.finish() if final else parser.last_time_per_step_list + [parser.row_count - 1]
+        new_ends = step_ends[known_ends:-1]
+        open_index = step_ends[-1]
+
+        df = None
+        if len(columns):
+            df = columns.to_dataframe()
+            df.index += base
+            df = df.dropna(subset=["System Time"])
+        del columns
+
+        # Detail rows are only ever appended
+        with _open_output(self.detail_path, state["detail_size"]) as f:
+            if df is not None and len(df):
+                f.write(df.to_csv(index=False, header=(state["detail_size"] == 0),
+                                  date_format=DATE_FORMAT).encode("utf-8"))
+            state["detail_size"] = f.tell()
+
+        # Steps that ended in this update: the previous open line (when the new
+        # step header came right after it) and the ends among the new rows
+        lines = []
+        header = None
+        for index in new_ends:
+            if index < base and index == state["open_index"] and state["open_line"] is not None:
+                lines.append(state["open_line"])
+        in_frame = [index for index in new_ends if index >= base]
+        if df is not None:
+            in_frame = [index for index in in_frame if index in df.index]
+            header = ",".join(df.columns) + "\n"
+            if in_frame:
+                lines.append(df.loc[in_frame].to_csv(index=False, header=False, date_format=DATE_FORMAT))
+            if open_index in df.index:
+                state["open_line"] = df.loc[[open_index]].to_csv(index=False, header=False, date_format=DATE_FORMAT)
+            elif open_index != state["open_index"]:
+                state["open_line"] = None
+        elif open_index != state["open_index"]:
+            state["open_line"] = None
+        state["open_index"] = open_index
+
+        with _open_output(self.step_path, state["step_size"]) as f:
+            if f.tell() == 0 and header is not None and (lines or state["open_line"]):
+                f.write(header.encode("utf-8"))
+            f.write("".join(lines).encode("utf-8"))
+            state["step_size"] = f.tell()
+            if state["open_line"]:
+                f.write(state["open_line"].encode("utf-8"))
+
+        state["inode"] = stat.st_ino
+        state["parser"] = parser.get_state()
+        self.save_state(state)
+        return {
+            "offset": parser.bytes_fed,
+            "new_rows": 0 if df is None else len(df),
+            "rows": parser.row_count,
+            "steps": len(step_ends),
+            "step_name": parser.step_name,
+        }
+
+
+def _open_output(path, size):
+    """
+    Open an output for appending after its first size bytes.
+    """
+    f = open(path, "r+b" if os.path.exists(path) else "wb")
+    f.truncate(size)
+    f.seek(size)
+    return f
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert a tester file incrementally while it is being written.")
+    parser.add_argument("source", help="tester export (.001 / .csv) that is still growing")
+    parser.add_argument("output_folder", help="folder for the _detail.csv / _step.csv outputs and the state file")
+    parser.add_argument("--follow", type=float, metavar="SECONDS",
+                        help="keep polling the source every SECONDS seconds")
+    parser.add_argument("--final", action="store_true", help="the test has ended: also take the last unterminated line")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.output_folder, exist_ok=True)
+    tail = TailIngest(args.source, args.output_folder)
+    while True:
+        summary = tail.update(final=args.final)
+        print(json.dumps(summary, ensure_ascii=False), flush=True)
+        if not args.follow:
+            return 0
+        time.sleep(args.follow)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
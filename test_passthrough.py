@@ -0,0 +1,159 @@
+"""
+Differential tests: passthrough.passthrough_file against the DataFrame path
+of chunked.export_file, and zipstream.ZipStream against zipfile.
+
+    python -m pytest -q test_passthrough.py
+"""
+import gzip
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from chunked import export_file
+from passthrough import passthrough_file
+from synthetic import generate
+from zipstream import ZIP64_LIMIT, ZipStream
+
+# Kept as text: passthrough copies the tester's formatting of these
+TEXT_COLUMNS = {"System Time": str, "Step Time": str, "Total Time": str, "Step name": str}
+
+EDGE_CASES = "\n".join([
+    "Start Time,24/01/02 23:59:00",
+    "%,Time",
+    "@,1",
+    "Label,Fuction,Set,Record Time,Change",
+    ',0,CC "fast" 充電,00:01.0,Time=05:00:00--Next',
+    "$,1,Loop (S1)=1/2000,Loop (S2)=1/4",
+    "System Time,Step Time,V,I,T,R,P,mAh,Wh,Total Time",
+    "24/01/03 00:00:58,0:00:01.0,3.1,1,25,0.01,3,0.1,0.001,0:01:01.0",
+    "24/01/03 00:00:59,0:00:02,3.2,1,25,0.01,3,0.2,0.002,0:01:02.25",
+    "24/01/03 00:00:60,-0:00:03,3.3,1,25,0.01,3,0.3,0.003,0:01:1e1",
+    "24/13/03 00:01:01,0:00:04.0,3.4,1,25,0.01,3,0.4,0.004,0:01:04.0",
+    "24/01/03 00:01:02,0:00:05.,3.5,1,25,0.01,3,0.5,0.005,bad",
+    "%,Time",
+    "@,2",
+    "Label,Fuction,Set,Record Time,Change",
+    ",1,靜置,00:01.0,Time=05:00:00--Next",
+    "$,2,Loop (S1)=1/2000,Loop (S2)=2/4",
+    "System Time,Step Time,V,I,T,R,P,mAh,Wh,Total Time",
+    "24/01/03 00:01:03,0:00:01.0,3.6,0,25,0.01,0,0.0,0.000,0:01:06.0",
+    "24/01/03 00:01:04,123:45:06.789,3.7,0,25,0.01,0,0.0,0.000,0:01:07.0",
+]) + "\n"
+
+
+def read_csv(path):
+    return pd.read_csv(path, dtype=TEXT_COLUMNS, keep_default_na=False, na_values=[""])
+
+
+def assert_same_frames(expected, actual):
+    assert list(actual.columns) == list(expected.columns)
+    assert len(actual) == len(expected)
+    for name in expected.columns:
+        x, y = expected[name], actual[name]
+        if x.dtype.kind == "f":
+            np.testing.assert_allclose(y.to_numpy(), x.to_numpy(), rtol=1e-12, equal_nan=True, err_msg=name)
+        else:
+            assert y.fillna("").tolist() == x.fillna("").tolist(), name
+
+
+def convert_both(source, tmp_path):
+    """
+    Run both writers on source; returns their results and, per output, the
+    (DataFrame path, passthrough) frames.
+    """
+    expected = export_file(source, tmp_path / "df_detail.gz", tmp_path / "df_step.gz", summary=True)
+    actual = passthrough_file(source, tmp_path / "pt_detail.gz", tmp_path / "pt_step.gz", summary=True)
+    frames = {kind: (read_csv(tmp_path / f"df_{kind}.gz"), read_csv(tmp_path / f"pt_{kind}.gz"))
+              for kind in ("detail", "step")}
+    return expected, actual, frames
+
+
+@pytest.mark.parametrize("encoding", ["utf-8", "cp950"])
+@pytest.mark.parametrize("newline", ["\n", "\r\n"])
+@pytest.mark.parametrize("junk", [0.0, 0.02])
+def test_synthetic_files(tmp_path, encoding, newline, junk):
+    source = tmp_path / "sample.001"
+    info = generate(str(source), size=256 * 1024, steps=7, encoding=encoding, junk=junk, newline=newline, seed=3)
+    expected, actual, frames = convert_both(str(source), tmp_path)
+
+    assert actual["rows"] == expected["rows"]
+    assert actual["step_rows"] == expected["step_rows"] == 7
+    if not junk:
+        assert actual["rows"] == info["rows"]
+    for kind, (x, y) in frames.items():
+        assert_same_frames(x, y)
+    assert repr(actual["step_summary"]) == repr(expected["step_summary"])
+
+
+def test_edge_cases(tmp_path):
+    """
+    Quoted step names, a leap second, durations written through repr(),
+    unparsable durations and a row dropped for its impossible date.
+    """
+    source = tmp_path / "edge.001"
+    source.write_bytes(EDGE_CASES.encode("utf-8"))
+    expected, actual, frames = convert_both(str(source), tmp_path)
+
+    assert actual["rows"] == expected["rows"] == 6
+    for kind, (x, y) in frames.items():
+        assert_same_frames(x, y)
+    detail = frames["detail"][1]
+    assert detail["System Time"].tolist()[:3] == ["2024-01-03 00:00:58", "2024-01-03 00:00:59",
+                                                   "2024-01-03 00:01:00"]
+    assert detail["Step name"].iloc[0] == 'CC "fast" 充電'
+    assert detail["Step Time (s)"].tolist()[2] == -3.0
+    assert detail["Total Time (s)"].tolist()[2] == 70.0
+    assert np.isnan(detail["Total Time (s)"].iloc[3])
+    assert detail["Step Time (s)"].iloc[-1] == pytest.approx(123 * 3600 + 45 * 60 + 6.789)
+
+
+def read_zip(source):
+    with zipfile.ZipFile(source) as z:
+        assert z.testzip() is None
+        return {info.filename: z.read(info) for info in z.infolist()}
+
+
+def test_zip_entries(tmp_path):
+    content = b"".join(b"%d,%d\n" % (i, i * i) for i in range(50000))
+    gz = tmp_path / "squares.csv.gz"
+    gz.write_bytes(gzip.compress(content))
+    stream = ZipStream()
+    data = b"".join([*stream.add_gzip("squares.csv", str(gz)),
+                     *stream.add_chunks("資料.txt", iter([content[:1000], content[1000:]])),
+                     stream.finish()])
+    assert read_zip(io.BytesIO(data)) == {"squares.csv": content, "資料.txt": content}
+
+
+def test_zip64_offsets(tmp_path):
+    """
+    Entries past 4 GB: the archive is written behind a sparse 4 GB hole that
+    stands in for the earlier entries, so the offsets need ZIP64 records.
+    """
+    content = b"step,rows\n" * 1000
+    gz = tmp_path / "detail.csv.gz"
+    gz.write_bytes(gzip.compress(content))
+    path = tmp_path / "large.zip"
+    stream = ZipStream()
+    stream.offset = ZIP64_LIMIT + 1
+    with open(path, "wb") as f:
+        f.seek(stream.offset)
+        for chunk in [*stream.add_gzip("detail.csv", str(gz)), *stream.add_chunks("step.csv", [content]),
+                      stream.finish()]:
+            f.write(chunk)
+    assert read_zip(path) == {"detail.csv": content, "step.csv": content}
+
+
+def test_zip64_entry_count():
+    stream = ZipStream(level=1)
+    chunks = [chunk for i in range(0x10000) for chunk in stream.add_chunks(f"{i}.txt", [b"%d" % i])]
+    data = b"".join(chunks) + stream.finish()
+    # zipfile lists every entry whatever the count says, so look for the ZIP64 end (56 bytes) and
+    # locator (20) records before the end of central directory record (22)
+    assert data[-98:-94] == b"PK\x06\x06" and data[-42:-38] == b"PK\x06\x07"
+    with zipfile.ZipFile(io.BytesIO(data)) as z:
+        names = z.namelist()
+        assert len(names) == 0x10000
+        assert z.read("65535.txt") == b"65535"
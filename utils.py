@@ -1,71 +1,726 @@
-import re
-
-def convert_to_seconds(row):
-    try:
-        hours, minutes, seconds = map(float, row.split(":"))
-        total_seconds = float(hours) * 3600 + float(minutes) * 60 + float(seconds)
-        return total_seconds
-    except Exception as e:
-        print(f"Error processing row: {row}, Error: {e}")
-        return None
-
-def get_n_cols(fpath: str):
-    """
-    Get the number of columns
-    """
-    f = open(fpath, 'r')
-    for line in f.readlines():
-        row = line.strip().rsplit(",")
-        if len(row) > 0 and row[0] == "System Time":
-            return len(row)
-    return 0
-
-def is_match_date_string(ds: str):
-    pattern = r"^\d{2}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}$"
-    if re.match(pattern, ds):
-        return True
-    return False
-
-def extract_origin_csv(fpath: str):
-    """
-    The following content is the header of tester.
-    %	Time								
-    @	16								
-    Label	Fuction	Set	Record Time	Change					
-            "Charge	CC-CV	I=2.500	V=3.700"	00:15.0	"Time=05:00:00--Next	EC=0.125--Next"					
-    $	16	Loop (S1)=1/2000	Loop (S2)=8/100						
-    System Time	Step Time	V	I	T	R	P	mAh	Wh	Total Time
-    """
-    f = open(fpath, 'r')
-    rows = []
-    last_time_per_step_list = []
-    step_name = None
-    n_cols = get_n_cols(fpath=fpath)
-    is_reading_protocol = False
-
-    try:
-        for line in f.readlines():
-            row = line.strip().rsplit(",")
-            if is_reading_protocol:
-                step_name = row[2]
-                is_reading_protocol = False  
-            if len(row) > 0 and row[0].startswith(("%", "@", "Label", "$", "System Time", "Start Time")): #content
-                if len(row) == 5 and row[0] == "Label": #header line 4
-                    is_reading_protocol = True                
-                elif len(row) == 2 and row[0] == '%': # header line 1
-                    last_time_per_step_list.append(len(rows)-1)
-                else:
-                    pass
-                
-            else:
-                if len(row) == n_cols and is_match_date_string(row[0]): # ensure the number of columns matches the data columns
-                    row.append(step_name)
-                    rows.append(row)
-
-        last_time_per_step_list.append(len(rows) -1)
-    
-    except:
-        raise Exception("此檔案並非'承德充放電機'檔案格式，請確認選擇檔案。")
-
-    
-    return rows, last_time_per_step_list
\ No newline at end of file
+import codecs
+import re
+
+import numpy as np
+
+from excel import is_excel, iter_excel_chunks
+
+# Bump whenever the parsed output changes; cached results are keyed by it
+PARSER_VERSION = "2"
+SNIFF_SIZE = 64 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+BATCH_SIZE = 1024 * 1024
+CANDIDATE_ENCODINGS = ("utf-8", "cp950")
+FALLBACK_ENCODING = "latin1"
+HEADER_PREFIXES = (b"%", b"@", b"Label", b"$", b"System Time", b"Start Time")
+DATE_PATTERN = re.compile(rb"^\d{2}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}$")
+LOOP_PATTERN = re.compile(rb"^Loop\b[^=]*=\s*(\d+)\s*/")
+COLUMN_NAMES = ["System Time", "Step Time", "V", "I", "T", "R", "P", "mAh", "Wh", "Total Time", "Step name"]
+DURATION_COLUMNS = {"Step Time": "Step Time (s)", "Total Time": "Total Time (s)"}
+MAX_DECIMALS = 6
+DURATION_CHECK_ROWS = 64 * 1024
+
+# Byte-level tables for the block classifier
+_DATE_TEMPLATE = np.frombuffer(b"00/00/00 00:00:00", dtype=np.uint8)
+_DATE_DIGITS = _DATE_TEMPLATE == ord("0")
+_DATE_OFFSETS = np.arange(len(_DATE_TEMPLATE))
+_TIME_DIGITS = np.flatnonzero(_DATE_DIGITS)
+_PREFIX_BYTES = np.frombuffer(b"%@L$S", dtype=np.uint8)
+_SPACE_BYTES = np.frombuffer(b" \t\n\r\x0b\x0c", dtype=np.uint8)
+_COMMA = ord(",")
+
+def extract_origin_csv(fpath: str, sink=None):
+    """
+    The following content is the header of tester.
+    %	Time								
+    @	16								
+    Label	Fuction	Set	Record Time	Change					
+            "Charge	CC-CV	I=2.500	V=3.700"	00:15.0	"Time=05:00:00--Next	EC=0.125--Next"					
+    $	16	Loop (S1)=1/2000	Loop (S2)=8/100						
+    System Time	Step Time	V	I	T	R	P	mAh	Wh	Total Time
+
+    The accepted rows go into sink (a new ColumnBuilder by default), which is
+    returned together with the row index of the last record of every step.
+    The cycle numbers of the "$" loop lines are left in sink.loops.
+    """
+    if sink is None:
+        sink = ColumnBuilder()
+    try:
+        parser, last_time_per_step_list = parse_origin_file(fpath, sink)
+    except Exception:
+        raise Exception("此檔案並非'承德充放電機'檔案格式，請確認選擇檔案。")
+
+    if isinstance(sink, ColumnBuilder):
+        sink.loops = parser.loop_list
+    return sink, last_time_per_step_list
+
+
+class ColumnBuffer:
+    """
+    Growable NumPy array.  Capacity doubles as rows are appended and the
+    spare capacity is given back in finish(), so values never need to be
+    collected in Python lists first.
+    """
+
+    def __init__(self, dtype, width=None, capacity=64 * 1024):
+        self._shape = () if width is None else (width,)
+        self._data = np.empty((capacity,) + self._shape, dtype=dtype)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def extend(self, values):
+        values = np.asarray(values)
+        if values.dtype.kind == "S" and values.dtype.itemsize > self._data.dtype.itemsize:
+            self._data = self._data.astype(values.dtype)
+        end = self._size + len(values)
+        if end > len(self._data):
+            capacity = max(end, 2 * len(self._data))
+            grown = np.empty((capacity,) + self._shape, dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:end] = values
+        self._size = end
+
+    def finish(self):
+        """
+        Return the filled part of the buffer without copying it.
+        """
+        self._data.resize((self._size,) + self._shape, refcheck=False)
+        return self._data
+
+
+class ColumnBuilder:
+    """
+    OriginParser sink that splits accepted rows straight into typed columns:
+    one float64 block for V/I/T/R/P/mAh/Wh, int64 nanoseconds for System
+    Time, raw bytes and float seconds for the two duration columns and int32
+    step name codes.  loops is set to OriginParser.loop_list once the
+    parse is finished.
+    """
+
+    CHANNELS = ["V", "I", "T", "R", "P", "mAh", "Wh"]
+
+    def __init__(self):
+        self.system_time = ColumnBuffer(np.int64)
+        self.step_time = ColumnBuffer("S1")
+        self.total_time = ColumnBuffer("S1")
+        self.step_seconds = ColumnBuffer(np.float64)
+        self.total_seconds = ColumnBuffer(np.float64)
+        self.channels = ColumnBuffer(np.float64, width=len(self.CHANNELS))
+        self.step_codes = ColumnBuffer(np.int32)
+        self.step_names = []
+        self._step_index = {}
+        self.loops = []
+        # Short runs are batched so the column split works on large blocks
+        self._batch = []
+        self._batch_codes = []
+        self._batch_rows = []
+        self._batch_bytes = 0
+
+    def __len__(self):
+        return len(self.system_time) + sum(self._batch_rows)
+
+    def __call__(self, data: bytes, n_rows: int, step_name: str):
+        code = self._step_index.get(step_name)
+        if code is None:
+            code = self._step_index[step_name] = len(self.step_names)
+            self.step_names.append(step_name)
+
+        self._batch.append(data)
+        self._batch_codes.append(code)
+        self._batch_rows.append(n_rows)
+        self._batch_bytes += len(data)
+        if self._batch_bytes >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Split the batched rows into the column buffers.
+        """
+        if not self._batch:
+            return
+        n_rows = sum(self._batch_rows)
+        fields = split_fields(b"".join(self._batch), n_rows)
+        if len(fields) != len(COLUMN_NAMES) - 1:
+            raise ValueError(f"unexpected column count: {len(fields)}")
+
+        self.system_time.extend(parse_system_time(fields[0]).view(np.int64))
+        self.step_time.extend(fields[1])
+        self.channels.extend(np.column_stack([to_float(f) for f in fields[2:9]]))
+        self.total_time.extend(fields[9])
+        self.step_seconds.extend(parse_duration(fields[1]))
+        self.total_seconds.extend(parse_duration(fields[9]))
+        self.step_codes.extend(np.repeat(np.array(self._batch_codes, dtype=np.int32), self._batch_rows))
+
+        self._batch = []
+        self._batch_codes = []
+        self._batch_rows = []
+        self._batch_bytes = 0
+
+    def to_dataframe(self, compact=False):
+        """
+        Build the DataFrame (COLUMN_NAMES order, then the seconds columns)
+        on top of the buffers.  pandas is imported here, so the parser and
+        the passthrough writer work without it.
+
+        compact keeps the same columns in less memory: Step name becomes
+        categorical, channels and seconds that print the same from float32
+        become float32, and Step Time / Total Time become integer seconds
+        when format_durations() gives back their text.  Write such a frame
+        through expand_durations() to get the same CSV.
+        """
+        try:
+            import pandas as pd
+        except ImportError as e:
+            raise ImportError("pandas is required to build DataFrames") from e
+
+        self.flush()
+
+        channels = self.channels.finish()
+        step_seconds, total_seconds = self.step_seconds.finish(), self.total_seconds.finish()
+        if compact:
+            df = pd.DataFrame({name: float32_exact(channels[:, i]) for i, name in enumerate(self.CHANNELS)})
+            step_time = whole_seconds(self.step_time.finish(), step_seconds)
+            total_time = whole_seconds(self.total_time.finish(), total_seconds)
+            step_names = pd.Categorical.from_codes(self.step_codes.finish(), categories=self.step_names)
+            step_seconds, total_seconds = float32_exact(step_seconds), float32_exact(total_seconds)
+        else:
+            df = pd.DataFrame(channels, columns=self.CHANNELS, copy=False)
+            step_time = total_time = None
+            step_names = np.array(self.step_names, dtype=object)[self.step_codes.finish()]
+        df.insert(0, "System Time", self.system_time.finish().view("datetime64[ns]"))
+        df.insert(1, "Step Time", step_time if step_time is not None else decode_ascii(self.step_time.finish()))
+        df["Total Time"] = total_time if total_time is not None else decode_ascii(self.total_time.finish())
+        df["Step name"] = step_names
+        df[DURATION_COLUMNS["Step Time"]] = step_seconds
+        df[DURATION_COLUMNS["Total Time"]] = total_seconds
+        return df
+
+
+def fixed_decimals(values, max_decimals=MAX_DECIMALS):
+    """
+    Smallest number of decimals that reproduces every value exactly, or None.
+    """
+    if len(values) == 0:
+        return 0
+    if not np.isfinite(values).all():
+        return None
+    for decimals in range(max_decimals + 1):
+        scale = 10.0 ** decimals
+        scaled = np.round(values * scale)
+        if np.abs(scaled).max() >= 2 ** 53:
+            return None
+        if np.array_equal(scaled / scale, values):
+            return decimals
+    return None
+
+
+def float32_exact(values):
+    """
+    float64 values as float32 when that prints every value the same, else
+    unchanged.  That holds when the fewest decimals that reproduce the values
+    are finer than float32's spacing at the largest of them, so no two
+    values with those decimals share a float32, and no value crosses the
+    1e-4 / 1e16 bounds of scientific notation on the way.  NaN is kept.
+    """
+    finite = values[~np.isnan(values)]
+    decimals = fixed_decimals(finite)
+    if decimals is None:
+        return values
+    if len(finite) and np.spacing(np.float32(np.abs(finite).max())) >= 0.5 * 10.0 ** -decimals:
+        return values
+    narrow = values.astype(np.float32)
+    magnitude, narrow_magnitude = np.abs(finite), np.abs(narrow[~np.isnan(narrow)].astype(np.float64))
+    for bound in (1e-4, 1e16):
+        if not np.array_equal(magnitude < bound, narrow_magnitude < bound):
+            return values
+    return narrow
+
+
+def widen_float32(values):
+    """
+    float32 values as float64 with the fewest decimals that give the same
+    float32 values back, i.e. the numbers they were read from.
+    """
+    wide = values.astype(np.float64)
+    for decimals in range(MAX_DECIMALS + 1):
+        rounded = np.round(wide, decimals)
+        if np.array_equal(rounded.astype(np.float32), values, equal_nan=True):
+            return rounded
+    return wide
+
+
+def format_durations(seconds):
+    """
+    Whole seconds as "H:MM:SS.0" bytes, the way the tester writes durations.
+    """
+    seconds = np.asarray(seconds, dtype=np.int64)
+    hours, rest = np.divmod(seconds, 3600)
+    minutes, secs = np.divmod(rest, 60)
+    n_digits = len(str(int(hours.max(initial=0))))
+    # Hours right-aligned in n_digits, then ":MM:SS.0" and room to shift left
+    chars = np.zeros((len(seconds), 2 * n_digits + 8), dtype=np.uint8)
+    for k in range(n_digits):
+        chars[:, k] = ord("0") + hours // 10 ** (n_digits - 1 - k) % 10
+    chars[:, n_digits:n_digits + 8] = np.frombuffer(b":00:00.0", dtype=np.uint8)
+    for column, values in ((1, minutes // 10), (2, minutes % 10), (4, secs // 10), (5, secs % 10)):
+        chars[:, n_digits + column] += values.astype(np.uint8)
+    # Drop the leading zeros of the hours (keeping one)
+    widths = np.ones(len(seconds), dtype=np.int64)
+    for k in range(1, n_digits):
+        widths += hours >= 10 ** k
+    offsets = np.arange(n_digits + 8)
+    text = np.take_along_axis(chars, (n_digits - widths)[:, None] + offsets, axis=1)
+    text[offsets >= (widths + 8)[:, None]] = 0
+    return np.ascontiguousarray(text).view(f"S{n_digits + 8}").ravel()
+
+
+def whole_seconds(raw, seconds):
+    """
+    A duration column as integer seconds when format_durations() gives back
+    its raw text on every row, else None.
+    """
+    if len(seconds) == 0 or not np.isfinite(seconds).all():
+        return None
+    whole = seconds.astype(np.int64)
+    if whole.min() < 0 or not np.array_equal(whole, seconds):
+        return None
+    for start in range(0, len(whole), DURATION_CHECK_ROWS):  # Bounds the temporary text
+        stop = start + DURATION_CHECK_ROWS
+        if not np.array_equal(format_durations(whole[start:stop]), raw[start:stop]):
+            return None
+    return whole.astype(np.int32) if whole.max() <= np.iinfo(np.int32).max else whole
+
+
+def expand_durations(df):
+    """
+    A frame from to_dataframe(compact=True) with the duration text written
+    back; other frames are returned as they are.
+    """
+    restored = {name: decode_ascii(format_durations(df[name].to_numpy()))
+                for name in DURATION_COLUMNS if df[name].dtype.kind in "iu"}
+    return df.assign(**restored) if restored else df
+
+
+def memory_report(df):
+    """
+    {column: {"dtype", "bytes"}} of a DataFrame plus its "total" bytes,
+    counting the Python objects of object columns.
+    """
+    usage = df.memory_usage(index=False, deep=True)
+    report = {name: {"dtype": str(df[name].dtype), "bytes": int(usage[name])} for name in df.columns}
+    report["total"] = int(usage.sum())
+    return report
+
+
+def split_fields(data: bytes, n_rows: int):
+    """
+    Split n_rows "\n"-terminated CSV rows with the same field count into
+    one fixed-width bytes array per column.
+    """
+    buf = np.frombuffer(data, dtype=np.uint8)
+    line_ends = np.flatnonzero(buf == ord("\n"))
+    commas = np.flatnonzero(buf == _COMMA).reshape(n_rows, -1)
+    starts = np.empty_like(line_ends)
+    starts[0] = 0
+    starts[1:] = line_ends[:-1] + 1
+    left = np.column_stack((starts, commas + 1))
+    right = np.column_stack((commas, line_ends))
+
+    return [slice_bytes(buf, lo, hi) for lo, hi in zip(left.T, right.T)]
+
+
+def slice_bytes(buf, lo, hi):
+    """
+    Gather buf[lo[i]:hi[i]] for every i into a fixed-width bytes array.
+    """
+    widths = hi - lo
+    width = max(int(widths.max(initial=0)), 1)
+    offsets = np.arange(width)
+    raw = buf[np.minimum(lo[:, None] + offsets, len(buf) - 1)]
+    raw[offsets >= widths[:, None]] = 0
+    return raw.view(f"S{width}").ravel()
+
+
+def to_float(raw):
+    """
+    Bytes column to float64; values that are not numbers become NaN like
+    pd.to_numeric(errors='coerce').
+    """
+    try:
+        return raw.astype(np.float64)
+    except ValueError:
+        out = np.empty(len(raw), dtype=np.float64)
+        for i, value in enumerate(raw):
+            try:
+                out[i] = float(value)
+            except ValueError:
+                out[i] = np.nan
+        return out
+
+
+def parse_system_time(raw, strict=True):
+    """
+    Fixed-width "yy/mm/dd HH:MM:SS" bytes column to datetime64[ns].
+
+    The fields are read with digit arithmetic and the epoch is computed once
+    per run of rows that share a date.  Years follow %y (69-99 -> 19xx).
+    With strict, rows pd.to_datetime(errors='coerce') would reject (bad
+    month, day, hour or minute) become NaT; without it they are not checked.
+    """
+    raw = np.ascontiguousarray(raw, dtype="S17")
+    digits = raw.view(np.uint8).reshape(-1, 17)[:, _TIME_DIGITS].astype(np.int64) - ord("0")
+    fields = digits[:, 0::2] * 10 + digits[:, 1::2]
+    yy, month, day, hour, minute, second = fields.T
+
+    day_key = yy * 10000 + month * 100 + day
+    firsts = np.flatnonzero(np.concatenate(([True], day_key[1:] != day_key[:-1])))
+    year = yy[firsts] + np.where(yy[firsts] < 69, 2000, 1900)
+    month_start = (year - 1970) * 12 + month[firsts] - 1
+    first_day = month_start.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+    day_epoch = first_day + day[firsts] - 1
+    if strict:
+        month_days = (month_start + 1).astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) - first_day
+        bad_day = (month[firsts] < 1) | (month[firsts] > 12) | (day[firsts] < 1) | (day[firsts] > month_days)
+    day_epoch = np.repeat(day_epoch, np.diff(np.append(firsts, len(day_key))))
+
+    seconds = day_epoch * 86400 + hour * 3600 + minute * 60 + second
+    values = seconds * 1_000_000_000
+    if strict:
+        bad = np.repeat(bad_day, np.diff(np.append(firsts, len(day_key))))
+        # %S also takes 60 and 61, which roll over into the next minute
+        bad |= (hour > 23) | (minute > 59) | (second > 61)
+        values[bad] = np.iinfo(np.int64).min
+    return values.view("datetime64[ns]")
+
+
+def parse_duration(raw):
+    """
+    "H:MM:SS.s" bytes column to float seconds.  Hours may run past 24 and
+    the seconds may carry any number of decimals; values without exactly
+    two colons or with non-numeric parts become NaN.  A leading "-" negates
+    the whole value ("-0:00:04" is -4 seconds).
+    """
+    raw = np.ascontiguousarray(raw)
+    n_rows, width = len(raw), raw.dtype.itemsize
+    chars = raw.view(np.uint8).reshape(n_rows, width)
+    is_colon = chars == ord(":")
+    first = is_colon.argmax(axis=1)
+    second = width - 1 - is_colon[:, ::-1].argmax(axis=1)
+    valid = is_colon.sum(axis=1) == 2
+
+    row_start = np.arange(n_rows) * width
+    buf = chars.ravel()
+    length = (chars != 0).sum(axis=1)
+    hours = to_float(slice_bytes(buf, row_start, row_start + first))
+    minutes = to_float(slice_bytes(buf, row_start + first + 1, row_start + second))
+    seconds = to_float(slice_bytes(buf, row_start + second + 1, row_start + length))
+
+    total = np.abs(hours) * 3600 + minutes * 60 + seconds
+    total[np.signbit(hours)] *= -1  # signbit also catches "-0"
+    total[~valid] = np.nan
+    return total
+
+
+def decode_ascii(raw):
+    """
+    Bytes column to an object column of str.
+    """
+    return raw.astype("U").astype(object)
+
+
+def sniff_encoding(prefix: bytes):
+    """
+    Guess the text encoding from the first bytes of a file.
+    A multi-byte sequence cut off at the end of the prefix is not an error.
+    """
+    for encoding in CANDIDATE_ENCODINGS:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(prefix, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return FALLBACK_ENCODING
+
+
+class OriginParser:
+    """
+    Push parser for the tester export format, see extract_origin_csv.
+
+    Bytes are handed over with feed() as they arrive and only complete lines
+    are kept until they are processed, so memory does not grow with the file.
+    The encoding is sniffed from the first SNIFF_SIZE bytes (or from what
+    there is when sniff_now() is called) and the column count is taken from
+    the first "System Time" header on the way.  When those bytes are all
+    ASCII, the first non-ASCII bytes sniff the encoding again.
+
+    Each block of complete lines is classified with NumPy: rows whose date
+    shape and field count are already right are accepted in bulk, and only
+    header, protocol and irregular lines go through _handle_line.
+
+    Accepted rows are passed to sink(data, n_rows, step_name) in runs, where
+    data holds n_rows stripped rows of the same step, each ending with "\n".
+    Every "$" line with a loop counter adds [row index of the next row,
+    cycle] to loop_list, the cycle being the first (outermost) counter.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.encoding = None
+        self.sniffed_ascii = False  # The encoding was guessed from ASCII bytes only
+        self.newline = b"\n"
+        self.n_cols = 0
+        self.step_name = "Unknown"
+        self.is_reading_protocol = False
+        self.row_count = 0
+        self.last_time_per_step_list = []
+        self.loop_list = []
+        self.bytes_fed = 0
+        self._pending = b""
+
+    def get_state(self):
+        """
+        Everything needed to resume parsing at bytes_fed, as a JSON-friendly
+        dict (the unfinished trailing line is kept latin1-decoded).
+        """
+        return {
+            "offset": self.bytes_fed,
+            "encoding": self.encoding,
+            "sniffed_ascii": self.sniffed_ascii,
+            "newline": self.newline.decode("latin1"),
+            "n_cols": self.n_cols,
+            "step_name": self.step_name,
+            "is_reading_protocol": self.is_reading_protocol,
+            "row_count": self.row_count,
+            "last_time_per_step_list": list(self.last_time_per_step_list),
+            "loop_list": [list(loop) for loop in self.loop_list],
+            "partial": self._pending.decode("latin1"),
+        }
+
+    @classmethod
+    def from_state(cls, sink, state):
+        """
+        A parser that continues where get_state() left off; feed it the
+        source from state["offset"] on.
+        """
+        parser = cls(sink)
+        parser.bytes_fed = state["offset"]
+        parser.encoding = state["encoding"]
+        parser.sniffed_ascii = state.get("sniffed_ascii", False)
+        parser.newline = state["newline"].encode("latin1")
+        parser.n_cols = state["n_cols"]
+        parser.step_name = state["step_name"]
+        parser.is_reading_protocol = state["is_reading_protocol"]
+        parser.row_count = state["row_count"]
+        parser.last_time_per_step_list = list(state["last_time_per_step_list"])
+        parser.loop_list = [list(loop) for loop in state.get("loop_list", [])]
+        parser._pending = state["partial"].encode("latin1")
+        return parser
+
+    def feed(self, data: bytes):
+        self.bytes_fed += len(data)
+        if self._pending:
+            data = self._pending + data
+        if self.encoding is None and len(data) < SNIFF_SIZE:
+            self._pending = data
+            return
+        self._process(data)
+
+    def sniff_now(self):
+        """
+        Sniff the encoding from the bytes held so far instead of waiting for
+        SNIFF_SIZE bytes, and process their complete lines, for sources that
+        grow slowly (tail mode).  Waits for the first complete line, as the
+        line separator is not known before; returns whether the encoding is
+        set.
+        """
+        if self.encoding is None and (b"\n" in self._pending or b"\r" in self._pending[:-1]):
+            data, self._pending = self._pending, b""
+            self._process(data)
+        return self.encoding is not None
+
+    def finish(self):
+        """
+        Process the trailing line and return the step end indices.
+        """
+        if not self.sniff_now():
+            self._process(self._pending)
+        if self._pending:
+            data = self._pending + self.newline
+            self._scan_block(data, len(data))
+        self._pending = b""
+        return self.last_time_per_step_list + [self.row_count - 1]
+
+    def _process(self, data: bytes):
+        """
+        Scan the complete lines of data and keep the rest.
+        """
+        if self.encoding is None:
+            self._sniff(data)
+            # Old exports may use a bare "\r" as line separator
+            if b"\n" not in data and b"\r" in data:
+                self.newline = b"\r"
+        elif self.sniffed_ascii and not data.isascii():
+            self._sniff(data)
+        cut = data.rfind(self.newline) + 1
+        self._pending = data[cut:]
+        if cut:
+            self._scan_block(data, cut)
+
+    def _sniff(self, data: bytes):
+        # ASCII decodes the same in every candidate, so sniff from the first non-ASCII byte
+        self.sniffed_ascii = data.isascii()
+        first = 0 if self.sniffed_ascii else int(np.argmax(np.frombuffer(data, dtype=np.uint8) >= 0x80))
+        self.encoding = sniff_encoding(data[first:first + SNIFF_SIZE])
+
+    def _decode(self, field: bytes):
+        return field.decode(self.encoding, errors="replace")
+
+    def _scan_block(self, data: bytes, end: int):
+        """
+        Classify the complete lines in data[:end] and feed them through the
+        state machine in order.
+        """
+        buf = np.frombuffer(data, dtype=np.uint8, count=end)
+        line_ends = np.flatnonzero(buf == self.newline[0])
+        starts = np.empty_like(line_ends)
+        starts[0] = 0
+        starts[1:] = line_ends[:-1] + 1
+        content_ends = line_ends.copy()
+        if self.newline == b"\n":
+            content_ends -= (line_ends > starts) & (buf[line_ends - 1] == ord("\r"))
+        lengths = content_ends - starts
+        nonempty = lengths > 0
+
+        first = buf[starts]
+        last = buf[content_ends - 1]
+        first_space = np.isin(first, _SPACE_BYTES) & nonempty
+        last_space = np.isin(last, _SPACE_BYTES) & nonempty
+        digit_first = ((first - np.uint8(ord("0"))) < 10) & nonempty
+
+        accepted = np.zeros(len(starts), dtype=bool)
+        if self.n_cols:
+            commas = np.flatnonzero(buf == _COMMA)
+            n_fields = np.searchsorted(commas, content_ends) - np.searchsorted(commas, starts) + 1
+            candidates = np.flatnonzero(
+                digit_first & ~last_space & (n_fields == self.n_cols) & (lengths >= len(_DATE_TEMPLATE))
+            )
+            if len(candidates):
+                cand_starts = starts[candidates]
+                date_bytes = buf[cand_starts[:, None] + _DATE_OFFSETS]
+                ok = np.where(
+                    _DATE_DIGITS, (date_bytes - np.uint8(ord("0"))) < 10, date_bytes == _DATE_TEMPLATE
+                ).all(axis=1)
+                if self.n_cols > 1:
+                    ok &= buf[cand_starts + len(_DATE_TEMPLATE)] == _COMMA
+                else:
+                    ok &= lengths[candidates] == len(_DATE_TEMPLATE)
+                accepted[candidates[ok]] = True
+
+        # Lines the bulk path cannot decide: headers, protocol rows and rows
+        # that only become valid after strip().  Everything else is junk.
+        events = np.flatnonzero(
+            ~accepted & (np.isin(first, _PREFIX_BYTES) | first_space | (digit_first & last_space))
+        ).tolist()
+        nonempty_lines = np.flatnonzero(nonempty)
+
+        n_lines = len(starts)
+        pos = 0
+        k = 0
+        while True:
+            nxt = events[k] if k < len(events) else n_lines
+            if self.is_reading_protocol:
+                # Whatever comes next is the protocol row, even a data row
+                i = np.searchsorted(nonempty_lines, pos)
+                if i < len(nonempty_lines):
+                    nxt = min(nxt, int(nonempty_lines[i]))
+            if pos < nxt:
+                self._emit_runs(data, starts, line_ends, accepted, pos, nxt)
+            if nxt == n_lines:
+                break
+            if k < len(events) and events[k] == nxt:
+                k += 1
+            n_cols = self.n_cols
+            self._handle_line(data[starts[nxt]:line_ends[nxt]])
+            if self.n_cols != n_cols:
+                # The rows below the first header can only be classified now
+                rest = int(line_ends[nxt]) + 1
+                if rest < end:
+                    self._scan_block(data[rest:end], end - rest)
+                return
+            pos = nxt + 1
+
+    def _emit_runs(self, data, starts, line_ends, accepted, lo, hi):
+        """
+        Pass the accepted lines in [lo, hi) to the sink as contiguous runs.
+        """
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], accepted[lo:hi], [False])).view(np.int8)))
+        for run_start, run_end in zip(edges[::2] + lo, edges[1::2] + lo):
+            run = data[starts[run_start]:line_ends[run_end - 1] + 1]
+            if self.newline != b"\n":
+                run = run.replace(self.newline, b"\n")
+            elif b"\r" in run:
+                run = run.replace(b"\r\n", b"\n")
+            n_rows = int(run_end - run_start)
+            self.sink(run, n_rows, self.step_name)
+            self.row_count += n_rows
+
+    def _handle_line(self, line: bytes):
+        line = line.strip()
+        if not line:
+            return
+
+        if line.startswith(HEADER_PREFIXES):
+            row = line.split(b",")
+            if row[0] == b"Label":
+                self.is_reading_protocol = True
+            elif self.is_reading_protocol:
+                if len(row) > 2:
+                    self.step_name = self._decode(row[2])
+                self.is_reading_protocol = False
+
+            if len(row) == 2 and row[0] == b"%":
+                self.last_time_per_step_list.append(self.row_count - 1)
+            elif row[0] == b"$" and len(row) > 2:
+                loop = LOOP_PATTERN.match(row[2].strip())
+                if loop:
+                    self.loop_list.append([self.row_count, int(loop.group(1))])
+            elif row[0] == b"System Time" and not self.n_cols:
+                self.n_cols = len(row)
+
+        elif self.is_reading_protocol:
+            # The line after "Label" holds the step protocol
+            row = line.split(b",")
+            if len(row) > 2:
+                self.step_name = self._decode(row[2])
+            self.is_reading_protocol = False
+
+        elif line[:1].isdigit():
+            if line.count(b",") + 1 == self.n_cols and DATE_PATTERN.match(line.split(b",", 1)[0]):
+                self.sink(line + b"\n", 1, self.step_name)
+                self.row_count += 1
+
+
+def parse_origin_file(fpath: str, sink, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    Stream a tester file through OriginParser with a single binary open.
+    Excel workbooks (.xlsx) are read row by row as their text export.
+    """
+    parser = OriginParser(sink)
+    for chunk in iter_source_chunks(fpath, chunk_size):
+        parser.feed(chunk)
+    return parser, parser.finish()
+
+
+def iter_source_chunks(fpath: str, chunk_size: int = READ_CHUNK_SIZE):
+    """
+    The bytes of a tester file in chunks for OriginParser.feed(); Excel
+    workbooks (.xlsx) as their text export.
+    """
+    if is_excel(fpath):
+        yield from iter_excel_chunks(fpath, chunk_size)
+        return
+    with open(fpath, "rb") as f:
+        yield from iter(lambda: f.read(chunk_size), b"")
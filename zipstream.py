@@ -0,0 +1,181 @@
+"""
+Zip archives written as a stream.
+
+ZipStream yields the archive piece by piece while the entries are read, so
+nothing is staged on disk and the first bytes go out right away.  Entries
+are either deflated on the fly, with the CRC-32 and sizes in a data
+descriptor after the data, or copied from a gzip file: a gzip member is a
+raw deflate stream followed by the CRC-32 and size of the content, which is
+exactly what a deflate zip entry holds, so it is reused without
+recompressing.  Archives past 4 GB or 65535 entries get ZIP64 records.
+"""
+import os
+import struct
+import time
+import zlib
+
+READ_SIZE = 256 * 1024
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_DEFLATED = 8
+VERSION = 20  # 2.0: deflate, data descriptors
+VERSION_ZIP64 = 45
+FLAG_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+UNIX_FILE_ATTRIBUTES = (0o100644 << 16)
+
+
+def dos_time(timestamp):
+    """
+    (time, date) fields of a zip entry for a POSIX timestamp.
+    """
+    t = time.localtime(timestamp)
+    if t.tm_year < 1980:
+        return 0, (1 << 5) | 1
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def gzip_member(f):
+    """
+    (offset, length, crc, size) of the deflate data of the single-member
+    gzip file f.  size is the content size modulo 2**32, as the gzip
+    trailer stores it.
+    """
+    header = f.read(10)
+    if len(header) < 10 or header[:3] != b"\x1f\x8b\x08":
+        raise ValueError("not a gzip file")
+    flags = header[3]
+    if flags & 0x04:  # FEXTRA
+        f.seek(struct.unpack("<H", f.read(2))[0], os.SEEK_CUR)
+    for flag in (0x08, 0x10):  # FNAME, FCOMMENT: zero-terminated
+        if flags & flag:
+            while f.read(1) not in (b"\x00", b""):
+                pass
+    if flags & 0x02:  # FHCRC
+        f.seek(2, os.SEEK_CUR)
+    start = f.tell()
+    end = f.seek(-8, os.SEEK_END)
+    if end < start:
+        raise ValueError("truncated gzip file")
+    crc, size = struct.unpack("<II", f.read(8))
+    return start, end - start, crc, size
+
+
+class ZipStream:
+    """
+    Each add_*() generator yields the bytes of one entry; finish() returns
+    the central directory that closes the archive.
+    """
+
+    def __init__(self, level=6, read_size=READ_SIZE):
+        self.level = level
+        self.read_size = read_size
+        self.offset = 0
+        self._entries = []  # (name, flags, time, date, crc, compressed, size, offset)
+
+    def add_file(self, name, path):
+        """
+        Deflate the file at path into the entry name.
+        """
+        with open(path, "rb") as f:
+            mtime = os.fstat(f.fileno()).st_mtime
+            yield from self.add_chunks(name, iter(lambda: f.read(self.read_size), b""), mtime)
+
+    def add_chunks(self, name, chunks, mtime=None):
+        """
+        Deflate an iterable of bytes into the entry name.  Sizes are not
+        known up front, so the entry always carries ZIP64 sizes in its data
+        descriptor when it turns out larger than 4 GB.
+        """
+        dos = dos_time(time.time() if mtime is None else mtime)
+        offset = self.offset
+        yield self._emit(self._local_header(name, FLAG_DESCRIPTOR, dos, 0, 0, 0))
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        crc = size = compressed = 0
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data = compressor.compress(chunk)
+            if data:
+                compressed += len(data)
+                yield self._emit(data)
+        data = compressor.flush()
+        compressed += len(data)
+        if size >= ZIP64_LIMIT or compressed >= ZIP64_LIMIT:
+            descriptor = struct.pack("<4sIQQ", b"PK\x07\x08", crc, compressed, size)
+        else:
+            descriptor = struct.pack("<4sIII", b"PK\x07\x08", crc, compressed, size)
+        yield self._emit(data + descriptor)
+        self._entries.append((name, FLAG_DESCRIPTOR, dos, crc, compressed, size, offset))
+
+    def add_gzip(self, name, path):
+        """
+        Store the content of the gzip file at path as the entry name, reusing
+        its deflate data.  The file is opened before anything is yielded, so
+        a missing file raises without leaving a partial entry.
+        """
+        with open(path, "rb") as f:
+            mtime = os.fstat(f.fileno()).st_mtime
+            start, length, crc, size = gzip_member(f)
+            dos = dos_time(mtime)
+            offset = self.offset
+            yield self._emit(self._local_header(name, 0, dos, crc, length, size))
+            f.seek(start)
+            remaining = length
+            while remaining:
+                data = f.read(min(self.read_size, remaining))
+                if not data:
+                    raise ValueError(f"truncated gzip file: {path}")
+                remaining -= len(data)
+                yield self._emit(data)
+        self._entries.append((name, 0, dos, crc, length, size, offset))
+
+    def finish(self):
+        """
+        The central directory and end records.
+        """
+        start = self.offset
+        records = []
+        for name, flags, (dos_t, dos_d), crc, compressed, size, offset in self._entries:
+            encoded = name.encode("utf-8")
+            extra = _zip64_extra(size, compressed, offset)
+            records.append(struct.pack(
+                "<4sHHHHHHIIIHHHHHII", b"PK\x01\x02", (3 << 8) | VERSION_ZIP64,
+                VERSION_ZIP64 if extra else VERSION, flags | FLAG_UTF8, ZIP_DEFLATED, dos_t, dos_d, crc,
+                min(compressed, ZIP64_LIMIT), min(size, ZIP64_LIMIT), len(encoded), len(extra), 0, 0, 0,
+                UNIX_FILE_ATTRIBUTES, min(offset, ZIP64_LIMIT)) + encoded + extra)
+        directory = b"".join(records)
+        end = self.offset + len(directory)
+        count = len(self._entries)
+        tail = b""
+        if count >= 0xFFFF or start >= ZIP64_LIMIT or len(directory) >= ZIP64_LIMIT:
+            tail = struct.pack("<4sQHHIIQQQQ", b"PK\x06\x06", 44, (3 << 8) | VERSION_ZIP64, VERSION_ZIP64, 0, 0,
+                               count, count, len(directory), start)
+            tail += struct.pack("<4sIQI", b"PK\x06\x07", 0, end, 1)
+        tail += struct.pack("<4sHHHHIIH", b"PK\x05\x06", 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                            min(len(directory), ZIP64_LIMIT), min(start, ZIP64_LIMIT), 0)
+        return self._emit(directory + tail)
+
+    def _local_header(self, name, flags, dos, crc, compressed, size):
+        encoded = name.encode("utf-8")
+        extra = b""
+        if size >= ZIP64_LIMIT or compressed >= ZIP64_LIMIT:
+            extra = struct.pack("<HHQQ", 0x0001, 16, size, compressed)
+        return struct.pack(
+            "<4sHHHHHIIIHH", b"PK\x03\x04", VERSION_ZIP64 if extra else VERSION, flags | FLAG_UTF8, ZIP_DEFLATED,
+            dos[0], dos[1], crc, ZIP64_LIMIT if extra else compressed, ZIP64_LIMIT if extra else size,
+            len(encoded), len(extra)) + encoded + extra
+
+    def _emit(self, data):
+        self.offset += len(data)
+        return data
+
+
+def _zip64_extra(size, compressed, offset):
+    """
+    ZIP64 extended information for a central directory record: only the
+    fields that do not fit in 32 bits, in the order of the specification.
+    """
+    values = [value for value in (size, compressed, offset) if value >= ZIP64_LIMIT]
+    if not values:
+        return b""
+    return struct.pack(f"<HH{len(values)}Q", 0x0001, 8 * len(values), *values)